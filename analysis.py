@@ -1,14 +1,81 @@
 import os
-from openai import OpenAI
+import json
+import time
+import asyncio
+import threading
+from cache import get_cache, make_key
+from metrics import metrics
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
 MODEL = "gpt-4o"
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# "quotes": the model repeats every quote in full. "spans": sentences are
+# numbered and the model returns only their numbers under a strict schema,
+# which are turned back into quotes locally (see references.py).
+OUTPUT_MODE = os.environ.get("ANALYSIS_OUTPUT", "quotes")
+
+# Bump whenever the prompt or output format changes so cached results are not reused
+PROMPT_VERSION = "1" if OUTPUT_MODE != "spans" else "1-spans"
+
+# Deterministic mode pins temperature and seed so repeat analyses of the same
+# text can be served from the cache. Set ANALYSIS_DETERMINISTIC=0 to sample.
+DETERMINISTIC = os.environ.get("ANALYSIS_DETERMINISTIC", "1") != "0"
+TEMPERATURE = 0 if DETERMINISTIC else 0.7
+SEED = 42
+
+# The OpenAI client is built on first use, so importing this module (e.g. for
+# the code lists) doesn't pay for the openai package or need an API key
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        return _client
+
+SYSTEM_PROMPT = "You are an expert in analyzing special education responses. Always respond with valid JSON."
+
+# Analysis codes, in heatmap column order
+PREDETERMINED_CODES = [
+    "Academic Language Support",
+    "Grammar Support",
+    "Content Knowledge Support",
+    "Collaboration with Teachers",
+    "Student Engagement",
+    "Assessment of Language Proficiency"
+]
+
+EMERGENT_CODES = [
+    "Perceptions of Language Acquisition",
+    "Perceived Challenges",
+    "Innovative Practices",
+    "Perceptions of Error"
+]
+
+CODES = PREDETERMINED_CODES + EMERGENT_CODES
+
+# Result sections and their codes, in the order the prompt lists them
+SECTIONS = (("predetermined_codes", PREDETERMINED_CODES), ("emergent_codes", EMERGENT_CODES))
+
+NO_QUOTE = "No direct quote found"
+
+def make_async_client():
+    """Creates an async client; retries are handled by the analysis engine."""
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+
+def build_messages(text):
+    if OUTPUT_MODE == "spans":
+        from references import build_prompt
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": build_prompt(text)}
+        ]
 
-def analyze_response(text):
     prompt = f"""
     Analyze the following special education response text. For each category, find and extract EXACT quotes that demonstrate that concept.
 
@@ -43,27 +110,251 @@ def analyze_response(text):
     8. Preserve all original punctuation and formatting within the quotes
     """
 
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def completion_options():
+    options = {
+        "model": MODEL,
+        "response_format": {"type": "json_object"},
+        "temperature": TEMPERATURE
+    }
+    if OUTPUT_MODE == "spans":
+        from references import response_format
+        options["response_format"] = response_format()
+    if DETERMINISTIC:
+        options["seed"] = SEED
+    return options
+
+def decode_reply(text, content):
+    """Parses the model's reply to text into an analysis result."""
+    result = json.loads(content)
+    if OUTPUT_MODE == "spans" and isinstance(result, dict):
+        from references import rehydrate_result
+        result = rehydrate_result(result, text)
+    return result
+
+def cache_key(text):
+    return make_key(MODEL, PROMPT_VERSION, TEMPERATURE, text)
+
+def cached_result(text, record=True):
+    """Returns a cached analysis for this text, or None. Only deterministic runs are cached.
+
+    record=False leaves the lookup out of the cache hit/miss metrics, e.g. for prefetches.
+    """
+    cache = get_cache()
+    if cache is None or not DETERMINISTIC:
+        return None
     try:
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": "You are an expert in analyzing special education responses. Always respond with valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.7
-        )
-        
-        # Parse the JSON response
-        import json
-        result = json.loads(response.choices[0].message.content)
+        result = cache.get(cache_key(text))
+        if record:
+            metrics.record_cache(result is not None)
         return result
     except Exception as e:
-        return {
-            "predetermined_codes": {
-                "error": f"Analysis failed: {str(e)}"
-            },
-            "emergent_codes": {
-                "error": f"Analysis failed: {str(e)}"
-            }
+        print(f"Analysis cache read failed: {str(e)}")
+        return None
+
+def store_result(text, result):
+    cache = get_cache()
+    if cache is None or not DETERMINISTIC:
+        return
+    try:
+        cache.put(cache_key(text), result)
+    except Exception as e:
+        print(f"Analysis cache write failed: {str(e)}")
+
+def error_result(e):
+    return {
+        "predetermined_codes": {
+            "error": f"Analysis failed: {str(e)}"
+        },
+        "emergent_codes": {
+            "error": f"Analysis failed: {str(e)}"
         }
+    }
+
+def analyze_response(text):
+    """Analyzes one text through the process-wide scheduler."""
+    from scheduler import get_scheduler
+    return get_scheduler().submit(text).result()
+
+def section_of(code):
+    return 'predetermined_codes' if code in PREDETERMINED_CODES else 'emergent_codes'
+
+def _closing_bracket(content, start):
+    """Index of the ']' closing the array opened at content[start], or -1 if it hasn't arrived."""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(content)):
+        ch = content[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '[':
+            depth += 1
+        elif ch == ']':
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+def completed_codes(content, found=None):
+    """Parses the quote lists that have fully arrived in a partial JSON reply.
+
+    Returns {code: quotes}; codes already in `found` are not parsed again.
+    """
+    found = dict(found or {})
+    for code in CODES:
+        if code in found:
+            continue
+        key = content.find(json.dumps(code))
+        if key == -1:
+            continue
+        start = content.find('[', key)
+        if start == -1:
+            continue
+        end = _closing_bracket(content, start)
+        if end == -1:
+            continue
+        try:
+            quotes = json.loads(content[start:end + 1])
+        except ValueError:
+            continue
+        if isinstance(quotes, list):
+            found[code] = quotes
+    return found
+
+def partial_result(found):
+    """Arranges {code: quotes} into the usual result structure."""
+    result = {'predetermined_codes': {}, 'emergent_codes': {}}
+    for code, quotes in found.items():
+        result[section_of(code)][code] = quotes
+    return result
+
+def analyze_response_stream(text):
+    """Yields progressively more complete analyses while the reply streams in.
+
+    Each partial result holds only the codes whose quote lists have fully
+    arrived; the last result yielded is the complete analysis (or an error).
+    """
+    cached = cached_result(text)
+    if cached is not None:
+        yield cached
+        return
+
+    # Streamed calls are admitted by the shared scheduler like any other
+    from scheduler import get_scheduler
+    reservation = get_scheduler().reserve(text)
+    if reservation.shared is not None:
+        # The same text is already being analyzed; wait for that result
+        yield reservation.shared.result()
+        return
+    if not reservation.wait():
+        # The scheduler couldn't start; the job already holds the error
+        yield reservation.job.future.result()
+        return
+
+    start = time.perf_counter()
+    usage = None
+    try:
+        # Retries go through the scheduler, so a 429 pauses every call, not just this one
+        stream = get_client().with_options(max_retries=0).chat.completions.create(
+            messages=build_messages(text),
+            stream=True,
+            stream_options={"include_usage": True},
+            **completion_options()
+        )
+        content = ""
+        found = {}
+        for chunk in stream:
+            # Usage arrives on a final chunk without choices
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            delta = chunk.choices[0].delta.content
+            content += delta
+            # A code's list can only have completed in a delta that closes an array
+            if ']' not in delta:
+                continue
+            newly_found = completed_codes(content, found)
+            if len(newly_found) > len(found):
+                found = newly_found
+                if OUTPUT_MODE == "spans":
+                    from references import number_sentences, rehydrate
+                    yield partial_result(rehydrate(found, number_sentences(text)[1]))
+                else:
+                    yield partial_result(found)
+
+        result = decode_reply(text, content)
+        metrics.record_call(time.perf_counter() - start, usage)
+        store_result(text, result)
+    except GeneratorExit:
+        # Dropped mid-stream, e.g. by a Streamlit rerun
+        reservation.abandon()
+        raise
+    except Exception as e:
+        metrics.record_call(time.perf_counter() - start, usage, error=e)
+        if reservation.retry(e):
+            # Backed off with the scheduler's other calls and retried without streaming
+            metrics.flush()
+            yield reservation.job.future.result()
+            return
+        result = error_result(e)
+    reservation.finish(result)
+    metrics.flush()
+    yield result
+
+async def request_analysis_async(async_client, text):
+    """Runs one analysis on the async client. API errors are raised to the caller.
+
+    The cache is not consulted; the scheduler already did when the call was
+    submitted. The result is stored from a worker thread so the SQLite write
+    doesn't hold up the event loop.
+    """
+    start = time.perf_counter()
+    response = None
+    try:
+        response = await async_client.chat.completions.create(
+            messages=build_messages(text),
+            **completion_options()
+        )
+        result = decode_reply(text, response.choices[0].message.content)
+    except Exception as e:
+        metrics.record_call(time.perf_counter() - start, getattr(response, "usage", None), error=e)
+        raise
+    metrics.record_call(time.perf_counter() - start, response.usage)
+    await asyncio.to_thread(store_result, text, result)
+    return result
+
+def parse_completion(content, text):
+    """Parses a model reply to text into an analysis result, falling back to an error result."""
+    try:
+        result = decode_reply(text, content)
+        if not isinstance(result, dict):
+            raise ValueError(f"expected a JSON object, got {type(result).__name__}")
+        return result
+    except Exception as e:
+        return error_result(e)
+
+def count_quotes(analysis_results):
+    """Returns the number of quotes found for each code, in CODES order."""
+    counts = []
+    for j, code in enumerate(CODES):
+        section = 'predetermined_codes' if j < len(PREDETERMINED_CODES) else 'emergent_codes'
+        try:
+            quotes = analysis_results.get(section, {}).get(code, [NO_QUOTE])
+            counts.append(len([q for q in quotes if q != NO_QUOTE]))
+        except Exception as e:
+            print(f"Error processing code {code}: {str(e)}")
+            counts.append(0)
+    return counts
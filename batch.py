@@ -0,0 +1,173 @@
+import io
+import os
+import json
+import time
+import argparse
+import numpy as np
+from openai import OpenAI
+from analysis import (
+    CODES, build_messages, completion_options, cache_key, cached_result,
+    store_result, parse_completion, error_result, count_quotes
+)
+from verify import verify_result
+
+# Bulk cohort analysis through the OpenAI Batch API. Every student prompt is
+# written to a JSONL job file, submitted as one batch and polled until done.
+# A checkpoint file records the submitted batch so an interrupted run picks
+# the same job back up instead of paying for it twice.
+
+DEFAULT_CHECKPOINT = "batch_checkpoint.json"
+POLL_INTERVAL = 30
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def build_job_lines(documents):
+    """One Batch API request per unique document, keyed by its cache key."""
+    lines = {}
+    for document in documents:
+        key = cache_key(document)
+        if key in lines:
+            continue
+        lines[key] = json.dumps({
+            "custom_id": key,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"messages": build_messages(document), **completion_options()}
+        })
+    return lines
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(path, checkpoint):
+    # Write then rename so a crash never leaves a half-written checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def submit_batch(client, job_lines):
+    job_file = io.BytesIO(("\n".join(job_lines) + "\n").encode("utf-8"))
+    job_file.name = "analysis_batch.jsonl"
+    uploaded = client.files.create(file=job_file, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    return batch
+
+def ingest_output(client, file_id, documents):
+    """Downloads a batch output file and returns {custom_id: result}.
+
+    documents maps each custom_id (cache key) to the text it analyzed.
+    """
+    results = {}
+    content = client.files.content(file_id).text
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            results[record["custom_id"]] = error_result(record.get("error") or f"status {response.get('status_code')}")
+            continue
+        results[record["custom_id"]] = parse_completion(
+            response["body"]["choices"][0]["message"]["content"], documents.get(record["custom_id"], "")
+        )
+    return results
+
+def run_batch(corpus, checkpoint_path=DEFAULT_CHECKPOINT, poll_interval=POLL_INTERVAL, client=None, on_status=None):
+    """Analyzes the whole corpus through one batch job.
+
+    Returns (matrix, results) where matrix has one row per student in
+    corpus order and one column per code, as generate_heatmap builds it.
+    Students whose text is already cached are not resubmitted.
+    """
+    client = client or OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    keys = {student: cache_key(corpus.document(student)) for student in corpus.students}
+    documents = {keys[student]: corpus.document(student) for student in corpus.students}
+
+    results = {}
+    pending = []
+    for key, document in documents.items():
+        cached = cached_result(document)
+        if cached is not None:
+            results[key] = cached
+        else:
+            pending.append(document)
+
+    job_lines = build_job_lines(pending)
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint is not None and set(checkpoint["keys"]) != set(job_lines):
+        print(f"Checkpoint {checkpoint_path} is for a different job, starting a new batch")
+        checkpoint = None
+
+    if job_lines:
+        if checkpoint is None:
+            batch = submit_batch(client, job_lines.values())
+            checkpoint = {"batch_id": batch.id, "keys": sorted(job_lines), "status": batch.status}
+            save_checkpoint(checkpoint_path, checkpoint)
+            print(f"Submitted batch {batch.id} with {len(job_lines)} requests")
+        else:
+            print(f"Resuming batch {checkpoint['batch_id']}")
+
+        while True:
+            batch = client.batches.retrieve(checkpoint["batch_id"])
+            if batch.status != checkpoint["status"]:
+                checkpoint["status"] = batch.status
+                save_checkpoint(checkpoint_path, checkpoint)
+            if on_status is not None:
+                on_status(batch)
+            if batch.status in TERMINAL_STATUSES:
+                break
+            time.sleep(poll_interval)
+
+        if batch.output_file_id:
+            for key, result in ingest_output(client, batch.output_file_id, documents).items():
+                if key in documents and "error" not in result.get("predetermined_codes", {}):
+                    store_result(documents[key], result)
+                results[key] = result
+        if batch.status != "completed":
+            print(f"Batch {batch.id} ended with status {batch.status}")
+
+    matrix = np.zeros((len(corpus.students), len(CODES)))
+    student_results = {}
+    for i, student in enumerate(corpus.students):
+        result = results.get(keys[student], error_result("missing from batch output"))
+        result = verify_result(result, corpus.quote_index, students=[student])
+        student_results[student] = result
+        matrix[i] = count_quotes(result)
+
+    # The job is fully ingested into the cache, so the checkpoint is done
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return matrix, student_results
+
+if __name__ == "__main__":
+    from corpus import ResponseCorpus, ResponseDataError
+    from ingest import read_responses
+
+    parser = argparse.ArgumentParser(description="Analyze a cohort CSV through the OpenAI Batch API")
+    parser.add_argument("csv", help="Student responses CSV")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument("--output", default="batch_results.json", help="Where to write the per-student results")
+    args = parser.parse_args()
+
+    try:
+        corpus = ResponseCorpus(read_responses(args.csv))
+    except ResponseDataError as e:
+        parser.error(str(e))
+
+    matrix, student_results = run_batch(
+        corpus,
+        args.checkpoint,
+        args.poll_interval,
+        on_status=lambda batch: print(f"Batch {batch.id}: {batch.status}")
+    )
+    with open(args.output, "w") as f:
+        json.dump({"codes": CODES, "students": corpus.students, "matrix": matrix.tolist(), "results": student_results}, f)
+    print(f"Wrote results for {len(corpus)} students to {args.output}")
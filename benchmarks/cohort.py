@@ -0,0 +1,74 @@
+import os
+import csv
+import random
+import argparse
+
+# Synthetic cohorts shaped like Varied_PhD-Level_Responses.csv. Each answer
+# is recombined from one to three real answers to the same question, so the
+# text reads like the sample data but students rarely collide. A share of
+# students can copy another student's answers to exercise de-duplication.
+#
+#   python benchmarks/cohort.py 1000 -o cohort_1000.csv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, "Varied_PhD-Level_Responses.csv")
+
+FIRST_NAMES = [
+    "Maria", "Blaine", "Robert", "Jeff", "Daryll", "Brandon", "Aisha", "Chen", "Priya", "Diego",
+    "Fatima", "Kenji", "Olga", "Samuel", "Amara", "Luis", "Hannah", "Mateo", "Yusuf", "Grace",
+    "Ines", "Tomas", "Nadia", "Omar", "Leah", "Andrei", "Sofia", "Kwame", "Mei", "Elena"
+]
+LAST_NAMES = [
+    "Rodriguez", "Nguyen", "Patel", "Kim", "Okafor", "Schmidt", "Garcia", "Haddad", "Ivanova", "Mensah",
+    "Tanaka", "Silva", "Cohen", "Lopez", "Ahmed", "Novak", "Moreau", "Rossi", "Jensen", "Costa"
+]
+
+def read_source(path=SOURCE):
+    """Returns (header, {column: [answers]}) from a sample cohort."""
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    header = rows[0]
+    pools = {column: [row[i] for row in rows[1:] if row[i].strip()] for i, column in enumerate(header)}
+    return header, pools
+
+def student_names(count, rng):
+    names = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    rng.shuffle(names)
+    # Numbered once the name combinations run out
+    return [names[i % len(names)] + (f" {i // len(names) + 1}" if i >= len(names) else "") for i in range(count)]
+
+def make_answer(pool, rng):
+    parts = rng.sample(pool, k=min(len(pool), rng.choice([1, 1, 2, 3])))
+    return " ".join(part.strip() for part in parts)
+
+def generate_rows(count, seed=0, duplicate_rate=0.0, source=SOURCE):
+    """Yields the header and then `count` synthetic student rows."""
+    rng = random.Random(seed)
+    header, pools = read_source(source)
+    yield header
+    previous = []
+    for name in student_names(count, rng):
+        if previous and rng.random() < duplicate_rate:
+            answers = rng.choice(previous)
+        else:
+            answers = [make_answer(pools[column], rng) for column in header[1:]]
+            previous.append(answers)
+        yield [name] + answers
+
+def write_cohort(path, count, seed=0, duplicate_rate=0.0):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(generate_rows(count, seed, duplicate_rate))
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic student response cohort")
+    parser.add_argument("students", type=int, help="Number of students, e.g. 10 to 10000")
+    parser.add_argument("--output", "-o", default=None, help="CSV path (default cohort_<students>.csv)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="Share of students copying another's answers")
+    args = parser.parse_args()
+    path = write_cohort(args.output or f"cohort_{args.students}.csv", args.students, args.seed, args.duplicate_rate)
+    print(f"Wrote {args.students} students to {path}")
+
+if __name__ == "__main__":
+    main()
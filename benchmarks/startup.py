@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Cold-start measurement for the Streamlit app. Each run is a fresh
+# interpreter that renders main.py's login screen with Streamlit's AppTest
+# harness and reports how long the import and first render took, and which
+# heavy modules got loaded on the way. Exits non-zero if the login screen
+# pulls in any of HEAVY_MODULES or the median exceeds --budget.
+#
+#   python benchmarks/startup.py --runs 5 --budget 3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["pandas", "numpy", "matplotlib", "seaborn", "openai"]
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import streamlit
+from streamlit.testing.v1 import AppTest
+ready = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=60)
+at.run()
+done = time.perf_counter()
+print(json.dumps({
+    "streamlit_seconds": ready - start,
+    "login_seconds": done - ready,
+    "exception": [str(e.value) for e in at.exception],
+    "heavy_loaded": [m for m in sys.argv[2:] if m in sys.modules]
+}))
+"""
+
+def measure_once():
+    env = dict(os.environ)
+    # The login screen must not need an API key
+    env.pop("OPENAI_API_KEY", None)
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, os.path.join(ROOT, "main.py"), *HEAVY_MODULES],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the app's cold start to the login screen")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=None, help="Fail if the median login render takes longer (seconds)")
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    login = statistics.median(run["login_seconds"] for run in runs)
+    base = statistics.median(run["streamlit_seconds"] for run in runs)
+    heavy = sorted({m for run in runs for m in run["heavy_loaded"]})
+    errors = [e for run in runs for e in run["exception"]]
+
+    print(f"import streamlit: {base:.3f}s median over {args.runs} runs")
+    print(f"login screen:     {login:.3f}s median (main.py import and first render)")
+    print(f"heavy modules loaded: {', '.join(heavy) or 'none'}")
+
+    failed = False
+    if errors:
+        print(f"login screen raised: {errors[0]}")
+        failed = True
+    if heavy:
+        print("regression: the login screen should not import " + ", ".join(heavy))
+        failed = True
+    if args.budget is not None and login > args.budget:
+        print(f"regression: login screen took {login:.3f}s, budget is {args.budget:.3f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import io
+import os
+import gc
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import tracemalloc
+
+# Benchmarks for load_data, analyze_response and generate_heatmap against the
+# local mock server, on synthetic cohorts of each requested size. Reports
+# wall-clock, model calls per second and the process's peak RSS after each
+# benchmark. --trace-memory also reports each benchmark's own peak Python
+# allocations, at the cost of much slower timings. --json saves a run and
+# --compare prints the change against a saved one.
+#
+#   python benchmarks/suite.py --sizes 10 100 1000 --latency 0.2 --rate-limit 0.05 --json before.json
+#   python benchmarks/suite.py --sizes 10 100 1000 --latency 0.2 --rate-limit 0.05 --compare before.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(name, students, fn, server_state, trace_memory=False):
+    """Runs fn once and returns its timings, model calls and memory."""
+    gc.collect()
+    before = server_state.snapshot()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    traced = None
+    if trace_memory:
+        traced = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        tracemalloc.stop()
+    after = server_state.snapshot()
+    calls = after["chat_requests"] - before["chat_requests"]
+    return {
+        "benchmark": name,
+        "students": students,
+        "seconds": round(seconds, 4),
+        "calls": calls,
+        "calls_per_sec": round(calls / seconds, 2) if seconds else 0.0,
+        "rate_limited": after["rate_limited"] - before["rate_limited"],
+        "completion_tokens": after["completion_tokens"] - before["completion_tokens"],
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "traced_peak_mb": traced
+    }
+
+def print_table(rows, baseline=None):
+    previous = {(row["benchmark"], row["students"]): row for row in baseline or []}
+    header = f"{'benchmark':<18}{'students':>9}{'seconds':>10}{'calls':>8}{'calls/s':>9}{'429s':>6}{'out tok':>9}{'RSS MB':>9}{'traced MB':>11}"
+    if baseline is not None:
+        header += f"{'vs base':>9}"
+    print(header)
+    for row in rows:
+        line = (
+            f"{row['benchmark']:<18}{row['students']:>9}{row['seconds']:>10.3f}{row['calls']:>8}"
+            f"{row['calls_per_sec']:>9.1f}{row['rate_limited']:>6}{row.get('completion_tokens', '-'):>9}{row['peak_rss_mb']:>9.1f}"
+            f"{'-' if row['traced_peak_mb'] is None else row['traced_peak_mb']:>11}"
+        )
+        base = previous.get((row["benchmark"], row["students"]))
+        if baseline is not None:
+            line += f"{row['seconds'] / base['seconds']:>8.2f}x" if base and base["seconds"] else f"{'-':>9}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app against the local mock model server")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Cohort sizes (students)")
+    parser.add_argument("--samples", type=int, default=20, help="Sequential analyze_response calls per size")
+    parser.add_argument("--concurrency", type=int, default=None, help="Heatmap concurrency (default ANALYSIS_CONCURRENCY)")
+    parser.add_argument("--no-dedup", action="store_true", help="Analyze near-duplicate students separately")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="Share of synthetic students copying another")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock seconds per chat completion")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Mock extra seconds per completion token")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of calls answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--skip", nargs="*", default=[], choices=["load_data", "analyze_response", "generate_heatmap"])
+    parser.add_argument("--trace-memory", action="store_true", help="Trace each benchmark's peak allocations (slow)")
+    parser.add_argument("--json", default=None, help="Save results to this file")
+    parser.add_argument("--compare", default=None, help="Compare against results saved with --json")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="esol-bench-")
+    # Caches would turn repeat runs into no-ops, so every run starts cold
+    os.environ["ANALYSIS_CACHE"] = "0"
+    os.environ["HEATMAP_ROWS_PATH"] = os.path.join(workdir, "rows.sqlite")
+    # Synthetic cohorts stay out of the app's Trends tab
+    os.environ["ANALYSIS_VECTORS_PATH"] = os.path.join(workdir, "code_vectors")
+    # Measure the app, not the account limits, unless they are set explicitly
+    os.environ.setdefault("ANALYSIS_RPM", "0")
+    os.environ.setdefault("ANALYSIS_TPM", "0")
+
+    from mock_server import start_server
+    server, base_url = start_server(
+        latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit, retry_after=args.retry_after, seed=0,
+        token_latency=args.token_latency
+    )
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    state = server.RequestHandlerClass.state
+
+    import memo
+    from cohort import write_cohort
+    from corpus import ResponseCorpus
+    from analysis import analyze_response
+    from engine import DEFAULT_CONCURRENCY
+    from main import load_data, generate_heatmap
+
+    # Pay for imports and client setup up front, not in the first benchmark
+    import pandas, seaborn, matplotlib.pyplot
+    from analysis import get_client
+    get_client()
+
+    concurrency = args.concurrency or DEFAULT_CONCURRENCY
+    rows = []
+    for size in args.sizes:
+        # A different seed per size keeps cohorts from sharing students
+        path = write_cohort(os.path.join(workdir, f"cohort_{size}.csv"), size, seed=size, duplicate_rate=args.duplicate_rate)
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if "load_data" not in args.skip:
+            rows.append(measure("load_data", size, lambda: load_data(io.BytesIO(data)), state, args.trace_memory))
+        corpus = ResponseCorpus(load_data(io.BytesIO(data)), fingerprint=memo.fingerprint(data))
+
+        if "analyze_response" not in args.skip:
+            documents = [corpus.document(student) for student in corpus.students[:args.samples]]
+            rows.append(measure(
+                "analyze_response", size, lambda: [analyze_response(d) for d in documents], state, args.trace_memory
+            ))
+
+        if "generate_heatmap" not in args.skip:
+            memo.results.clear()
+            rows.append(measure(
+                "generate_heatmap", size,
+                lambda: generate_heatmap(corpus, max_concurrency=concurrency, dedup=not args.no_dedup),
+                state, args.trace_memory
+            ))
+        print_table(rows[-3:])
+
+    server.shutdown()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print()
+    from analysis import OUTPUT_MODE
+    print(
+        f"latency {args.latency}s (+{args.token_latency}s/token), jitter {args.jitter}, 429 rate {args.rate_limit}, "
+        f"concurrency {concurrency}, output {OUTPUT_MODE}"
+    )
+    print_table(rows, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"options": vars(args), "results": rows}, f, indent=2)
+        print(f"Saved results to {args.json}")
+
+if __name__ == "__main__":
+    main()
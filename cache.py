@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+CACHE_PATH = os.environ.get("ANALYSIS_CACHE_PATH", "analysis_cache.sqlite")
+# Eviction limits: least recently used entries go first once MAX_ENTRIES is
+# exceeded, and anything older than MAX_AGE_DAYS is dropped.
+MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "50000"))
+MAX_AGE_DAYS = float(os.environ.get("ANALYSIS_CACHE_MAX_AGE_DAYS", "90"))
+# How many writes happen between eviction passes
+EVICT_EVERY = 200
+
+def make_key(*parts):
+    """Content address for an analysis: hash of everything that shapes the output."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class AnalysisCache:
+    """On-disk SQLite cache of analysis results keyed by content hash."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, max_age_days=MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analyses ("
+                "key TEXT PRIMARY KEY, result TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS analyses_accessed ON analyses (accessed)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT result, created FROM analyses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.max_age:
+                conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE analyses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, result, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result), now, now)
+            )
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM analyses WHERE created < ?", (time.time() - self.max_age,))
+            conn.execute(
+                "DELETE FROM analyses WHERE key IN ("
+                "SELECT key FROM analyses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM analyses")
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Returns the process-wide cache, or None when caching is disabled."""
+    global _cache
+    if os.environ.get("ANALYSIS_CACHE", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnalysisCache()
+        return _cache
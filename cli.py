@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import glob
+import argparse
+import pandas as pd
+from analysis import CODES, count_quotes
+from corpus import ResponseCorpus, ResponseDataError
+from ingest import iter_response_frames
+from engine import analyze_many, DEFAULT_CONCURRENCY
+from verify import verify_result
+from dedup import Cluster, cluster_students, remap_result
+from metrics import metrics
+
+# Headless analysis of one or more response CSVs. Files are read in chunks
+# and every student's result is written out as soon as it arrives, so memory
+# stays flat however large the input is. With --resume, students already in
+# the output are skipped.
+#
+#   python cli.py responses.csv more.csv --output results.jsonl --resume
+#   python cli.py responses.csv --output results_parquet/
+
+DEFAULT_CHUNKSIZE = 500
+
+def make_record(source, student, result):
+    return {
+        "source": source,
+        "student": student,
+        "counts": count_quotes(result),
+        "predetermined_codes": result.get("predetermined_codes", {}),
+        "emergent_codes": result.get("emergent_codes", {}),
+        "quote_spans": result.get("quote_spans", {}),
+        "unverified_quotes": result.get("unverified_quotes", {})
+    }
+
+def is_failed(record):
+    return "error" in record["predetermined_codes"]
+
+class JsonlWriter:
+    """Appends one JSON line per student, flushed immediately."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def done_keys(self):
+        keys = set()
+        if not os.path.exists(self.path):
+            return keys
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run killed mid-write can leave a partial last line
+                    continue
+                if not is_failed(record):
+                    keys.add((record["source"], record["student"]))
+        return keys
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write(self, record):
+        if self._file is None:
+            self._file = open(self.path, "a")
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def end_chunk(self):
+        pass
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+class ParquetWriter:
+    """Writes one Parquet part file per input chunk into a directory."""
+
+    def __init__(self, path):
+        self.path = path
+        self._rows = []
+        os.makedirs(path, exist_ok=True)
+        self._part = len(glob.glob(os.path.join(path, "part-*.parquet")))
+
+    def done_keys(self):
+        keys = set()
+        for part in sorted(glob.glob(os.path.join(self.path, "part-*.parquet"))):
+            df = pd.read_parquet(part, columns=["source", "student", "failed"])
+            df = df[~df["failed"]]
+            keys.update(zip(df["source"], df["student"]))
+        return keys
+
+    def reset(self):
+        for part in glob.glob(os.path.join(self.path, "part-*.parquet")):
+            os.remove(part)
+        self._part = 0
+
+    def write(self, record):
+        self._rows.append({
+            "source": record["source"],
+            "student": record["student"],
+            "failed": is_failed(record),
+            **dict(zip(CODES, record["counts"])),
+            "result": json.dumps({k: record[k] for k in ("predetermined_codes", "emergent_codes", "quote_spans", "unverified_quotes")})
+        })
+
+    def end_chunk(self):
+        if not self._rows:
+            return
+        part_path = os.path.join(self.path, f"part-{self._part:05d}.parquet")
+        pd.DataFrame(self._rows).to_parquet(f"{part_path}.tmp", index=False)
+        os.replace(f"{part_path}.tmp", part_path)
+        self._part += 1
+        self._rows = []
+
+    def close(self):
+        self.end_chunk()
+
+def make_writer(path):
+    if path.endswith(".jsonl") or path.endswith(".json"):
+        return JsonlWriter(path)
+    return ParquetWriter(path)
+
+def iter_corpora(path, chunksize=DEFAULT_CHUNKSIZE):
+    """Yields a ResponseCorpus per chunk of at most chunksize students, validating the file as it is read."""
+    for frame in iter_response_frames(path):
+        for start in range(0, len(frame), chunksize):
+            yield ResponseCorpus(frame.iloc[start:start + chunksize])
+
+def run(paths, writer, resume=False, chunksize=DEFAULT_CHUNKSIZE, max_concurrency=DEFAULT_CONCURRENCY, dedup=False):
+    done = writer.done_keys() if resume else set()
+    if done:
+        print(f"Resuming: {len(done)} students already analyzed")
+
+    analyzed = 0
+    failed = 0
+    for path in paths:
+        source = os.path.basename(path)
+        try:
+            for corpus in iter_corpora(path, chunksize):
+                students = [s for s in corpus.students if (source, s) not in done]
+                if not students:
+                    continue
+
+                clusters = cluster_students(corpus, students) if dedup else [Cluster(s) for s in students]
+
+                def write_record(student, result):
+                    nonlocal analyzed, failed
+                    record = make_record(source, student, result)
+                    writer.write(record)
+                    analyzed += 1
+                    if is_failed(record):
+                        failed += 1
+                    else:
+                        done.add((source, student))
+
+                def write_result(i, result):
+                    cluster = clusters[i]
+                    result = verify_result(result, corpus.quote_index, students=[cluster.representative])
+                    write_record(cluster.representative, result)
+                    for member in cluster.members:
+                        write_record(member, remap_result(result, corpus, member))
+
+                items = [(i, corpus.documents[cluster.representative]) for i, cluster in enumerate(clusters)]
+                analyze_many(items, max_concurrency=max_concurrency, on_result=write_result)
+                writer.end_chunk()
+                print(f"{source}: {analyzed} students analyzed, {failed} failed")
+        except ResponseDataError as e:
+            print(f"Skipping {path}: {str(e)}", file=sys.stderr)
+    writer.close()
+    return analyzed, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze student response CSVs without the Streamlit UI")
+    parser.add_argument("csv", nargs="+", help="One or more response CSV files")
+    parser.add_argument("--output", "-o", default="results.jsonl",
+                        help="A .jsonl file, or a directory for Parquet part files")
+    parser.add_argument("--resume", action="store_true", help="Skip students already in the output")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Students analyzed per chunk")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--dedup", action="store_true",
+                        help="Analyze near-duplicate students once and remap the quotes to each of them")
+    parser.add_argument("--metrics", default=None,
+                        help="Write call metrics here at the end (.json for JSON, otherwise Prometheus text)")
+    args = parser.parse_args(argv)
+
+    writer = make_writer(args.output)
+    if not args.resume:
+        writer.reset()
+
+    analyzed, failed = run(args.csv, writer, args.resume, args.chunksize, args.concurrency, args.dedup)
+    print(f"Done: {analyzed} students analyzed, {failed} failed, results in {args.output}")
+    if args.metrics:
+        metrics.write(args.metrics)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
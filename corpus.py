@@ -0,0 +1,198 @@
+import re
+import unicodedata
+
+STUDENT_COLUMN = 'Student'
+
+# Question columns and the section label each one gets in the prompt text
+QUESTION_COLUMNS = [
+    'What student information do you need to plan the lesson?',
+    'What information would you ask of the other fifth-grade teachers?',
+    'How would you ensure all students are engaged in the lesson?',
+    'How would you assess the assignment?',
+    "How would you assess students' understanding of each of the objectives?"
+]
+
+QUESTION_LABELS = [
+    'Student Information Needed',
+    'Information from Other Teachers',
+    'Student Engagement',
+    'Assessment Approach',
+    'Objectives Assessment'
+]
+
+REQUIRED_COLUMNS = [STUDENT_COLUMN] + QUESTION_COLUMNS
+
+# Headers, after normalization, taken to mean the student column
+STUDENT_ALIASES = {'student', 'students', 'name', 'student name', 'name of student', 'learner'}
+# Share of a question's words a header must contain to be mapped to it
+MIN_QUESTION_RECALL = 0.8
+
+HEADER_TRANSLATE = str.maketrans({
+    "‘": "'", "’": "'", "‚": "'", "′": "'", "`": "'",
+    "“": '"', "”": '"', "„": '"', "″": '"',
+    "–": "-", "—": "-", "‐": "-"
+})
+# "1.", "2)", "a." and similar numbering in front of a question
+HEADER_NUMBERING = re.compile(r"^\s*(?:\d+|[a-z])[.)]\s+", re.IGNORECASE)
+
+class ResponseDataError(ValueError):
+    """Raised when uploaded response data does not have the expected shape."""
+
+def fix_mojibake(text):
+    """Undoes UTF-8 text that was decoded as Windows-1252 or Mac Roman ("studentsâ€™", "students‚Äô")."""
+    if text.isascii():
+        return text
+    for encoding in ("cp1252", "mac_roman"):
+        try:
+            return text.encode(encoding).decode("utf-8")
+        except UnicodeError:
+            continue
+    return text
+
+def normalize_header(header):
+    """Comparable form of a column header.
+
+    Drops a byte-order mark, fixes mojibake, straightens curly quotes, keeps
+    only the first line of multi-line headers, removes leading numbering and
+    folds case and whitespace.
+    """
+    text = fix_mojibake(str(header).lstrip("\ufeff"))
+    text = unicodedata.normalize("NFKC", text).translate(HEADER_TRANSLATE)
+    text = text.strip().split("\n")[0]
+    text = HEADER_NUMBERING.sub("", text)
+    return " ".join(text.split()).casefold().rstrip(" :")
+
+def header_words(text):
+    return set(re.findall(r"[a-z0-9]+", text.replace("'", "")))
+
+QUESTION_WORDS = [header_words(normalize_header(question)) for question in QUESTION_COLUMNS]
+
+def map_columns(headers):
+    """Maps uploaded headers to REQUIRED_COLUMNS; returns {header: column}.
+
+    Exact matches after normalization win. Remaining questions go to the
+    header containing the largest share of their words (at least
+    MIN_QUESTION_RECALL), so reworded headers such as "How would you ensure
+    all students, regardless of their proficiency level, are engaged in the
+    lesson?" still map. Each header and column is used at most once.
+    """
+    normalized = {header: normalize_header(header) for header in headers}
+    exact = {normalize_header(column): column for column in REQUIRED_COLUMNS}
+    mapping = {}
+    used = set()
+    for header, text in normalized.items():
+        column = STUDENT_COLUMN if text in STUDENT_ALIASES else exact.get(text)
+        if column is not None and column not in used:
+            mapping[header] = column
+            used.add(column)
+
+    candidates = []
+    for header, text in normalized.items():
+        if header in mapping:
+            continue
+        words = header_words(text)
+        for column, question_words in zip(QUESTION_COLUMNS, QUESTION_WORDS):
+            if column in used or not words:
+                continue
+            shared = len(words & question_words)
+            recall = shared / len(question_words)
+            if recall >= MIN_QUESTION_RECALL:
+                dice = 2 * shared / (len(words) + len(question_words))
+                candidates.append((recall, dice, header, column))
+    for recall, dice, header, column in sorted(candidates, key=lambda c: (c[0], c[1]), reverse=True):
+        if header not in mapping and column not in used:
+            mapping[header] = column
+            used.add(column)
+    return mapping
+
+def missing_columns(df):
+    return [col for col in REQUIRED_COLUMNS if col not in df.columns]
+
+def validate_responses(df):
+    """Maps headers onto the expected columns, drops empty rows and checks nothing is missing.
+
+    Raises ResponseDataError naming the missing columns.
+    """
+    mapping = map_columns(df.columns)
+    df = df[list(mapping)].rename(columns=mapping)
+
+    # Remove any completely empty rows
+    df = df.dropna(how='all')
+    
+    # Ensure all required columns exist
+    missing = missing_columns(df)
+    if missing:
+        raise ResponseDataError(f"Missing required columns: {', '.join(missing)}")
+    return df
+
+def render_document(student, answers):
+    """Formats one student's answers as the text sent to the model."""
+    sections = [f"Student: {student}"]
+    for label, answer in zip(QUESTION_LABELS, answers):
+        sections.append(f"{label}:\n{answer}")
+    return "\n\n".join(sections)
+
+class ResponseCorpus:
+    """Per-student answers and prompt documents, built once per uploaded file.
+
+    Lookups by student are dict hits, so reruns and student switches never
+    rescan the DataFrame.
+    """
+
+    def __init__(self, df, fingerprint=None):
+        # Content hash of the file the corpus was built from, if known
+        self.fingerprint = fingerprint
+        if hasattr(df, "column_names"):
+            # Arrow table from ingest.read_response_table, already one row per
+            # student; going through pandas keeps missing answers as NaN, as below
+            columns = [df.column(col).to_pandas().tolist() for col in REQUIRED_COLUMNS]
+        else:
+            rows = df.dropna(subset=[STUDENT_COLUMN]).drop_duplicates(subset=[STUDENT_COLUMN])
+            columns = [rows[STUDENT_COLUMN].tolist()] + [rows[col].tolist() for col in QUESTION_COLUMNS]
+        self.students = []
+        self.answers = {}
+        self.documents = {}
+        for student, *answers in zip(*columns):
+            self.students.append(student)
+            self.answers[student] = tuple(answers)
+            self.documents[student] = render_document(student, answers)
+        # Anything worth telling the user about how the file was read
+        self.ingest_notes = []
+        # File name the data was uploaded as, if known
+        self.source = None
+        self._all_students_document = None
+        self._quote_index = None
+
+    def __len__(self):
+        return len(self.students)
+
+    def memory_size(self):
+        """Approximate bytes held by the corpus, for cache accounting."""
+        text = sum(len(document) for document in self.documents.values())
+        # Answers and documents hold the text twice; the quote index adds a
+        # normalized copy plus four bytes of position map per character
+        size = 2 * text + 200 * len(self.students)
+        if self._quote_index is not None:
+            size += 5 * text
+        return size
+
+    def document(self, student):
+        return self.documents[student]
+
+    def items(self):
+        """(student, document) pairs in upload order."""
+        return [(student, self.documents[student]) for student in self.students]
+
+    @property
+    def quote_index(self):
+        """Index of the source answers for verifying model quotes, built on first use."""
+        if self._quote_index is None:
+            from verify import QuoteIndex
+            self._quote_index = QuoteIndex(self)
+        return self._quote_index
+
+    @property
+    def all_students_document(self):
+        if self._all_students_document is None:
+            self._all_students_document = "\n\n".join(self.documents[s] for s in self.students)
+        return self._all_students_document
@@ -0,0 +1,107 @@
+import zlib
+import numpy as np
+from analysis import NO_QUOTE, SECTIONS
+from verify import normalize, parse_quote, verify_result
+
+# Near-duplicate detection over students' answers with MinHash and LSH.
+# Students whose answers to every question are near-duplicates of a
+# representative's share that representative's analysis: the model is called
+# once per cluster and the verified quotes are remapped to each member.
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+# Minimum estimated Jaccard similarity, on every question, to join a cluster
+DEFAULT_THRESHOLD = 0.9
+
+_PRIME = (1 << 61) - 1
+_rng = np.random.default_rng(20241215)
+_A = _rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+
+def shingles(text):
+    words = normalize(text).split()
+    if len(words) < SHINGLE_WORDS:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def minhash(text):
+    """MinHash signature of an answer's word shingles."""
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.uint64)
+    # (a * x + b) mod p for every permutation and shingle, minimized per permutation
+    return ((np.outer(_A, hashes) + _B[:, None]) % _PRIME).min(axis=1)
+
+class Cluster:
+    def __init__(self, representative):
+        self.representative = representative
+        self.members = []
+
+    def __len__(self):
+        return 1 + len(self.members)
+
+def cluster_students(corpus, students=None, threshold=DEFAULT_THRESHOLD):
+    """Groups students whose answers are all near-duplicates of a representative.
+
+    Returns clusters in corpus order; each student is in exactly one.
+    """
+    students = corpus.students if students is None else students
+    if not students:
+        return []
+    # signatures[s, q] is the MinHash of student s's answer to question q
+    signatures = np.stack([
+        np.stack([minhash(answer) for answer in corpus.answers[student]]) for student in students
+    ])
+
+    # Each band spans every question, so students only collide when they are
+    # similar across all of their answers
+    buckets = {}
+    for s in range(len(students)):
+        for band in range(BANDS):
+            key = (band, signatures[s, :, band * ROWS:(band + 1) * ROWS].tobytes())
+            buckets.setdefault(key, []).append(s)
+
+    candidates = [set() for _ in students]
+    for members in buckets.values():
+        if len(members) > 1:
+            for s in members:
+                candidates[s].update(members)
+
+    assigned = np.zeros(len(students), dtype=bool)
+    clusters = []
+    for s in range(len(students)):
+        if assigned[s]:
+            continue
+        assigned[s] = True
+        cluster = Cluster(students[s])
+        others = sorted(c for c in candidates[s] if not assigned[c])
+        if others:
+            # Estimated Jaccard per question, against the representative
+            similarity = (signatures[others] == signatures[s]).mean(axis=2)
+            for c, sims in zip(others, similarity):
+                if sims.min() >= threshold:
+                    assigned[c] = True
+                    cluster.members.append(students[c])
+        clusters.append(cluster)
+    return clusters
+
+def remap_result(result, corpus, student):
+    """Re-attributes a representative's quotes to another cluster member.
+
+    Each quote is rewritten under the member's name and verified against the
+    member's own answers; quotes that don't occur there are dropped.
+    """
+    if not isinstance(result, dict) or "error" in result.get("predetermined_codes", {}):
+        return result
+    remapped = {}
+    for section, codes in SECTIONS:
+        remapped[section] = {}
+        for code in codes:
+            quotes = []
+            for entry in result.get(section, {}).get(code, []):
+                if entry == NO_QUOTE:
+                    continue
+                name, quote = parse_quote(entry)
+                quotes.append(f"{student}: '{quote}'")
+            remapped[section][code] = quotes or [NO_QUOTE]
+    return verify_result(remapped, corpus.quote_index, students=[student])
@@ -0,0 +1,47 @@
+import os
+import asyncio
+from metrics import metrics
+from scheduler import get_scheduler
+
+# Analyses one run keeps queued or in flight at once. Process-wide limits,
+# retries and 429 back-off are handled by the shared scheduler.
+DEFAULT_CONCURRENCY = int(os.environ.get("ANALYSIS_CONCURRENCY", "8"))
+
+class AnalysisEngine:
+    """Runs many analyses through the process-wide scheduler.
+
+    Only max_concurrency of a run's analyses are submitted at a time, so one
+    large run doesn't fill the scheduler's queue ahead of everything else
+    its session asks for.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_CONCURRENCY, session=None):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.session = session
+
+    async def _analyze(self, scheduler, semaphore, key, text):
+        async with semaphore:
+            return key, await asyncio.wrap_future(scheduler.submit(text, self.session))
+
+    async def run(self, items, on_result=None):
+        """Analyzes (key, text) pairs and returns {key: result}.
+
+        `on_result(key, result)` is called as each analysis arrives.
+        """
+        scheduler = get_scheduler()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = {}
+        tasks = [asyncio.create_task(self._analyze(scheduler, semaphore, key, text)) for key, text in items]
+        for task in asyncio.as_completed(tasks):
+            key, result = await task
+            results[key] = result
+            if on_result is not None:
+                on_result(key, result)
+        return results
+
+def analyze_many(items, max_concurrency=DEFAULT_CONCURRENCY, on_result=None):
+    """Synchronous entry point for scripts and Streamlit callbacks."""
+    try:
+        return asyncio.run(AnalysisEngine(max_concurrency).run(items, on_result))
+    finally:
+        metrics.flush(force=True)
@@ -0,0 +1,205 @@
+import os
+import csv
+import glob
+import time
+import uuid
+import argparse
+from analysis import NO_QUOTE, SECTIONS
+from engine import analyze_many, DEFAULT_CONCURRENCY
+from verify import verify_result, parse_quote
+
+# Cohort-wide export of coded quotes in long format: one row per
+# (student, type, code, quote). Students are analyzed and written a chunk
+# at a time, so only one chunk's rows are ever held in memory; analyses
+# already in the cache are reused without a model call.
+#
+#   python export.py responses.csv --output quotes.parquet
+
+COLUMNS = ["student", "type", "code", "quote"]
+# Students analyzed and written per chunk
+CHUNK_STUDENTS = int(os.environ.get("EXPORT_CHUNK_STUDENTS", "50"))
+# Where the app writes finished exports for downloading
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "exports")
+# Export files are deleted after this long
+EXPORT_MAX_AGE_HOURS = 24
+
+SECTION_TYPES = {"predetermined_codes": "Predetermined", "emergent_codes": "Emergent"}
+
+# format -> (file extension, MIME type)
+FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+    "Excel": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+}
+
+def result_rows(student, result):
+    """Long-format rows for one analysis; a failed analysis gives one Error row.
+
+    With student=None each row takes the student named in its quote, as in
+    an All Students analysis.
+    """
+    if not isinstance(result, dict) or "error" in result.get("predetermined_codes", {}):
+        error = result["predetermined_codes"]["error"] if isinstance(result, dict) else str(result)
+        return [(student or "", "Error", "", error)]
+    rows = []
+    for section, codes in SECTIONS:
+        for code in codes:
+            for entry in result.get(section, {}).get(code, []):
+                if entry == NO_QUOTE:
+                    continue
+                name, quote = parse_quote(entry)
+                rows.append((student or name or "", SECTION_TYPES[section], code, quote))
+    return rows
+
+def iter_row_chunks(corpus, max_concurrency=DEFAULT_CONCURRENCY, dedup=True,
+                    chunk_students=CHUNK_STUDENTS, on_progress=None):
+    """Yields lists of export rows, one list per chunk of students.
+
+    Only quotes verified against the student's own answers are exported.
+    `on_progress(done, total)` is called with students written so far.
+    """
+    from dedup import Cluster, cluster_students, remap_result
+
+    clusters = cluster_students(corpus) if dedup else [Cluster(student) for student in corpus.students]
+    total = len(corpus.students)
+    done = 0
+    chunk = []
+    chunk_size = 0
+    for i, cluster in enumerate(clusters):
+        chunk.append(cluster)
+        chunk_size += len(cluster)
+        if chunk_size < chunk_students and i < len(clusters) - 1:
+            continue
+        results = analyze_many(
+            [(j, corpus.documents[c.representative]) for j, c in enumerate(chunk)], max_concurrency=max_concurrency
+        )
+        rows = []
+        for j, c in enumerate(chunk):
+            verified = verify_result(results[j], corpus.quote_index, students=[c.representative])
+            rows.extend(result_rows(c.representative, verified))
+            for member in c.members:
+                rows.extend(result_rows(member, remap_result(verified, corpus, member)))
+            done += len(c)
+        chunk = []
+        chunk_size = 0
+        if on_progress is not None:
+            on_progress(done, total)
+        yield rows
+
+class CsvExport:
+    def __init__(self, path):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+class ParquetExport:
+    """One row group per chunk."""
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self._schema = pa.schema([(column, pa.string()) for column in COLUMNS])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows):
+        if rows:
+            columns = [self._pa.array(values, type=self._pa.string()) for values in zip(*rows)]
+            self._writer.write_table(self._pa.Table.from_arrays(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+class ExcelExport:
+    """Write-only workbook: openpyxl spools rows to disk instead of keeping cells in memory."""
+
+    def __init__(self, path):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError("Excel export needs openpyxl (pip install openpyxl)")
+        self.path = path
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet("Quotes")
+        self._sheet.append(COLUMNS)
+
+    def write(self, rows):
+        for row in rows:
+            self._sheet.append(row)
+
+    def close(self):
+        self._workbook.save(self.path)
+
+WRITERS = {"CSV": CsvExport, "Parquet": ParquetExport, "Excel": ExcelExport}
+
+def format_for(path):
+    for name, (extension, mime) in FORMATS.items():
+        if path.lower().endswith(extension):
+            return name
+    raise ValueError(f"Unknown export format for {path}; use one of {', '.join(e for e, _ in FORMATS.values())}")
+
+def export_cohort(corpus, path, format=None, **options):
+    """Writes every student's coded quotes to path, a chunk at a time. Returns the number of rows."""
+    writer = WRITERS[format or format_for(path)](path)
+    count = 0
+    try:
+        for rows in iter_row_chunks(corpus, **options):
+            writer.write(rows)
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
+
+def evict_exports(directory=EXPORT_DIR, max_age_hours=EXPORT_MAX_AGE_HOURS):
+    """Deletes export files older than max_age_hours."""
+    cutoff = time.time() - max_age_hours * 3600
+    for path in glob.glob(os.path.join(directory, "export-*")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def export_to_dir(corpus, format, directory=EXPORT_DIR, **options):
+    """Exports to a new file in directory, for downloading once it is done. Returns (path, rows)."""
+    extension, _ = FORMATS[format]
+    os.makedirs(directory, exist_ok=True)
+    evict_exports(directory)
+    path = os.path.join(directory, f"export-{uuid.uuid4().hex}{extension}")
+    # Written under a temporary name so a half-written file is never offered
+    partial = f"{path}.tmp"
+    try:
+        count = export_cohort(corpus, partial, format, **options)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return path, count
+
+def main(argv=None):
+    from corpus import ResponseCorpus
+    from ingest import read_responses
+
+    parser = argparse.ArgumentParser(description="Export every student's coded quotes")
+    parser.add_argument("csv", help="Response CSV file")
+    parser.add_argument("--output", "-o", default="quotes.csv", help="A .csv, .parquet or .xlsx file")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--dedup", action="store_true",
+                        help="Analyze near-duplicate students once and remap the quotes to each of them")
+    args = parser.parse_args(argv)
+
+    corpus = ResponseCorpus(read_responses(args.csv))
+    count = export_cohort(
+        corpus, args.output, max_concurrency=args.concurrency, dedup=args.dedup,
+        on_progress=lambda done, total: print(f"Exported {done} of {total} students")
+    )
+    print(f"Wrote {count} rows to {args.output}")
+
+if __name__ == "__main__":
+    main()
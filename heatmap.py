@@ -0,0 +1,74 @@
+import io
+import os
+import numpy as np
+from analysis import CODES
+
+# Heatmap rendering that stays the same size however many students there are.
+# Up to MAX_ROWS students get a row each; larger cohorts are sorted by code
+# profile so similar students are adjacent and binned into MAX_ROWS groups
+# that show the mean counts of their members.
+
+MAX_ROWS = int(os.environ.get("HEATMAP_MAX_ROWS", "50"))
+# Cell values are only written into the figure for up to this many rows
+ANNOTATE_ROWS = 30
+FIGURE_SIZE = (15, 8)
+DPI = 100
+
+def profile_order(matrix):
+    """Row order grouping students by their most frequent code, busiest first."""
+    if len(matrix) == 0:
+        return np.arange(0)
+    return np.lexsort((-matrix.sum(axis=1), matrix.argmax(axis=1)))
+
+def aggregate_rows(matrix, students, max_rows=MAX_ROWS):
+    """Returns (matrix, labels, aggregated) with at most max_rows rows.
+
+    Small cohorts are returned unchanged. Otherwise rows are grouped by
+    profile into max_rows near-equal bins whose values are member means.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    if len(matrix) <= max_rows:
+        return matrix, list(students), False
+
+    order = profile_order(matrix)
+    bins = np.array_split(order, max_rows)
+    means = np.stack([matrix[rows].mean(axis=0) for rows in bins])
+    labels = []
+    for i, rows in enumerate(bins):
+        code = CODES[int(means[i].argmax())] if means[i].any() else "no quotes"
+        labels.append(f"Group {i + 1} ({len(rows)}): mostly {short_label(code)}")
+    return means, labels, True
+
+def short_label(code):
+    return code.replace(' Support', '').replace('Perceptions of ', '')
+
+def render_heatmap(matrix, students):
+    """Draws the code-frequency heatmap and returns it as PNG bytes."""
+    # The plotting stack is slow to import, so it is loaded on the first draw
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
+    values, labels, aggregated = aggregate_rows(matrix, students)
+    fig = plt.figure(figsize=FIGURE_SIZE, dpi=DPI)
+    sns.heatmap(
+        values,
+        xticklabels=[short_label(code) for code in CODES],
+        yticklabels=labels,
+        cmap='YlOrRd',
+        annot=len(values) <= ANNOTATE_ROWS,
+        fmt='.1f' if aggregated else '.0f',
+        cbar_kws={'label': 'Mean Quotes per Student' if aggregated else 'Number of Relevant Quotes'}
+    )
+    if aggregated:
+        plt.title(f'Response Analysis Code Frequency Heatmap ({len(students)} students in {len(values)} groups)')
+    else:
+        plt.title('Response Analysis Code Frequency Heatmap')
+    plt.xticks(rotation=45, ha='right')
+    if len(values) > ANNOTATE_ROWS:
+        plt.yticks(fontsize=8)
+    plt.tight_layout()
+
+    image = io.BytesIO()
+    fig.savefig(image, format='png')
+    plt.close(fig)
+    return image.getvalue()
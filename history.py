@@ -0,0 +1,160 @@
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from analysis import CODES, PREDETERMINED_CODES, EMERGENT_CODES, NO_QUOTE, section_of
+from cache import AnalysisCache, make_key
+
+# Compact, bounded per-session analysis history. A stored analysis keeps
+# verified quotes as spans into the source answers (code id, student index,
+# question, offset, length) instead of strings, and is rebuilt from the
+# corpus when loaded. Each session keeps its most recent entries in memory
+# and spills the rest to a shared SQLite file.
+
+HISTORY_PATH = os.environ.get("ANALYSIS_HISTORY_PATH", "analysis_history.sqlite")
+MAX_IN_MEMORY = int(os.environ.get("HISTORY_MAX_IN_MEMORY", "10"))
+# Entries listed per session; older ones are forgotten
+MAX_ENTRIES = int(os.environ.get("HISTORY_MAX_ENTRIES", "200"))
+# Spilled entries of sessions that have ended are dropped after this long
+SPILL_MAX_AGE_DAYS = 7
+
+CODE_IDS = {code: i for i, code in enumerate(CODES)}
+SPAN_FIELDS = 5
+
+class CompactAnalysis:
+    def __init__(self, fingerprint, spans, unverified=(), error=None):
+        # Content fingerprint of the file the spans point into
+        self.fingerprint = fingerprint
+        # SPAN_FIELDS unsigned ints per verified quote
+        self.spans = spans
+        # (code id, quote) for quotes that were not found in the source
+        self.unverified = list(unverified)
+        self.error = error
+
+    @classmethod
+    def from_result(cls, result, corpus):
+        if not isinstance(result, dict) or "error" in result.get("predetermined_codes", {}):
+            error = result["predetermined_codes"]["error"] if isinstance(result, dict) else str(result)
+            return cls(corpus.fingerprint, array("I"), error=error)
+        student_ids = {student: i for i, student in enumerate(corpus.students)}
+        spans = array("I")
+        for code, code_spans in result.get("quote_spans", {}).items():
+            for span in code_spans:
+                if span is not None:
+                    spans.extend((
+                        CODE_IDS[code], student_ids[span["student"]], span["question"], span["offset"], span["length"]
+                    ))
+        unverified = [
+            (CODE_IDS[code], quote) for code, quotes in result.get("unverified_quotes", {}).items() for quote in quotes
+        ]
+        return cls(corpus.fingerprint, spans, unverified)
+
+    def to_result(self, corpus):
+        """Rebuilds the analysis result, quoting the spans from the corpus answers."""
+        if self.error is not None:
+            return {"predetermined_codes": {"error": self.error}, "emergent_codes": {"error": self.error}}
+        result = {
+            "predetermined_codes": {code: [] for code in PREDETERMINED_CODES},
+            "emergent_codes": {code: [] for code in EMERGENT_CODES},
+            "quote_spans": {},
+            "unverified_quotes": {}
+        }
+        for i in range(0, len(self.spans), SPAN_FIELDS):
+            code_id, student_id, question, offset, length = self.spans[i:i + SPAN_FIELDS]
+            code = CODES[code_id]
+            student = corpus.students[student_id]
+            quote = str(corpus.answers[student][question])[offset:offset + length]
+            result[section_of(code)][code].append(f"{student}: '{quote}'")
+            result["quote_spans"].setdefault(code, []).append(
+                {"student": student, "question": question, "offset": offset, "length": length}
+            )
+        for code_id, quote in self.unverified:
+            code = CODES[code_id]
+            result[section_of(code)][code].append(quote)
+            result["quote_spans"].setdefault(code, []).append(None)
+            result["unverified_quotes"].setdefault(code, []).append(quote)
+        for section in ("predetermined_codes", "emergent_codes"):
+            for code, quotes in result[section].items():
+                if not quotes:
+                    quotes.append(NO_QUOTE)
+        return result
+
+    def to_dict(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "spans": self.spans.tolist(),
+            "unverified": self.unverified,
+            "error": self.error
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["fingerprint"], array("I", data["spans"]), [tuple(u) for u in data["unverified"]], data["error"])
+
+_spill = None
+_spill_lock = threading.Lock()
+
+def get_spill_store():
+    global _spill
+    with _spill_lock:
+        if _spill is None:
+            _spill = AnalysisCache(HISTORY_PATH, max_age_days=SPILL_MAX_AGE_DAYS)
+        return _spill
+
+class HistoryStore:
+    """One session's analyses: recent entries in memory, least recently used ones on disk."""
+
+    def __init__(self, session, max_in_memory=MAX_IN_MEMORY, max_entries=MAX_ENTRIES):
+        self.session = session
+        self.max_in_memory = max(1, max_in_memory)
+        self.max_entries = max_entries
+        self._keys = []
+        self._memory = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def add(self, key, result, corpus):
+        """Stores result under key, numbered if key is already taken. Returns the key used."""
+        taken = set(self._keys)
+        base = key
+        count = 1
+        while key in taken:
+            count += 1
+            key = f"{base}_{count}"
+        self._keys.append(key)
+        self._memory[key] = CompactAnalysis.from_result(result, corpus)
+        while len(self._keys) > self.max_entries:
+            self._memory.pop(self._keys.pop(0), None)
+        self._trim()
+        return key
+
+    def get(self, key):
+        """Returns the CompactAnalysis stored under key, or None if it is gone."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+        if key not in self._keys:
+            return None
+        try:
+            data = get_spill_store().get(make_key(self.session, key))
+        except Exception as e:
+            print(f"History read failed: {str(e)}")
+            return None
+        if data is None:
+            return None
+        entry = self._memory[key] = CompactAnalysis.from_dict(data)
+        self._trim()
+        return entry
+
+    def _trim(self):
+        while len(self._memory) > self.max_in_memory:
+            key, entry = self._memory.popitem(last=False)
+            try:
+                get_spill_store().put(make_key(self.session, key), entry.to_dict())
+            except Exception as e:
+                print(f"History spill failed, dropping {key}: {str(e)}")
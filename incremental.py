@@ -0,0 +1,77 @@
+import os
+import threading
+import numpy as np
+from analysis import MODEL, PROMPT_VERSION, CODES
+from cache import AnalysisCache, make_key
+
+# Row-level state for incremental heatmap refreshes. Each student's five
+# answers are fingerprinted, and the code-count vector computed for that
+# fingerprint is persisted, so a re-upload only sends added or edited
+# students to the model and the rest of the matrix is patched from disk.
+
+ROW_STATE_PATH = os.environ.get("HEATMAP_ROWS_PATH", "heatmap_rows.sqlite")
+
+def row_fingerprint(student, answers):
+    return make_key(student, *answers)
+
+def row_fingerprints(corpus, students=None):
+    students = corpus.students if students is None else students
+    return {student: row_fingerprint(student, corpus.answers[student]) for student in students}
+
+def options_key(dedup):
+    """Everything besides the answers that changes a student's counts."""
+    return make_key(MODEL, PROMPT_VERSION, dedup)
+
+class RowDiff:
+    def __init__(self, previous, current):
+        self.added = [s for s in current if s not in previous]
+        self.changed = [s for s in current if s in previous and previous[s] != current[s]]
+        self.removed = [s for s in previous if s not in current]
+        self.unchanged = [s for s in current if previous.get(s) == current[s]]
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def summary(self):
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed"
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_row_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AnalysisCache(ROW_STATE_PATH)
+        return _store
+
+def load_vectors(fingerprints, options):
+    """Returns {student: counts} for every student with a stored vector."""
+    store = get_row_store()
+    vectors = {}
+    for student, fp in fingerprints.items():
+        counts = store.get(make_key(options, fp))
+        if counts is not None and len(counts) == len(CODES):
+            vectors[student] = counts
+    return vectors
+
+def save_vectors(fingerprints, options, matrix, students):
+    store = get_row_store()
+    for row, student in zip(matrix, students):
+        store.put(make_key(options, fingerprints[student]), [int(c) for c in row])
+
+def patch_matrix(previous, students, vectors):
+    """Builds the matrix for `students` from stored vectors.
+
+    `previous` is (students, matrix) from the last refresh or None. When the
+    roster is unchanged only the rows with new vectors are overwritten on a
+    copy of the previous matrix.
+    """
+    if previous is not None and list(previous[0]) == list(students):
+        matrix = previous[1].copy()
+    else:
+        matrix = np.zeros((len(students), len(CODES)))
+    for i, student in enumerate(students):
+        if student in vectors:
+            matrix[i] = vectors[student]
+    return matrix
@@ -0,0 +1,181 @@
+import os
+import codecs
+from corpus import REQUIRED_COLUMNS, STUDENT_COLUMN, ResponseDataError, fix_mojibake, map_columns
+
+# Chunked reading of response CSVs with pyarrow's streaming CSV reader.
+# Headers are read first and mapped onto the expected columns (see
+# corpus.map_columns); only the mapped columns are then parsed, as strings,
+# one block at a time, and each block is validated as it arrives. Rows
+# pyarrow can't parse are skipped and counted rather than failing the load.
+
+# Bytes of CSV parsed per block
+CHUNK_BYTES = int(os.environ.get("INGEST_CHUNK_BYTES", str(1 << 20)))
+# Bytes looked at to tell UTF-8 from Windows-1252
+SNIFF_BYTES = 64 * 1024
+
+class IngestReport:
+    """What happened while reading a file, for showing next to the data."""
+
+    def __init__(self):
+        # Uploaded header -> expected column, for headers that differed
+        self.renamed = {}
+        self.encoding = "utf8"
+        self.rows = 0
+        self.malformed_rows = 0
+        self.rows_without_student = 0
+        self.duplicate_students = 0
+
+    def notes(self):
+        notes = []
+        if self.encoding != "utf8":
+            notes.append(f"Read as {self.encoding}, not UTF-8.")
+        if self.renamed:
+            notes.append(f"Matched {len(self.renamed)} column headers to the expected columns.")
+        if self.malformed_rows:
+            notes.append(f"Skipped {self.malformed_rows} rows that could not be parsed.")
+        if self.rows_without_student:
+            notes.append(f"Skipped {self.rows_without_student} rows without a student name.")
+        if self.duplicate_students:
+            notes.append(f"Ignored {self.duplicate_students} repeated rows for students already seen.")
+        return notes
+
+def sniff_encoding(head):
+    """"utf8" if the start of the file decodes as UTF-8, otherwise "cp1252"."""
+    try:
+        # A multi-byte character may be cut off at the end of the sample
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf8"
+    except UnicodeDecodeError:
+        return "cp1252"
+
+def as_buffer(source):
+    """A pyarrow input for a path, bytes or file-like object, plus its first bytes."""
+    import pyarrow as pa
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            head = f.read(SNIFF_BYTES)
+        return lambda: pa.OSFile(os.fspath(source)), head
+    if hasattr(source, "getbuffer"):
+        data = source.getbuffer()
+    elif hasattr(source, "read"):
+        data = source.read()
+    else:
+        data = source
+    buffer = pa.py_buffer(data)
+    return lambda: pa.BufferReader(buffer), bytes(data[:SNIFF_BYTES])
+
+def iter_response_batches(source, chunk_bytes=CHUNK_BYTES, report=None):
+    """Yields validated Arrow record batches with REQUIRED_COLUMNS, one per parsed block.
+
+    Raises ResponseDataError as soon as the headers show a required column
+    is missing; rows without a student and repeats of a student already
+    seen are dropped as each block is validated. A file sniffed as UTF-8
+    that turns out not to be is read again as Windows-1252, skipping the
+    students already yielded.
+    """
+    import pyarrow as pa
+
+    report = IngestReport() if report is None else report
+    open_input, head = as_buffer(source)
+    report.encoding = sniff_encoding(head)
+    yielded = set()
+    while True:
+        try:
+            yield from _read_batches(open_input, chunk_bytes, report, yielded)
+            return
+        except pa.ArrowInvalid as e:
+            if report.encoding != "utf8" or "invalid UTF8" not in str(e):
+                raise ResponseDataError(f"Could not read the CSV file: {str(e)}")
+            print(f"Reading again as cp1252: {str(e)}")
+            report.encoding = "cp1252"
+            # Counted again from the top
+            report.rows = report.malformed_rows = report.rows_without_student = report.duplicate_students = 0
+
+def repair_mojibake(values):
+    """Fixes UTF-8 text in a string array that was decoded as Windows-1252, as in mixed files."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if pc.all(pc.fill_null(pc.string_is_ascii(values), True)).as_py():
+        return values
+    return pa.array([None if v is None else fix_mojibake(v) for v in values.to_pylist()], type=pa.string())
+
+def _read_batches(open_input, chunk_bytes, report, yielded):
+    """One pass over the file in report.encoding; adds the students it yields to `yielded`."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+
+    def skip_row(row):
+        report.malformed_rows += 1
+        return "skip"
+
+    read_options = pacsv.ReadOptions(block_size=chunk_bytes, encoding=report.encoding)
+    parse_options = pacsv.ParseOptions(newlines_in_values=True, invalid_row_handler=skip_row)
+    # Opening parses the first block, whose bad rows are counted on the real pass
+    probe_options = pacsv.ParseOptions(newlines_in_values=True, invalid_row_handler=lambda row: "skip")
+    headers = pacsv.open_csv(open_input(), read_options=read_options, parse_options=probe_options).schema.names
+
+    mapping = map_columns(headers)
+    missing = [column for column in REQUIRED_COLUMNS if column not in mapping.values()]
+    if missing:
+        raise ResponseDataError(f"Missing required columns: {', '.join(missing)}")
+    report.renamed = {header: column for header, column in mapping.items() if header != column}
+
+    # Only the mapped columns are converted, all as strings so blocks agree on types
+    convert_options = pacsv.ConvertOptions(
+        include_columns=list(mapping),
+        column_types={header: pa.string() for header in mapping},
+        strings_can_be_null=True
+    )
+    reader = pacsv.open_csv(
+        open_input(), read_options=read_options, parse_options=parse_options, convert_options=convert_options
+    )
+    schema = pa.schema([(column, pa.string()) for column in REQUIRED_COLUMNS])
+    # Students yielded by an earlier pass in another encoding
+    previous = set(yielded)
+    seen = set()
+    for batch in reader:
+        report.rows += batch.num_rows
+        columns = dict(zip([mapping[name] for name in batch.schema.names], batch.columns))
+        if report.encoding == "cp1252":
+            columns = {column: repair_mojibake(values) for column, values in columns.items()}
+        # Entirely blank rows are dropped without being counted
+        blank = None
+        for values in columns.values():
+            blank = pc.is_null(values) if blank is None else pc.and_(blank, pc.is_null(values))
+        columns[STUDENT_COLUMN] = pc.utf8_trim_whitespace(columns[STUDENT_COLUMN])
+        student = columns[STUDENT_COLUMN]
+        has_student = pc.fill_null(pc.not_equal(student, ""), False)
+        report.rows_without_student += int(pc.sum(pc.and_(pc.invert(has_student), pc.invert(blank))).as_py() or 0)
+        batch = pa.RecordBatch.from_arrays([columns[column] for column in REQUIRED_COLUMNS], schema=schema)
+        batch = batch.filter(has_student)
+        # One pass with a set; pc.is_in would need `seen` rebuilt as an array for every block
+        keep = []
+        duplicates = 0
+        for name in batch.column(STUDENT_COLUMN).to_pylist():
+            duplicates += name in seen
+            keep.append(name not in seen and name not in previous)
+            seen.add(name)
+        report.duplicate_students += duplicates
+        if not all(keep):
+            batch = batch.filter(pa.array(keep, type=pa.bool_()))
+        if batch.num_rows:
+            yielded.update(batch.column(STUDENT_COLUMN).to_pylist())
+            yield batch
+
+def iter_response_frames(source, chunk_bytes=CHUNK_BYTES, report=None):
+    """Yields validated DataFrames with REQUIRED_COLUMNS, one per parsed block."""
+    for batch in iter_response_batches(source, chunk_bytes, report):
+        yield batch.to_pandas()
+
+def read_response_table(source, chunk_bytes=CHUNK_BYTES, report=None):
+    """Reads a whole response file into one validated Arrow table; nothing is copied into pandas."""
+    import pyarrow as pa
+    batches = list(iter_response_batches(source, chunk_bytes, report))
+    if not batches:
+        raise ResponseDataError("The file has the expected columns but no student responses.")
+    return pa.Table.from_batches(batches)
+
+def read_responses(source, chunk_bytes=CHUNK_BYTES, report=None):
+    """Reads a whole response file into one validated DataFrame."""
+    return read_response_table(source, chunk_bytes, report).to_pandas()
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# Background jobs for long analyses. The Streamlit script only submits a job
+# and polls it, so reruns caused by widget clicks, and browser disconnects,
+# don't throw the work away: the job keeps running in a worker thread and
+# any later run can attach to it by id. Job state and results are kept in
+# SQLite, so finished jobs can be reattached after a restart too.
+
+JOBS_PATH = os.environ.get("ANALYSIS_JOBS_PATH", "analysis_jobs.sqlite")
+WORKERS = int(os.environ.get("ANALYSIS_JOB_WORKERS", "4"))
+# Finished jobs are forgotten after this long
+JOB_MAX_AGE_DAYS = 7
+# Minimum seconds between progress writes to the store
+PROGRESS_WRITE_INTERVAL = 2.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# Was queued or running when the process that owned it stopped
+INTERRUPTED = "interrupted"
+UNFINISHED = (QUEUED, RUNNING)
+
+class JobRecord:
+    def __init__(self, id, kind, key, params, status, done, total, error, result, created, updated):
+        self.id = id
+        self.kind = kind
+        self.key = key
+        self.params = params
+        self.status = status
+        self.done = done
+        self.total = total
+        self.error = error
+        self.result = result
+        self.created = created
+        self.updated = updated
+        # Latest partial result, only while the job runs in this process
+        self.partial = None
+
+    @property
+    def finished(self):
+        return self.status not in UNFINISHED
+
+    @property
+    def fraction(self):
+        return self.done / self.total if self.total else 0.0
+
+class JobStore:
+    """SQLite table of jobs; results and params are stored as JSON."""
+
+    COLUMNS = "id, kind, key, params, status, done, total, error, result, created, updated"
+
+    def __init__(self, path=JOBS_PATH, max_age_days=JOB_MAX_AGE_DAYS):
+        self.path = path
+        self.max_age = max_age_days * 86400
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, key TEXT NOT NULL, params TEXT NOT NULL, "
+                "status TEXT NOT NULL, done INTEGER NOT NULL, total INTEGER NOT NULL, error TEXT, result TEXT, "
+                "created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _record(self, row):
+        if row is None:
+            return None
+        id, kind, key, params, status, done, total, error, result, created, updated = row
+        return JobRecord(
+            id, kind, key, json.loads(params), status, done, total, error,
+            None if result is None else json.loads(result), created, updated
+        )
+
+    def create(self, id, kind, key, params):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT INTO jobs ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, 0, 0, NULL, NULL, ?, ?)",
+                (id, kind, key, json.dumps(params), QUEUED, now, now)
+            )
+
+    def get(self, id):
+        with self._connect() as conn:
+            return self._record(conn.execute(f"SELECT {self.COLUMNS} FROM jobs WHERE id = ?", (id,)).fetchone())
+
+    def find_unfinished(self, key):
+        """Id of a queued or running job with this key, if there is one."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE key = ? AND status IN (?, ?) ORDER BY created DESC LIMIT 1",
+                (key, *UNFINISHED)
+            ).fetchone()
+        return row[0] if row else None
+
+    def update(self, id, **fields):
+        fields["updated"] = time.time()
+        for name in ("result", "params"):
+            if name in fields:
+                fields[name] = json.dumps(fields[name])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), id))
+
+    def interrupt_unfinished(self):
+        """Marks jobs left queued or running by a previous process; their workers are gone."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, updated = ? WHERE status IN (?, ?)",
+                (INTERRUPTED, time.time(), *UNFINISHED)
+            )
+
+    def evict(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE updated < ?", (time.time() - self.max_age,))
+
+class JobQueue:
+    """Runs submitted functions on a worker pool and records them in a JobStore."""
+
+    def __init__(self, store, workers=WORKERS):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max(1, workers), thread_name_prefix="analysis-job")
+        self._lock = threading.Lock()
+        # id -> JobRecord of jobs queued or running in this process
+        self._live = {}
+
+    def submit(self, kind, key, fn, params=None):
+        """Queues fn(report) and returns the job id.
+
+        While a job with the same key is queued or running, its id is
+        returned instead, so a repeated click attaches to the work already
+        under way. `report(done, total, partial=None)` publishes progress;
+        fn's return value must be JSON-serializable and becomes the result.
+        """
+        with self._lock:
+            existing = self.store.find_unfinished(key)
+            if existing is not None and existing in self._live:
+                return existing
+            id = uuid.uuid4().hex
+            params = params or {}
+            self.store.create(id, kind, key, params)
+            job = JobRecord(id, kind, key, params, QUEUED, 0, 0, None, None, time.time(), time.time())
+            self._live[id] = job
+        # The worker sees the submitting session's context, e.g. its scheduler session
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._run, job, fn)
+        return id
+
+    def _run(self, job, fn):
+        last_write = [0.0]
+
+        def report(done, total, partial=None):
+            job.done, job.total = done, total
+            if partial is not None:
+                job.partial = partial
+            now = time.monotonic()
+            if now - last_write[0] >= PROGRESS_WRITE_INTERVAL:
+                last_write[0] = now
+                self.store.update(job.id, done=done, total=total)
+
+        job.status = RUNNING
+        self.store.update(job.id, status=RUNNING)
+        try:
+            result = fn(report)
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed: {str(e)}")
+            job.error = str(e)
+            self.store.update(job.id, status=FAILED, error=job.error, done=job.done, total=job.total)
+            job.status = FAILED
+        else:
+            job.result = result
+            self.store.update(job.id, status=DONE, result=result, done=job.total or job.done, total=job.total)
+            job.status = DONE
+        finally:
+            with self._lock:
+                self._live.pop(job.id, None)
+
+    def get(self, id):
+        """The job's current state, or None if it is unknown or expired."""
+        with self._lock:
+            live = self._live.get(id)
+        if live is not None:
+            return live
+        return self.store.get(id)
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            store = JobStore()
+            store.interrupt_unfinished()
+            store.evict()
+            _queue = JobQueue(store)
+        return _queue
@@ -1,10 +1,31 @@
+import io
+import os
+import csv
+import time
+import uuid
+import base64
 import streamlit as st
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import numpy as np
 from styles import apply_styles
-from analysis import analyze_response
+from analysis import analyze_response_stream, count_quotes, CODES, PREDETERMINED_CODES, EMERGENT_CODES, MODEL, PROMPT_VERSION, DETERMINISTIC
+from engine import analyze_many, DEFAULT_CONCURRENCY
+from corpus import ResponseCorpus, ResponseDataError
+from ingest import IngestReport, read_response_table
+from mapreduce import analyze_cohort
+from verify import verify_result
+import memo
+import shared
+from memo import fingerprint
+from metrics import metrics
+from scheduler import current_session, get_scheduler
+from history import HistoryStore
+from jobs import get_job_queue, DONE
+from cache import make_key, get_cache
+from vectors import get_vector_store, record_vectors
+from export import COLUMNS, FORMATS as EXPORT_FORMATS, result_rows, export_to_dir
+
+# pandas, numpy and the plotting stack are imported where they are first
+# needed, so the login screen renders without loading them. Run
+# benchmarks/startup.py to check.
 
 # Page configuration
 st.set_page_config(
@@ -43,141 +64,369 @@ def check_password():
         # Password correct
         return True
 
-def load_data(uploaded_file=None):
+DEFAULT_DATA_FILE = "Varied_PhD-Level_Responses.csv"
+
+def load_data(uploaded_file=None, report=None):
+    """Reads and validates the responses into an Arrow table, or None after showing the error."""
     try:
         if uploaded_file is not None:
-            df = pd.read_csv(uploaded_file)
+            table = read_response_table(uploaded_file, report=report)
         else:
-            df = pd.read_csv("Varied_PhD-Level_Responses.csv")
-        
-        # Remove any completely empty rows
-        df = df.dropna(how='all')
-        
-        # Ensure all required columns exist
-        required_columns = [
-            'Student',
-            'What student information do you need to plan the lesson?',
-            'What information would you ask of the other fifth-grade teachers?',
-            'How would you ensure all students are engaged in the lesson?',
-            'How would you assess the assignment?',
-            "How would you assess students' understanding of each of the objectives?"
-        ]
+            table = read_response_table(DEFAULT_DATA_FILE, report=report)
         
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            st.error(f"Missing required columns: {', '.join(missing_columns)}")
-            return None
-            
-        return df
+        return table
+    except ResponseDataError as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
         st.error("Please ensure your CSV file has all required columns and valid data.")
         return None
 
-def generate_heatmap(df):
-    if df.empty:
-        raise ValueError("No data available for heatmap generation")
+def data_fingerprint(uploaded_file=None):
+    """Content hash of the data in use, without rereading the file on every rerun."""
+    if uploaded_file is None:
+        return memo.file_fingerprint(DEFAULT_DATA_FILE)
+    # An upload keeps its file_id until the user picks another file
+    cached = st.session_state.get('upload_fingerprint')
+    if cached is None or cached[0] != uploaded_file.file_id:
+        cached = (uploaded_file.file_id, fingerprint(uploaded_file.getvalue()))
+        st.session_state.upload_fingerprint = cached
+    return cached[1]
+
+def session_holder():
+    """Id of the browser session running this script."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "default"
+
+def release_closed_sessions():
+    """Lets go of shared data held by sessions whose browser has gone away."""
+    from streamlit import runtime
+    if runtime.exists():
+        shared.registry.sweep(runtime.get_instance().is_active_session)
+
+def load_corpus(uploaded_file=None):
+    """The response corpus for the data in use, shared by every session on the same file."""
+    file_fingerprint = data_fingerprint(uploaded_file)
+
+    def load():
+        report = IngestReport()
+        source = io.BytesIO(uploaded_file.getvalue()) if uploaded_file is not None else None
+        table = load_data(source, report)
+        if table is None:
+            return None
+        corpus = ResponseCorpus(table, fingerprint=file_fingerprint)
+        # Shown alongside the data on every rerun, not just the one that read it
+        corpus.ingest_notes = report.notes()
+        corpus.source = uploaded_file.name if uploaded_file is not None else DEFAULT_DATA_FILE
+        return corpus
+
+    release_closed_sessions()
+    dataset = shared.registry.acquire(session_holder(), file_fingerprint, load)
+    return dataset.corpus if dataset is not None else None
+
+def compute_code_matrix(corpus, max_concurrency=DEFAULT_CONCURRENCY, dedup=True, students=None, on_progress=None):
+    """Analyzes students (all by default) and returns (matrix, failed).
+
+    matrix has one row of code counts per student; failed is the set of
+    students whose analysis did not succeed. `on_progress(done, total, rows)`
+    is called after each model call with {student: counts} of the rows
+    finished so far.
+    """
+    import numpy as np
+    from dedup import Cluster, cluster_students, remap_result
+
+    students = corpus.students if students is None else students
+    if len(students) == 0:
+        raise ValueError("No students found in the data")
 
     # Define the analysis codes
-    codes = [
-        'Academic Language Support',
-        'Grammar Support',
-        'Content Knowledge Support',
-        'Collaboration with Teachers',
-        'Student Engagement',
-        'Assessment of Language Proficiency',
-        'Perceptions of Language Acquisition',
-        'Perceived Challenges',
-        'Innovative Practices',
-        'Perceptions of Error'
-    ]
+    codes = CODES
+    row_of = {student: i for i, student in enumerate(students)}
     
     # Initialize a matrix to store code frequencies
-    students = df['Student'].unique()
-    if len(students) == 0:
-        raise ValueError("No students found in the data")
-        
     matrix = np.zeros((len(students), len(codes)))
+    failed = set()
+    finished = {}
+    done = []
     
-    # Fill the matrix with code frequencies
-    for i, student in enumerate(students):
-        try:
-            student_data = df[df['Student'] == student]
-            if student_data.empty:
-                print(f"No data found for student: {student}")
-                continue
-                
-            # Combine all responses for the student
-            response_text = f"""
-            Student: {student}
-            
-            Student Information Needed:
-            {student_data['What student information do you need to plan the lesson?'].iloc[0]}
-            
-            Information from Other Teachers:
-            {student_data['What information would you ask of the other fifth-grade teachers?'].iloc[0]}
-            
-            Student Engagement:
-            {student_data['How would you ensure all students are engaged in the lesson?'].iloc[0]}
-            
-            Assessment Approach:
-            {student_data['How would you assess the assignment?'].iloc[0]}
-            
-            Objectives Assessment:
-            {student_data["How would you assess students' understanding of each of the objectives?"].iloc[0]}
-            """
-            
-            # Analyze the response
-            print(f"Analyzing responses for student: {student}")
-            analysis_results = analyze_response(response_text)
-            
-            if not isinstance(analysis_results, dict):
-                print(f"Invalid analysis results for student {student}: {analysis_results}")
-                continue
-                
-            # Count code frequencies
-            for j, code in enumerate(codes):
-                try:
-                    if j < 6:  # Predetermined codes
-                        quotes = analysis_results.get('predetermined_codes', {}).get(code, ["No direct quote found"])
-                    else:  # Emergent codes
-                        quotes = analysis_results.get('emergent_codes', {}).get(code, ["No direct quote found"])
-                    
-                    # Count non-empty quotes
-                    valid_quotes = [q for q in quotes if q != "No direct quote found"]
-                    matrix[i, j] = len(valid_quotes)
-                except Exception as e:
-                    print(f"Error processing code {code} for student {student}: {str(e)}")
-                    matrix[i, j] = 0
-        except Exception as e:
-            print(f"Error processing student {student}: {str(e)}")
-            continue
+    # Near-duplicate students share one analysis, made for the cluster's representative
+    clusters = cluster_students(corpus, students) if dedup else [Cluster(student) for student in students]
+    members = {row_of[cluster.representative]: cluster.members for cluster in clusters}
     
-    # Create the heatmap
-    plt.figure(figsize=(15, 8))
-    sns.heatmap(
-        matrix,
-        xticklabels=[code.replace(' Support', '').replace('Perceptions of ', '') for code in codes],
-        yticklabels=students,
-        cmap='YlOrRd',
-        annot=True,
-        fmt='.0f',
-        cbar_kws={'label': 'Number of Relevant Quotes'}
+    # One prompt per cluster, pre-rendered by the corpus
+    items = [(row_of[cluster.representative], corpus.documents[cluster.representative]) for cluster in clusters]
+
+    # Fill matrix rows as each analysis arrives
+    def fill_row(i, analysis_results):
+        if not isinstance(analysis_results, dict) or 'error' in analysis_results.get('predetermined_codes', {}):
+            print(f"Invalid analysis results for student {students[i]}: {analysis_results}")
+            failed.add(students[i])
+            failed.update(members[i])
+            return
+        # Only quotes that really occur in the student's answers are counted
+        verified = verify_result(analysis_results, corpus.quote_index, students=[students[i]])
+        matrix[i] = count_quotes(verified)
+        finished[students[i]] = matrix[i]
+        for member in members[i]:
+            matrix[row_of[member]] = count_quotes(remap_result(verified, corpus, member))
+            finished[member] = matrix[row_of[member]]
+
+    def on_result(i, analysis_results):
+        fill_row(i, analysis_results)
+        done.append(i)
+        if on_progress is not None:
+            on_progress(len(done), len(items), finished)
+
+    print(f"Analyzing responses for {len(students)} students with {len(items)} calls (concurrency {max_concurrency})")
+    analyze_many(items, max_concurrency=max_concurrency, on_result=on_result)
+    return matrix, failed
+
+def show_counts_table(matrix, students):
+    """Interactive per-student counts, one bar column per code."""
+    import pandas as pd
+    from heatmap import short_label
+
+    counts = pd.DataFrame(matrix.astype(int), index=pd.Index(students, name="Student"), columns=CODES)
+    top = max(int(counts.to_numpy().max(initial=0)), 1)
+    st.dataframe(
+        counts,
+        column_config={
+            code: st.column_config.ProgressColumn(short_label(code), min_value=0, max_value=top, format="%d")
+            for code in CODES
+        }
     )
-    plt.title('Response Analysis Code Frequency Heatmap')
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    
-    return plt
+
+def heatmap_key(corpus, dedup):
+    return (corpus.fingerprint, 'heatmap', MODEL, PROMPT_VERSION, dedup)
+
+def generate_heatmap(corpus, max_concurrency=DEFAULT_CONCURRENCY, dedup=True, previous=None, on_progress=None):
+    """Returns (matrix, png) for the corpus.
+
+    A cached result for the same file and options is reused. Otherwise only
+    students whose answers have no stored code counts are analyzed, and the
+    rest of the matrix is patched from the row store. `previous` is the
+    (students, matrix) of the last heatmap shown, if any.
+    `on_progress(done, total, matrix)` receives the partial matrix as
+    analyses complete.
+    """
+    key = heatmap_key(corpus, dedup)
+    cached = memo.results.get(key)
+    if cached is not None:
+        return cached
+
+    from heatmap import render_heatmap
+    from incremental import row_fingerprints, options_key, load_vectors, save_vectors, patch_matrix
+
+    options = options_key(dedup)
+    fingerprints = row_fingerprints(corpus)
+    vectors = load_vectors(fingerprints, options)
+    pending = [student for student in corpus.students if student not in vectors]
+    failed = set()
+    if pending:
+        print(f"Analyzing {len(pending)} new or changed students; {len(vectors)} reused")
+
+        def report(done, total, finished):
+            if on_progress is not None:
+                on_progress(done, total, patch_matrix(previous, corpus.students, {**vectors, **finished}))
+
+        rows, failed = compute_code_matrix(corpus, max_concurrency, dedup, students=pending, on_progress=report)
+        analyzed = [(student, row) for student, row in zip(pending, rows) if student not in failed]
+        save_vectors(fingerprints, options, [row for _, row in analyzed], [student for student, _ in analyzed])
+        record_vectors([student for student, _ in analyzed], [row for _, row in analyzed], corpus.fingerprint, corpus.source)
+        vectors.update(zip(pending, rows))
+
+    matrix = patch_matrix(previous, corpus.students, vectors)
+    heatmap = (matrix, render_heatmap(matrix, corpus.students))
+    # Incomplete results are shown but not kept, so the next click retries them
+    if failed:
+        print(f"{len(failed)} analyses failed; heatmap not cached")
+        return heatmap
+    return memo.results.put(key, heatmap)
+
+# Minimum seconds between redraws of the partial heatmap while it fills in
+REDRAW_SECONDS = 1.0
+
+def show_partial_results(placeholder, results, status):
+    """Renders the codes received so far into a placeholder while an analysis streams in."""
+    with placeholder.container():
+        st.header("Analysis Results")
+        st.caption(status)
+        for title, section, codes in (
+            ("Predetermined Codes", 'predetermined_codes', PREDETERMINED_CODES),
+            ("Emergent Codes", 'emergent_codes', EMERGENT_CODES)
+        ):
+            st.subheader(title)
+            received = results.get(section, {})
+            for code in codes:
+                if code in received:
+                    with st.expander(f"{code}", expanded=True):
+                        for quote in received[code]:
+                            st.markdown(f"- {quote}")
+                else:
+                    st.markdown(f"⏳ {code}")
+
+# Seconds between polls of a running job
+POLL_SECONDS = 0.5
+
+def watch_job(job_id, show):
+    """Shows a running job with show(job), polling in a fragment so the rest of
+    the page isn't rerun. The whole page reruns once the job has finished."""
+    @st.fragment(run_every=POLL_SECONDS)
+    def poll():
+        job = get_job_queue().get(job_id)
+        if job is None or job.finished:
+            st.rerun()
+        show(job)
+    poll()
+
+def analysis_job(corpus, student):
+    """Job function analyzing one student, or every student for 'All Students'."""
+    def run(report):
+        if student == 'All Students':
+            # Map-reduce over token-budgeted chunks of students
+            results = analyze_cohort(corpus, on_progress=report)
+            return verify_result(results, corpus.quote_index, drop=False)
+        for results in analyze_response_stream(corpus.documents[student]):
+            report(0, 1, results)
+        # A repeat click served from the cache adds nothing new to the Trends tab
+        if 'error' not in results.get('predetermined_codes', {}) and not get_vector_store().has(corpus.fingerprint, student, kind="analysis"):
+            counts = count_quotes(verify_result(results, corpus.quote_index, students=[student]))
+            record_vectors([student], [counts], corpus.fingerprint, corpus.source, kind="analysis")
+        return verify_result(results, corpus.quote_index, students=[student], drop=False)
+    return run
+
+def heatmap_job(corpus, max_concurrency, dedup, previous):
+    """Job function generating the heatmap; the result holds the matrix and base64 PNG."""
+    def run(report):
+        matrix, image = generate_heatmap(corpus, max_concurrency, dedup, previous, on_progress=report)
+        return {"matrix": matrix.tolist(), "image": base64.b64encode(image).decode("ascii")}
+    return run
+
+def export_job(corpus, format, dedup):
+    """Job function writing every student's quotes to a file; the result holds its path and row count."""
+    def run(report):
+        path, rows = export_to_dir(corpus, format, dedup=dedup, on_progress=report)
+        return {"path": path, "rows": rows}
+    return run
+
+def job_for(name, corpus, **params):
+    """This session's job stored under name, if it was made for this file and these options."""
+    job_id = st.session_state.get(name)
+    if job_id is None:
+        return None
+    job = get_job_queue().get(job_id)
+    wanted = {"fingerprint": corpus.fingerprint, **params}
+    if job is None or any(job.params.get(k) != v for k, v in wanted.items()):
+        return None
+    return job
+
+def attach_job(name, job_id):
+    """Remembers a job for this session and in the URL, so a reconnecting browser can attach to it."""
+    st.session_state[name] = job_id
+    st.query_params[name] = job_id
+
+# Students after the selected one that prefetch also analyzes
+PREFETCH_AHEAD = int(os.environ.get("ANALYSIS_PREFETCH_AHEAD", "2"))
+# Prefetch model calls allowed per browser session
+PREFETCH_BUDGET = int(os.environ.get("ANALYSIS_PREFETCH_BUDGET", "25"))
+
+def prefetch_students(corpus, student):
+    """Starts background analyses of student and the next PREFETCH_AHEAD students.
+
+    They run at low priority and land in the analysis cache, so clicking
+    Analyze Responses finds them ready. Calls count against this session's
+    PREFETCH_BUDGET; cached or already running analyses cost nothing. Each
+    student is looked at once per dataset, not again on every rerun.
+    """
+    prefetched = st.session_state.get('prefetched')
+    if prefetched is None or prefetched[0] != corpus.fingerprint:
+        prefetched = st.session_state['prefetched'] = (corpus.fingerprint, set())
+    start = corpus.students.index(student)
+    spent = st.session_state.get('prefetch_spent', 0)
+    for upcoming in corpus.students[start:start + 1 + PREFETCH_AHEAD]:
+        if spent >= PREFETCH_BUDGET:
+            break
+        if upcoming in prefetched[1]:
+            continue
+        prefetched[1].add(upcoming)
+        if get_scheduler().prefetch(corpus.documents[upcoming]):
+            spent += 1
+    st.session_state['prefetch_spent'] = spent
+
+def show_trends(corpus):
+    """Views over every code-frequency vector the app has recorded."""
+    st.header("Trends Across Analyses")
+    store = get_vector_store()
+    cohorts = store.cohorts()
+    if cohorts.empty:
+        st.info("No analyses recorded yet. Every heatmap and student analysis is added here.")
+        return
+
+    started = time.perf_counter()
+    labels = {
+        row.fingerprint: f"{row.source or 'upload'} ({row.fingerprint[:8]}, {row.students} students)"
+        for row in cohorts.itertuples()
+    }
+    st.caption(f"{int(cohorts['analyses'].sum()):,} analyses of {len(cohorts)} uploads.")
+
+    st.subheader("Mean code counts over time")
+    period = st.radio("Period", ["Day", "Week", "Month"], horizontal=True)
+    trends = store.trends({"Day": "D", "Week": "W", "Month": "MS"}[period])
+    st.line_chart(trends)
+
+    st.subheader("Compare uploads")
+    # This upload, if it has been analyzed, and the most recent other one
+    others = [f for f in labels if f != corpus.fingerprint]
+    default = ([corpus.fingerprint] if corpus.fingerprint in labels else []) + others[:1]
+    selected = st.multiselect("Uploads", list(labels), default=default, format_func=labels.get)
+    if selected:
+        comparison = store.compare(selected)
+        st.bar_chart(comparison.rename(index=labels).T, stack=False)
+
+    st.subheader("Code count percentiles")
+    only_current = st.checkbox("Only this upload", value=False)
+    percentiles = store.percentiles(fingerprint=corpus.fingerprint if only_current else None)
+    st.dataframe(percentiles.round(2))
+    st.caption(f"Aggregated in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+def show_metrics():
+    """Sidebar summary of model calls made by this server process."""
+    snapshot = metrics.snapshot()
+    latency = snapshot["latency_seconds"]
+    calls = latency["count"]
+    with st.expander("API metrics", expanded=False):
+        st.caption("All sessions since " + time.strftime("%Y-%m-%d %H:%M", time.localtime(snapshot["since"])))
+        st.markdown(f"""
+- Calls: {calls} ({snapshot['calls']['error']} failed, {snapshot['retries']} retried, {snapshot['rate_limited']} rate limited)
+- Latency: p50 {latency['p50'] or 0:.2f}s, p95 {latency['p95'] or 0:.2f}s, mean {latency['mean'] or 0:.2f}s
+- Tokens: {snapshot['tokens']['prompt']:,} prompt, {snapshot['tokens']['completion']:,} completion
+- Cache: {snapshot['cache']['hit']} hits, {snapshot['cache']['miss']} misses, {snapshot['coalesced']} shared in-flight calls
+""")
+        if snapshot["errors"]:
+            st.caption("Errors: " + ", ".join(f"{name} ×{count}" for name, count in snapshot["errors"].items()))
+        st.download_button("Download metrics (Prometheus)", metrics.to_prometheus(), file_name="analysis_metrics.prom", mime="text/plain")
+        st.download_button("Download metrics (JSON)", metrics.to_json(), file_name="analysis_metrics.json", mime="application/json")
 
 def main():
     # Initialize session state for historical tracking
     if 'analysis_history' not in st.session_state:
-        st.session_state.analysis_history = {}
+        st.session_state.analysis_history = HistoryStore(uuid.uuid4().hex)
         
     # Check authentication
     if not check_password():
         return
+
+    # Model calls from this browser session take turns with other sessions'
+    if 'scheduler_session' not in st.session_state:
+        st.session_state.scheduler_session = uuid.uuid4().hex
+    current_session.set(st.session_state.scheduler_session)
+
+    # A reconnecting browser picks its jobs back up from the URL
+    for name in ('analysis_job', 'heatmap_job', 'export_job'):
+        if name not in st.session_state and name in st.query_params:
+            st.session_state[name] = st.query_params[name]
         
     # Add logout button in sidebar
     with st.sidebar:
@@ -185,6 +434,9 @@ def main():
             st.session_state["password_correct"] = False
             st.rerun()
     
+    from heatmap import render_heatmap, MAX_ROWS
+    from incremental import RowDiff, row_fingerprints, options_key
+
     # Title
     st.title("Special Education Response Analysis")
 
@@ -201,26 +453,72 @@ def main():
         
         if uploaded_file is not None:
             st.success("Custom data loaded successfully!")
+        
+        use_dedup = st.checkbox(
+            "Reuse analyses for near-duplicate answers",
+            value=True,
+            help="Students whose answers are near-identical share one model call in the heatmap"
+        )
+        # Prefetched results are handed over through the analysis cache
+        can_prefetch = get_cache() is not None and DETERMINISTIC
+        use_prefetch = st.checkbox(
+            "Prefetch analyses",
+            disabled=not can_prefetch,
+            help=(
+                f"Analyze the selected student and the next {PREFETCH_AHEAD} in the background, "
+                f"so results are ready when you click Analyze (up to {PREFETCH_BUDGET} calls per session)"
+                if can_prefetch else "Needs the analysis cache and deterministic mode"
+            )
+        ) and can_prefetch
+        if use_prefetch:
+            st.caption(f"Prefetch budget: {st.session_state.get('prefetch_spent', 0)} of {PREFETCH_BUDGET} calls used")
             
         # Historical Analysis Section
         st.header("Analysis History")
+        history_to_load = None
         if st.session_state.analysis_history:
             selected_history = st.selectbox(
                 "View Previous Analyses",
-                options=list(st.session_state.analysis_history.keys()),
+                options=st.session_state.analysis_history.keys(),
                 format_func=lambda x: f"{x.split('_')[0]} - {x.split('_')[1]}"
             )
             if st.button("Load Selected Analysis"):
-                st.session_state.analysis_results = st.session_state.analysis_history[selected_history]
-                st.session_state.show_analysis = True
+                history_to_load = selected_history
 
     # Load data
-    df = load_data(uploaded_file)
-    if df is None:
+    corpus = load_corpus(uploaded_file)
+    if corpus is None:
         return
 
+    # History keeps quotes as spans, so they are rebuilt from the file they came from
+    if history_to_load is not None:
+        entry = st.session_state.analysis_history.get(history_to_load)
+        source = None
+        if entry is not None:
+            dataset = shared.registry.get(entry.fingerprint)
+            source = corpus if entry.fingerprint == corpus.fingerprint else dataset.corpus if dataset is not None else None
+        if source is None:
+            with st.sidebar:
+                st.warning("That analysis was made on a different file. Upload it again to view it.")
+        else:
+            st.session_state.analysis_results = entry.to_result(source)
+            st.session_state.show_analysis = True
+    
+    with st.sidebar:
+        for note in corpus.ingest_notes:
+            st.caption(note)
+    
+    with st.sidebar:
+        if st.button("Clear cached results", help="Forget the parsed data and heatmap kept for this file"):
+            # Reparsed on the next run unless another session is still using it
+            shared.registry.release(session_holder())
+            memo.results.invalidate(corpus.fingerprint)
+            st.session_state.pop('heatmap_job', None)
+            st.query_params.pop('heatmap_job', None)
+            st.rerun()
+
     # Create tabs for different views
-    analysis_tab, heatmap_tab = st.tabs(["Response Analysis", "Heatmap Analysis"])
+    analysis_tab, heatmap_tab, trends_tab = st.tabs(["Response Analysis", "Heatmap Analysis", "Trends"])
     
     # Analysis tab content
     with analysis_tab:
@@ -229,10 +527,11 @@ def main():
         with col1:
             st.header("Select Student")
             
-            # Get unique students from the DataFrame and add "All Students" option
-            students = df['Student'].dropna().unique().tolist()
-            students = ['All Students'] + students
+            # Students come from the corpus, with an "All Students" option
+            students = ['All Students'] + corpus.students
             selected_student = st.selectbox("", students)
+            if use_prefetch and selected_student != 'All Students':
+                prefetch_students(corpus, selected_student)
 
             # Analyze button placed above response section
             analyze_button = st.button("Analyze Responses")
@@ -242,50 +541,9 @@ def main():
             # Get student responses
             if selected_student:
                 if selected_student == 'All Students':
-                    # Combine all student responses
-                    all_responses = []
-                    for _, student_data in df.iterrows():
-                        response = f"""
-                        Student: {student_data['Student']}
-                        
-                        Student Information Needed:
-                        {student_data['What student information do you need to plan the lesson?']}
-                        
-                        Information from Other Teachers:
-                        {student_data['What information would you ask of the other fifth-grade teachers?']}
-                        
-                        Student Engagement:
-                        {student_data['How would you ensure all students are engaged in the lesson?']}
-                        
-                        Assessment Approach:
-                        {student_data['How would you assess the assignment?']}
-                        
-                        Objectives Assessment:
-                        {student_data["How would you assess students' understanding of each of the objectives?"]}
-                        """
-                        all_responses.append(response)
-                    response_text = "\n\n".join(all_responses)
+                    response_text = corpus.all_students_document
                 else:
-                    # Single student response
-                    student_data = df[df['Student'] == selected_student].iloc[0]
-                    response_text = f"""
-                    "{selected_student}, 5th Grade Teacher"
-
-                    Student Information:
-                    {student_data['What student information do you need to plan the lesson?']}
-
-                    Information from Other Teachers:
-                    {student_data['What information would you ask of the other fifth-grade teachers?']}
-
-                    Student Engagement:
-                    {student_data['How would you ensure all students are engaged in the lesson?']}
-
-                    Assessment Approach:
-                    {student_data['How would you assess the assignment?']}
-
-                    Objectives Assessment:
-                    {student_data["How would you assess students' understanding of each of the objectives?"]}
-                    """
+                    response_text = corpus.document(selected_student)
                 
                 # Add a container with custom styling for the response text
                 st.markdown(f"""
@@ -294,101 +552,195 @@ def main():
                     </div>
                     """, unsafe_allow_html=True)
                 
-                # Handle analysis when button is clicked
+                # The analysis runs as a background job, so reruns and disconnects don't lose it
                 if analyze_button:
-                    analysis_results = analyze_response(response_text)
-                    st.session_state['analysis_results'] = analysis_results
+                    job_id = get_job_queue().submit(
+                        "analysis",
+                        make_key("analysis", corpus.fingerprint, selected_student, MODEL, PROMPT_VERSION),
+                        analysis_job(corpus, selected_student),
+                        params={"fingerprint": corpus.fingerprint, "student": selected_student}
+                    )
+                    attach_job('analysis_job', job_id)
+
+        with col2:
+            job = job_for('analysis_job', corpus)
+            recorded = st.session_state.setdefault('recorded_jobs', set())
+            if job is not None and not job.finished:
+                # Codes are shown as soon as they arrive
+                def show_analysis_job(job):
+                    status = "Receiving results..."
+                    if job.params["student"] == 'All Students':
+                        status = f"Merged {job.done} of {job.total} chunks..." if job.total else "Analyzing all students..."
+                    show_partial_results(st.empty(), job.partial or {}, status)
+
+                watch_job(job.id, show_analysis_job)
+            elif job is not None and job.id not in recorded:
+                recorded.add(job.id)
+                if job.status == DONE:
+                    st.session_state['analysis_results'] = job.result
                     st.session_state['show_analysis'] = True
-                    
-                    # Add to history with timestamp
-                    from datetime import datetime
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    history_key = f"{selected_student}_{timestamp}"
-                    st.session_state.analysis_history[history_key] = analysis_results
+
+                    # Add to history with the time the analysis was requested
+                    timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(job.created))
+                    history_key = f"{job.params['student']}_{timestamp}"
+                    st.session_state.analysis_history.add(history_key, job.result, corpus)
                     st.success("Analysis completed and saved to history!")
+                else:
+                    st.error(f"Analysis did not finish ({job.status}): {job.error or 'the server restarted'}")
 
-        with col2:
             st.header("Analysis Results")
             
-            if 'show_analysis' in st.session_state and st.session_state['show_analysis']:
+            if (job is None or job.finished) and st.session_state.get('show_analysis'):
                 results = st.session_state['analysis_results']
                 
                 st.subheader("Predetermined Codes")
-                codes = [
-                    "Academic Language Support",
-                    "Grammar Support",
-                    "Content Knowledge Support",
-                    "Collaboration with Teachers",
-                    "Student Engagement",
-                    "Assessment of Language Proficiency"
-                ]
+                codes = PREDETERMINED_CODES
                 
                 for code in codes:
                     with st.expander(f"{code}", expanded=False):
                         quotes = results['predetermined_codes'].get(code, ["No direct quote found"])
+                        unverified = results.get('unverified_quotes', {}).get(code, [])
                         for quote in quotes:
-                            st.markdown(f"- {quote}")
+                            if quote in unverified:
+                                st.markdown(f"- {quote} ⚠️ *not found in the source text*")
+                            else:
+                                st.markdown(f"- {quote}")
                 
                 st.subheader("Emergent Codes")
-                emergent_codes = [
-                    "Perceptions of Language Acquisition",
-                    "Perceived Challenges",
-                    "Innovative Practices",
-                    "Perceptions of Error"
-                ]
+                emergent_codes = EMERGENT_CODES
                 
                 for code in emergent_codes:
                     with st.expander(f"{code}", expanded=False):
                         quotes = results['emergent_codes'].get(code, ["No direct quote found"])
+                        unverified = results.get('unverified_quotes', {}).get(code, [])
                         for quote in quotes:
-                            st.markdown(f"- {quote}")
+                            if quote in unverified:
+                                st.markdown(f"- {quote} ⚠️ *not found in the source text*")
+                            else:
+                                st.markdown(f"- {quote}")
                 
                 st.markdown("---")
                 st.subheader("Export Analysis")
                 
-                if st.button("Export Analysis Results"):
-                    # Get student name for export
-                    student_identifier = "all_students" if selected_student == "All Students" else selected_student
-                    
-                    # Create DataFrame for predetermined codes
-                    predetermined_df = pd.DataFrame([
-                        {"Student": student_identifier, "Category": code, "Analysis": results['predetermined_codes'].get(code, "")}
-                        for code in codes
-                    ])
-                    
-                    # Create DataFrame for emergent codes
-                    emergent_df = pd.DataFrame([
-                        {"Student": student_identifier, "Category": code, "Analysis": results['emergent_codes'].get(code, "")}
-                        for code in emergent_codes
-                    ])
-                    
-                    # Combine both DataFrames
-                    export_df = pd.concat([
-                        predetermined_df.assign(Type="Predetermined"),
-                        emergent_df.assign(Type="Emergent")
-                    ])
-                    
-                    # Convert DataFrame to CSV for download
-                    csv = export_df.to_csv(index=False)
-                    filename = f"response_analysis_{student_identifier.lower().replace(' ', '_')}.csv"
+                # The displayed result, one row per quote
+                student_identifier = "all_students" if selected_student == "All Students" else selected_student
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(COLUMNS)
+                writer.writerows(result_rows(None if selected_student == "All Students" else selected_student, results))
+                st.download_button(
+                    label="Export Analysis Results",
+                    data=buffer.getvalue(),
+                    file_name=f"response_analysis_{student_identifier.lower().replace(' ', '_')}.csv",
+                    mime="text/csv"
+                )
+
+            st.markdown("---")
+            st.subheader("Export All Students")
+            st.caption("Every student's verified quotes, one row per quote. Students not yet analyzed are analyzed as the file is written.")
+            export_format = st.selectbox("Format", list(EXPORT_FORMATS), key="export_format")
+            extension, mime = EXPORT_FORMATS[export_format]
+            export_params = {"format": export_format, "dedup": use_dedup}
+            if st.button("Export All Students"):
+                job_id = get_job_queue().submit(
+                    "export",
+                    make_key("export", corpus.fingerprint, export_format, use_dedup, MODEL, PROMPT_VERSION),
+                    export_job(corpus, export_format, use_dedup),
+                    params={"fingerprint": corpus.fingerprint, **export_params}
+                )
+                attach_job('export_job', job_id)
+            job = job_for('export_job', corpus, **export_params)
+            if job is not None and not job.finished:
+                watch_job(job.id, lambda job: st.progress(
+                    job.fraction, text=f"Exported {job.done} of {job.total} students" if job.total else "Starting export..."
+                ))
+            elif job is not None and job.status != DONE:
+                st.error(f"Error exporting ({job.status}): {job.error or 'the server restarted'}")
+            elif job is not None and os.path.exists(job.result["path"]):
+                st.caption(f"{job.result['rows']} rows ready.")
+                with open(job.result["path"], "rb") as f:
                     st.download_button(
-                        label="Download Analysis CSV",
-                        data=csv,
-                        file_name=filename,
-                        mime="text/csv"
+                        label="Download All Students",
+                        data=f,
+                        file_name=f"response_analysis_all_students{extension}",
+                        mime=mime
                     )
+            elif job is not None:
+                st.info("That export has expired. Export again to download it.")
 
     # Heatmap tab content
     with heatmap_tab:
         st.header("Response Analysis Heatmap")
         st.write("This heatmap shows the depth of responses across different questions for each student.")
         
-        if st.button("Generate Heatmap"):
+        concurrency = st.slider(
+            "Concurrent analyses",
+            min_value=1,
+            max_value=32,
+            value=DEFAULT_CONCURRENCY,
+            help="Number of students analyzed in parallel. Lower this if you hit API rate limits."
+        )
+        
+        # Compare against the last heatmap this session drew for the same options
+        snapshot = st.session_state.get('heatmap_snapshot')
+        options = options_key(use_dedup)
+        previous = None
+        if snapshot is not None and snapshot['options'] == options:
+            previous = (snapshot['students'], snapshot['matrix'])
+            diff = RowDiff(snapshot['fingerprints'], row_fingerprints(corpus))
+            if diff:
+                st.info(f"Changes since the last heatmap: {diff.summary()}. Only those students will be re-analyzed.")
+
+        cached_heatmap = memo.results.get(heatmap_key(corpus, use_dedup))
+        job_params = {"dedup": use_dedup}
+        if st.button("Generate Heatmap") and cached_heatmap is None:
+            job_id = get_job_queue().submit(
+                "heatmap",
+                make_key(*heatmap_key(corpus, use_dedup)),
+                heatmap_job(corpus, concurrency, use_dedup, previous),
+                params={"fingerprint": corpus.fingerprint, **job_params}
+            )
+            attach_job('heatmap_job', job_id)
+        job = job_for('heatmap_job', corpus, **job_params)
+
+        if job is not None and not job.finished:
+            # Redraw the partial matrix as students complete, at most once per REDRAW_SECONDS
+            def show_heatmap_job(job):
+                st.progress(job.fraction, text=f"Completed {job.done} of {job.total} analyses" if job.total else "Generating heatmap...")
+                drawn = st.session_state.get('heatmap_partial')
+                if job.partial is not None and (drawn is None or time.monotonic() - drawn[0] >= REDRAW_SECONDS):
+                    drawn = (time.monotonic(), render_heatmap(job.partial, corpus.students))
+                    st.session_state['heatmap_partial'] = drawn
+                if drawn is not None:
+                    st.image(drawn[1])
+
+            watch_job(job.id, show_heatmap_job)
+        elif job is not None and job.status != DONE and cached_heatmap is None:
+            st.error(f"Error generating heatmap ({job.status}): {job.error or 'the server restarted'}")
+        elif cached_heatmap is not None or job is not None:
+            st.session_state.pop('heatmap_partial', None)
             try:
-                with st.spinner("Generating heatmap..."):
-                    fig = generate_heatmap(df)
-                    st.pyplot(fig)
-                    plt.close()
+                if cached_heatmap is not None:
+                    matrix, image = cached_heatmap
+                else:
+                    import numpy as np
+                    matrix, image = np.array(job.result["matrix"]), base64.b64decode(job.result["image"])
+                st.image(image)
+                st.session_state['heatmap_snapshot'] = {
+                    'options': options,
+                    'students': list(corpus.students),
+                    'fingerprints': row_fingerprints(corpus),
+                    'matrix': matrix
+                }
+
+                if len(corpus.students) > MAX_ROWS:
+                    st.caption(
+                        f"{len(corpus.students)} students are grouped by code profile into {MAX_ROWS} rows "
+                        "showing mean counts. Per-student counts are in the table below."
+                    )
+                # The table is virtualized, so every student can be browsed and sorted
+                with st.expander("Per-student code counts", expanded=len(corpus.students) > MAX_ROWS):
+                    show_counts_table(matrix, corpus.students)
 
                 st.markdown("""
                 ### Understanding the Heatmap
@@ -402,6 +754,14 @@ def main():
                 st.error(f"Error generating heatmap: {str(e)}")
                 print(f"Heatmap generation error: {str(e)}")
 
+    # Rendered last so the numbers include this run's calls
+    # Trends tab content
+    with trends_tab:
+        show_trends(corpus)
+
+    with st.sidebar:
+        show_metrics()
+
 if __name__ == "__main__":
     # Apply custom styles
     apply_styles()
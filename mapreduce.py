@@ -0,0 +1,75 @@
+import os
+from analysis import SECTIONS, NO_QUOTE, error_result
+from engine import analyze_many, DEFAULT_CONCURRENCY
+
+# Input tokens of student text packed into each map prompt
+CHUNK_TOKEN_BUDGET = int(os.environ.get("ANALYSIS_CHUNK_TOKENS", "6000"))
+
+def estimate_tokens(text):
+    # ~4 characters per token for English text with GPT-4o's tokenizer
+    return len(text) // 4 + 1
+
+def pack_documents(documents, token_budget=CHUNK_TOKEN_BUDGET):
+    """Greedily packs documents, in order, into chunks of at most token_budget tokens.
+
+    A single document larger than the budget gets a chunk of its own.
+    """
+    chunks = []
+    current = []
+    used = 0
+    for document in documents:
+        tokens = estimate_tokens(document)
+        if current and used + tokens > token_budget:
+            chunks.append("\n\n".join(current))
+            current = []
+            used = 0
+        current.append(document)
+        used += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def merge_results(results):
+    """Reduces per-chunk analyses into one result with the usual structure."""
+    merged = {section: {code: [] for code in codes} for section, codes in SECTIONS}
+    failed = 0
+    for result in results:
+        if not isinstance(result, dict) or 'error' in result.get('predetermined_codes', {}):
+            failed += 1
+            continue
+        for section, codes in SECTIONS:
+            found = result.get(section, {})
+            for code in codes:
+                for quote in found.get(code, []):
+                    if quote != NO_QUOTE and quote not in merged[section][code]:
+                        merged[section][code].append(quote)
+
+    if results and failed == len(results):
+        return error_result(f"all {failed} chunks failed")
+
+    for section in merged.values():
+        for code, quotes in section.items():
+            if not quotes:
+                section[code] = [NO_QUOTE]
+    if failed:
+        merged['failed_chunks'] = failed
+    return merged
+
+def analyze_cohort(corpus, token_budget=CHUNK_TOKEN_BUDGET, max_concurrency=DEFAULT_CONCURRENCY, on_progress=None):
+    """Map-reduce analysis of every student in the corpus.
+
+    Students are packed into token-budgeted chunks that are analyzed in
+    parallel and merged. `on_progress(done, total, partial)` receives the
+    merge of the chunks finished so far.
+    """
+    chunks = pack_documents([corpus.document(s) for s in corpus.students], token_budget)
+    finished = []
+
+    def collect(key, result):
+        finished.append(result)
+        if on_progress is not None:
+            on_progress(len(finished), len(chunks), merge_results(finished))
+
+    print(f"Analyzing {len(corpus)} students in {len(chunks)} chunks")
+    results = analyze_many(list(enumerate(chunks)), max_concurrency=max_concurrency, on_result=collect)
+    return merge_results([results[i] for i in range(len(chunks))])
@@ -0,0 +1,89 @@
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Process-wide, memory-bounded cache for work derived from an uploaded file:
+# the parsed corpus, the heatmap matrix and the rendered figure. Entries are
+# keyed by (content fingerprint, kind, options) so they survive Streamlit
+# reruns and are shared by every session that uploads the same file.
+
+MAX_BYTES = int(float(os.environ.get("MEMO_MAX_MB", "256")) * 1024 * 1024)
+
+def fingerprint(data):
+    """Content hash of an uploaded file's bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+# path -> ((mtime, size), fingerprint). Kept here rather than in the Streamlit
+# script, which runs as a fresh module on every rerun.
+_file_fingerprints = {}
+
+def file_fingerprint(path):
+    """Content hash of the file at path, reread only when its mtime or size changes."""
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _file_fingerprints.get(path)
+    if cached is None or cached[0] != version:
+        with open(path, "rb") as f:
+            cached = _file_fingerprints[path] = (version, fingerprint(f.read()))
+    return cached[1]
+
+def estimate_size(value):
+    """Rough retained size in bytes of a cached value."""
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_size(item) for item in value)
+    if hasattr(value, "memory_size"):
+        return int(value.memory_size())
+    return sys.getsizeof(value)
+
+class BoundedCache:
+    """Thread-safe LRU cache bounded by the estimated size of its values."""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+        return value
+
+    def invalidate(self, file_fingerprint):
+        """Drops every entry derived from the given file."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == file_fingerprint]:
+                self.size -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+results = BoundedCache()
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+
+# Process-wide counters for every model call: latency, token usage, retries,
+# errors and analysis cache hits. Recording is a few increments under a lock.
+# Aggregates are shown in the sidebar and can be exported as Prometheus text
+# or JSON; set ANALYSIS_METRICS_PATH (*.json for JSON, anything else for
+# Prometheus text) to have them written after each run.
+
+METRICS_PATH = os.environ.get("ANALYSIS_METRICS_PATH")
+# Minimum seconds between writes of the metrics file
+FLUSH_INTERVAL = 5.0
+# Upper bounds, in seconds, of the call latency histogram buckets
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+# Recent latencies kept for the sidebar percentiles
+RECENT_CALLS = 1000
+
+def usage_tokens(usage):
+    """(prompt, completion) tokens from an API usage object or dict."""
+    if usage is None:
+        return 0, 0
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens", 0) or 0, usage.get("completion_tokens", 0) or 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.calls = {"ok": 0, "error": 0}
+            self.errors = {}
+            self.retries = 0
+            self.coalesced = 0
+            self.rate_limited = 0
+            self.cache = {"hit": 0, "miss": 0}
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+            self.latency_sum = 0.0
+            self.recent = deque(maxlen=RECENT_CALLS)
+
+    def record_call(self, seconds, usage=None, error=None):
+        """Records one model call, successful or not."""
+        prompt, completion = usage_tokens(usage)
+        with self._lock:
+            if error is None:
+                self.calls["ok"] += 1
+            else:
+                self.calls["error"] += 1
+                name = type(error).__name__
+                self.errors[name] = self.errors.get(name, 0) + 1
+                if getattr(error, "status_code", None) == 429:
+                    self.rate_limited += 1
+            self.prompt_tokens += prompt
+            self.completion_tokens += completion
+            self.latency_buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.latency_sum += seconds
+            self.recent.append(seconds)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_coalesced(self):
+        """An identical request was already in flight and its call was shared."""
+        with self._lock:
+            self.coalesced += 1
+
+    def record_cache(self, hit):
+        with self._lock:
+            self.cache["hit" if hit else "miss"] += 1
+
+    def percentile(self, q):
+        with self._lock:
+            recent = sorted(self.recent)
+        if not recent:
+            return None
+        return recent[min(len(recent) - 1, int(q * len(recent)))]
+
+    def snapshot(self):
+        with self._lock:
+            calls = self.calls["ok"] + self.calls["error"]
+            lookups = self.cache["hit"] + self.cache["miss"]
+            snapshot = {
+                "since": self.started,
+                "calls": dict(self.calls),
+                "errors": dict(self.errors),
+                "retries": self.retries,
+                "coalesced": self.coalesced,
+                "rate_limited": self.rate_limited,
+                "cache": dict(self.cache),
+                "cache_hit_rate": self.cache["hit"] / lookups if lookups else None,
+                "tokens": {"prompt": self.prompt_tokens, "completion": self.completion_tokens},
+                "latency_seconds": {
+                    "count": calls,
+                    "sum": self.latency_sum,
+                    "mean": self.latency_sum / calls if calls else None,
+                    "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], self.latency_buckets))
+                }
+            }
+        snapshot["latency_seconds"]["p50"] = self.percentile(0.5)
+        snapshot["latency_seconds"]["p95"] = self.percentile(0.95)
+        return snapshot
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        s = self.snapshot()
+        lines = [
+            "# HELP analysis_calls_total Model calls by outcome.",
+            "# TYPE analysis_calls_total counter"
+        ]
+        lines += [f'analysis_calls_total{{outcome="{k}"}} {v}' for k, v in s["calls"].items()]
+        lines += ["# HELP analysis_errors_total Failed model calls by exception type.", "# TYPE analysis_errors_total counter"]
+        lines += [f'analysis_errors_total{{type="{k}"}} {v}' for k, v in sorted(s["errors"].items())]
+        lines += [
+            "# HELP analysis_retries_total Model calls retried after an error.",
+            "# TYPE analysis_retries_total counter",
+            f"analysis_retries_total {s['retries']}",
+            "# HELP analysis_coalesced_total Requests that shared an identical call already in flight.",
+            "# TYPE analysis_coalesced_total counter",
+            f"analysis_coalesced_total {s['coalesced']}",
+            "# HELP analysis_rate_limited_total Model calls rejected with HTTP 429.",
+            "# TYPE analysis_rate_limited_total counter",
+            f"analysis_rate_limited_total {s['rate_limited']}",
+            "# HELP analysis_cache_lookups_total Analysis cache lookups by result.",
+            "# TYPE analysis_cache_lookups_total counter"
+        ]
+        lines += [f'analysis_cache_lookups_total{{result="{k}"}} {v}' for k, v in s["cache"].items()]
+        lines += ["# HELP analysis_tokens_total Tokens used by model calls.", "# TYPE analysis_tokens_total counter"]
+        lines += [f'analysis_tokens_total{{kind="{k}"}} {v}' for k, v in s["tokens"].items()]
+        lines += ["# HELP analysis_call_seconds Model call latency.", "# TYPE analysis_call_seconds histogram"]
+        cumulative = 0
+        for bound, count in s["latency_seconds"]["buckets"].items():
+            cumulative += count
+            lines.append(f'analysis_call_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"analysis_call_seconds_sum {s['latency_seconds']['sum']:.6f}")
+        lines.append(f"analysis_call_seconds_count {s['latency_seconds']['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes the metrics to path atomically, as JSON for *.json and Prometheus text otherwise."""
+        text = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def flush(self, force=False):
+        """Writes METRICS_PATH, if set, at most once per FLUSH_INTERVAL unless forced."""
+        if not METRICS_PATH:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        try:
+            self.write(METRICS_PATH)
+        except Exception as e:
+            print(f"Writing metrics failed: {str(e)}")
+
+metrics = Metrics()
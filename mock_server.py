@@ -0,0 +1,305 @@
+import re
+import json
+import time
+import zlib
+import random
+import uuid
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from analysis import PREDETERMINED_CODES, EMERGENT_CODES, NO_QUOTE
+
+# Local stand-in for the parts of the OpenAI API this app uses: chat
+# completions, file upload/download and batches. Point the app at it with
+#   OPENAI_BASE_URL=http://127.0.0.1:8011/v1 OPENAI_API_KEY=test
+# Chat completions can be slowed down with --latency/--jitter and a share of
+# them answered with 429s (--rate-limit) to exercise the retry path.
+
+STUDENT_LINE = re.compile(r"^\s*Student: (.+)$", re.MULTILINE)
+SENTENCE = re.compile(r"[^.!?\n]+[.!?]")
+# A numbered sentence in a sentence-reference prompt
+NUMBERED = re.compile(r"\[(\d+)\] ([^\[\n]+)")
+
+def fake_analysis(text):
+    """Deterministic analysis whose quotes are real sentences from the text."""
+    # Only look at the student text embedded in the prompt
+    if "Text to analyze:" in text:
+        text = text.split("Text to analyze:", 1)[1].split("Return a JSON object", 1)[0]
+    names = STUDENT_LINE.findall(text)
+    blocks = STUDENT_LINE.split(text)[1:]
+    quotes = []
+    for name, body in zip(blocks[0::2], blocks[1::2]):
+        for sentence in SENTENCE.findall(body):
+            quotes.append(f"{name.strip()}: '{sentence.strip()}'")
+    if not names:
+        quotes = [f"Student: '{s.strip()}'" for s in SENTENCE.findall(text)]
+
+    result = {"predetermined_codes": {}, "emergent_codes": {}}
+    for section, codes in (("predetermined_codes", PREDETERMINED_CODES), ("emergent_codes", EMERGENT_CODES)):
+        for code in codes:
+            picked = [q for q in quotes if zlib.crc32((code + q).encode()) % 4 == 0]
+            result[section][code] = picked or [NO_QUOTE]
+    return result
+
+def fake_references(text):
+    """Deterministic sentence-reference reply for a numbered prompt."""
+    text = text.split("Text to analyze:", 1)[1].split("Return a JSON object", 1)[0]
+    sentences = [(int(number), sentence.strip()) for number, sentence in NUMBERED.findall(text)]
+    result = {"predetermined_codes": {}, "emergent_codes": {}}
+    for section, codes in (("predetermined_codes", PREDETERMINED_CODES), ("emergent_codes", EMERGENT_CODES)):
+        for code in codes:
+            result[section][code] = [n for n, s in sentences if zlib.crc32((code + s).encode()) % 4 == 0]
+    return result
+
+def chat_completion(body):
+    text = body["messages"][-1]["content"]
+    if (body.get("response_format") or {}).get("type") == "json_schema":
+        content = json.dumps(fake_references(text))
+    else:
+        content = json.dumps(fake_analysis(text))
+    prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4
+        }
+    }
+
+STREAM_CHUNK_CHARS = 24
+
+def completion_chunks(completion, include_usage=False):
+    """Splits a completion into the chat.completion.chunk events of a streamed reply."""
+    content = completion["choices"][0]["message"]["content"]
+    base = {k: completion[k] for k in ("id", "created", "model")}
+    base["object"] = "chat.completion.chunk"
+    deltas = [{"role": "assistant", "content": ""}]
+    deltas += [{"content": content[i:i + STREAM_CHUNK_CHARS]} for i in range(0, len(content), STREAM_CHUNK_CHARS)]
+    for delta in deltas:
+        yield dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+    yield dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+    if include_usage:
+        yield dict(base, choices=[], usage=completion["usage"])
+
+class MockState:
+    def __init__(self, batch_delay=0.0, latency=0.0, jitter=0.0, rate_limit=0.0, retry_after=1.0, seed=None,
+                 token_latency=0.0):
+        self.batch_delay = batch_delay
+        # Seconds each chat completion takes, +/- jitter as a fraction of it
+        self.latency = latency
+        self.jitter = jitter
+        # Extra seconds per completion token, as generation time grows with output
+        self.token_latency = token_latency
+        # Fraction of chat completions rejected with a 429 and a Retry-After hint
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.files = {}
+        self.batches = {}
+        self.stats = {"chat_requests": 0, "rate_limited": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.lock = threading.Lock()
+
+    def admit_chat(self):
+        """Counts a chat request and decides whether it is rate limited; returns its delay."""
+        with self.lock:
+            self.stats["chat_requests"] += 1
+            limited = self.random.random() < self.rate_limit
+            if limited:
+                self.stats["rate_limited"] += 1
+            delay = self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+        return limited, max(0.0, delay)
+
+    def record_usage(self, completion):
+        with self.lock:
+            self.stats["prompt_tokens"] += completion["usage"]["prompt_tokens"]
+            self.stats["completion_tokens"] += completion["usage"]["completion_tokens"]
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def add_file(self, filename, purpose, content):
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        record = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed"
+        }
+        with self.lock:
+            self.files[file_id] = (record, content)
+        return record
+
+    def create_batch(self, body):
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0}
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        threading.Thread(target=self._run_batch, args=(batch_id,), daemon=True).start()
+        return batch
+
+    def _run_batch(self, batch_id):
+        batch = self.batches[batch_id]
+        _, content = self.files[batch["input_file_id"]]
+        lines = [json.loads(line) for line in content.decode("utf-8").splitlines() if line.strip()]
+        batch["request_counts"]["total"] = len(lines)
+        batch["status"] = "in_progress"
+        time.sleep(self.batch_delay)
+
+        output = []
+        for line in lines:
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": line["custom_id"],
+                "response": {"status_code": 200, "body": chat_completion(line["body"])},
+                "error": None
+            }))
+            batch["request_counts"]["completed"] += 1
+        record = self.add_file("batch_output.jsonl", "batch_output", ("\n".join(output) + "\n").encode("utf-8"))
+        batch["output_file_id"] = record["id"]
+        batch["status"] = "completed"
+
+class MockHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_rate_limited(self):
+        data = json.dumps({"error": {
+            "message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"
+        }}).encode("utf-8")
+        self.send_response(429)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Retry-After", str(self.state.retry_after))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, completion, include_usage=False):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for chunk in completion_chunks(completion, include_usage):
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        body = self._body()
+        if self.path.endswith("/chat/completions"):
+            limited, delay = self.state.admit_chat()
+            if limited:
+                return self._send_rate_limited()
+            request = json.loads(body)
+            completion = chat_completion(request)
+            time.sleep(delay + self.state.token_latency * completion["usage"]["completion_tokens"])
+            self.state.record_usage(completion)
+            if request.get("stream"):
+                self._send_stream(completion, (request.get("stream_options") or {}).get("include_usage", False))
+            else:
+                self._send_json(completion)
+        elif self.path.endswith("/files"):
+            message = BytesParser(policy=HTTP).parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body
+            )
+            fields = {}
+            filename = "upload.jsonl"
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                fields[name] = part.get_payload(decode=True)
+                if name == "file":
+                    filename = part.get_filename() or filename
+            record = self.state.add_file(filename, fields.get("purpose", b"batch").decode(), fields["file"])
+            self._send_json(record)
+        elif self.path.endswith("/batches"):
+            self._send_json(self.state.create_batch(json.loads(body)))
+        else:
+            self._send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+    def do_GET(self):
+        parts = self.path.rstrip("/").split("/")
+        if len(parts) >= 3 and parts[-1] == "content" and parts[-3] == "files":
+            record = self.state.files.get(parts[-2])
+            if record is None:
+                return self._send_json({"error": {"message": "No such file"}}, status=404)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(record[1])))
+            self.end_headers()
+            self.wfile.write(record[1])
+        elif parts[-1] == "stats":
+            self._send_json(self.state.snapshot())
+        elif parts[-2] == "batches" and parts[-1] in self.state.batches:
+            self._send_json(self.state.batches[parts[-1]])
+        else:
+            self._send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+def start_server(port=0, batch_delay=0.0, **options):
+    """Starts the mock server on a background thread. Returns (server, base_url).
+
+    `options` are passed to MockState; the state is server.RequestHandlerClass.state.
+    """
+    handler = type("Handler", (MockHandler,), {"state": MockState(batch_delay, **options)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in server")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="Seconds each batch stays in progress")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each chat completion takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Latency varies by up to this fraction either way")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of chat completions answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Extra seconds per completion token")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    server, url = start_server(
+        args.port, args.batch_delay, latency=args.latency, jitter=args.jitter,
+        rate_limit=args.rate_limit, retry_after=args.retry_after, seed=args.seed, token_latency=args.token_latency
+    )
+    print(f"Mock OpenAI server listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,110 @@
+import re
+from functools import lru_cache
+from analysis import PREDETERMINED_CODES, EMERGENT_CODES, SECTIONS, NO_QUOTE
+from corpus import QUESTION_LABELS
+
+# Sentence-reference output mode (ANALYSIS_OUTPUT=spans). The text sent to
+# the model has every answer sentence numbered, and a strict JSON schema
+# makes the model reply with sentence numbers per code instead of repeating
+# each quote. The numbers are turned back into "Student Name: 'sentence'"
+# quotes locally, so the rest of the app sees the usual result shape.
+
+STUDENT_LINE = re.compile(r"^Student: (.+)$")
+LABEL_LINES = {f"{label}:" for label in QUESTION_LABELS}
+# A sentence ends at . ! ? or ; followed by whitespace
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?;])\s+")
+
+@lru_cache(maxsize=512)
+def number_sentences(text):
+    """Returns (numbered text, sentences) for a rendered document.
+
+    Answer sentences are prefixed with [1], [2], ... in order;
+    sentences[n - 1] is the (student, sentence) that [n] refers to. Student
+    and question label lines are left as they are.
+    """
+    lines = []
+    sentences = []
+    student = None
+    for line in text.split("\n"):
+        match = STUDENT_LINE.match(line)
+        if match:
+            student = match.group(1).strip()
+            lines.append(line)
+            continue
+        if not line.strip() or line.strip() in LABEL_LINES:
+            lines.append(line)
+            continue
+        parts = []
+        for sentence in SENTENCE_SPLIT.split(line):
+            sentence = sentence.strip()
+            if sentence:
+                sentences.append((student, sentence))
+                parts.append(f"[{len(sentences)}] {sentence}")
+        lines.append(" ".join(parts))
+    return "\n".join(lines), tuple(sentences)
+
+def response_format():
+    """Strict schema: every code maps to a list of sentence numbers."""
+    def section(codes):
+        return {
+            "type": "object",
+            "properties": {code: {"type": "array", "items": {"type": "integer"}} for code in codes},
+            "required": list(codes),
+            "additionalProperties": False
+        }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "code_references",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {section_name: section(codes) for section_name, codes in SECTIONS},
+                "required": [section_name for section_name, _ in SECTIONS],
+                "additionalProperties": False
+            }
+        }
+    }
+
+def build_prompt(text):
+    numbered, _ = number_sentences(text)
+    example = ", ".join(f'"{code}": [3, 7]' for code in PREDETERMINED_CODES[:2])
+    return f"""
+    Analyze the following special education response text. Every sentence is numbered like [12]. For each category, find the sentences that demonstrate that concept.
+
+    Text to analyze: {numbered}
+
+    Return a JSON object with "predetermined_codes" and "emergent_codes", each mapping every category to the numbers of its sentences, e.g. {{{example}, ...}}.
+    Predetermined categories: {", ".join(PREDETERMINED_CODES)}
+    Emergent categories: {", ".join(EMERGENT_CODES)}
+
+    Critical Instructions:
+    1. Only use sentence numbers that appear in the text
+    2. Include a sentence for a category only if it demonstrates that concept
+    3. Use an empty list if no sentence fits a category
+    4. Return numbers only - no quotes, text or explanation
+    """
+
+def rehydrate(found, sentences):
+    """Turns {code: [sentence numbers]} into {code: quotes}; unknown numbers are dropped."""
+    quotes = {}
+    for code, references in found.items():
+        entries = []
+        for reference in references if isinstance(references, list) else []:
+            if isinstance(reference, bool) or not isinstance(reference, int) or not 1 <= reference <= len(sentences):
+                continue
+            student, sentence = sentences[reference - 1]
+            entry = f"{student or 'Student'}: '{sentence}'"
+            if entry not in entries:
+                entries.append(entry)
+        quotes[code] = entries
+    return quotes
+
+def rehydrate_result(reply, text):
+    """Builds the usual analysis result from a sentence-reference reply to text."""
+    _, sentences = number_sentences(text)
+    result = {}
+    for section, codes in SECTIONS:
+        quotes = rehydrate(reply.get(section, {}), sentences)
+        result[section] = {code: quotes.get(code) or [NO_QUOTE] for code in codes}
+    return result
@@ -0,0 +1,436 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+from analysis import build_messages, cache_key, cached_result, error_result, make_async_client, request_analysis_async
+from metrics import metrics
+
+# Process-wide scheduler for model calls. Every analysis in the process goes
+# through one dispatcher thread with its own event loop and async client, so:
+# - requests and tokens share one token-bucket rate limit (a 429 pauses all),
+# - sessions take turns, so one large heatmap can't starve everyone else,
+# - identical prompts in flight at the same time share a single API call,
+# - speculative (prefetch) calls run only when nothing else is waiting.
+
+# Calls in flight across the whole process
+MAX_IN_FLIGHT = int(os.environ.get("ANALYSIS_MAX_IN_FLIGHT", "16"))
+# Account-level limits; 0 turns a limit off. Up to a minute's worth may burst.
+REQUESTS_PER_MINUTE = float(os.environ.get("ANALYSIS_RPM", "500"))
+TOKENS_PER_MINUTE = float(os.environ.get("ANALYSIS_TPM", "200000"))
+# Completion tokens budgeted per call when admitting it
+COMPLETION_ALLOWANCE = 1000
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+# Share of MAX_IN_FLIGHT that prefetch calls may occupy
+BACKGROUND_SHARE = 0.5
+# Prefetch calls queued process-wide; further prefetches are dropped
+MAX_BACKGROUND_QUEUED = 100
+
+# Which session submitted a request; set once per Streamlit script run
+current_session = contextvars.ContextVar("analysis_session", default="default")
+
+def retry_after_seconds(error):
+    """Reads the server's Retry-After hint from an API error, if there is one."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP-date form
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+def is_retryable(error):
+    import openai
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def estimate_call_tokens(text):
+    # ~4 characters per token, plus room for the reply
+    return sum(len(m["content"]) for m in build_messages(text)) // 4 + COMPLETION_ALLOWANCE
+
+class TokenBucket:
+    """Refills at `per_minute / 60` units a second up to a minute's worth. Not thread-safe."""
+
+    def __init__(self, per_minute):
+        self.unlimited = per_minute <= 0
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount):
+        """Seconds until `amount` can be taken; 0 if it can be taken now."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        if not self.unlimited:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+
+class Job:
+    def __init__(self, key, text, session, future, stream=False, background=False):
+        self.key = key
+        self.text = text
+        self.session = session
+        self.future = future
+        self.tokens = estimate_call_tokens(text)
+        # Streamed calls are made by the caller once admitted; see Reservation
+        self.stream = stream
+        # Prefetches wait until no other work is queued
+        self.background = background
+        self.admitted = threading.Event()
+        self.attempts = 0
+        self.not_before = 0.0
+
+class Reservation:
+    """A caller-run (streamed) call: wait() for a slot, then finish() with the result."""
+
+    def __init__(self, scheduler, job=None, shared=None):
+        self.scheduler = scheduler
+        self.job = job
+        # Set when an identical request was already in flight
+        self.shared = shared
+        self.done = False
+
+    def wait(self):
+        """Blocks until the call may be made; False if the scheduler failed the job instead."""
+        self.job.admitted.wait()
+        return not self.job.future.done()
+
+    def finish(self, result):
+        if not self.done:
+            self.done = True
+            self.scheduler._finish_stream(self.job, result)
+
+    def retry(self, error):
+        """Hands a failed call back to be retried as a regular one after backing off.
+
+        Returns False if the error isn't worth retrying; then finish() the
+        reservation with the error as usual.
+        """
+        if self.done:
+            return False
+        if self.scheduler._retry_stream(self.job, error):
+            self.done = True
+            return True
+        return False
+
+    def abandon(self):
+        """Gives the slot back; anyone sharing this request gets a regular call instead."""
+        if not self.done:
+            self.done = True
+            self.scheduler._abandon_stream(self.job)
+
+class Scheduler:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, max_retries=MAX_RETRIES):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_retries = max_retries
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+        # session -> queued jobs; sessions are served round-robin
+        self._queues = OrderedDict()
+        # Queued prefetch jobs, first in first out across sessions
+        self._background = deque()
+        self._in_flight = {}
+        self._active = 0
+        self._resume_at = 0.0
+        self._loop = None
+        self._wake = None
+        self._thread = None
+        self._ready = threading.Event()
+        # Set if the dispatcher couldn't start; every request then fails with it
+        self._error = None
+        # The event loop only keeps weak references to running tasks
+        self._tasks = set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._serve, name="analysis-scheduler", daemon=True)
+                self._thread.start()
+        self._ready.wait()
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wake = asyncio.Event()
+        self._ready.set()
+        try:
+            self._loop.run_until_complete(self._dispatch())
+        except Exception as e:
+            self._fail_all(e)
+
+    def _wake_up(self):
+        self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _enqueue(self, job, front=False):
+        queue = self._background if job.background else self._queues.setdefault(job.session, deque())
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+
+    def _register(self, text, session, stream, background=False):
+        """Returns (job, shared future); exactly one of them is None."""
+        key = cache_key(text)
+        with self._lock:
+            if self._error is not None:
+                failed = Future()
+                failed.set_result(error_result(self._error))
+                return None, failed
+            shared = self._in_flight.get(key)
+            if shared is not None:
+                metrics.record_coalesced()
+                if not background and self._promote(key):
+                    self._wake_up()
+                return None, shared
+            future = Future()
+            try:
+                job = Job(key, text, session or current_session.get(), future, stream, background)
+            except Exception as e:
+                # Not registered, so later identical requests don't wait on a call that never happens
+                print(f"Analysis failed: {str(e)}")
+                future.set_result(error_result(e))
+                return None, future
+            self._in_flight[key] = future
+            self._enqueue(job)
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return job, None
+
+    def _promote(self, key):
+        """Someone is now waiting on a queued prefetch; it takes its session's turn like any request."""
+        for job in self._background:
+            if job.key == key:
+                self._background.remove(job)
+                job.background = False
+                self._enqueue(job)
+                return True
+        return False
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def submit(self, text, session=None):
+        """Queues one analysis; returns a concurrent Future of its result (never raises)."""
+        cached = cached_result(text)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+        self._start()
+        job, shared = self._register(text, session, stream=False)
+        if shared is not None:
+            return shared
+        self._wake_up()
+        return job.future
+
+    def prefetch(self, text, session=None):
+        """Queues a speculative analysis at background priority so a later request finds it cached.
+
+        Returns True if a model call was queued; False if the text is cached,
+        already queued or in flight, or too many prefetches are waiting.
+        """
+        if cached_result(text, record=False) is not None:
+            return False
+        with self._lock:
+            if len(self._background) >= MAX_BACKGROUND_QUEUED:
+                return False
+        self._start()
+        job, shared = self._register(text, session, stream=False, background=True)
+        if shared is not None:
+            return False
+        self._wake_up()
+        return True
+
+    def reserve(self, text, session=None):
+        """Queues a streamed call that the caller makes itself once admitted."""
+        self._start()
+        job, shared = self._register(text, session, stream=True)
+        if shared is not None:
+            return Reservation(self, shared=shared)
+        self._wake_up()
+        return Reservation(self, job)
+
+    def _finish_stream(self, job, result):
+        with self._lock:
+            self._active -= 1
+        if not job.future.done():
+            job.future.set_result(result)
+        self._wake_up()
+
+    def _retry_stream(self, job, error):
+        # Once requeued the job may be dispatched at once, as a regular call
+        job.stream = False
+        if not self._schedule_retry(job, error):
+            # The caller finishes the reservation, which gives the slot back
+            job.stream = True
+            return False
+        with self._lock:
+            self._active -= 1
+        self._wake_up()
+        return True
+
+    def _abandon_stream(self, job):
+        with self._lock:
+            self._active -= 1
+            job.stream = False
+            self._enqueue(job, front=True)
+        self._wake_up()
+
+    def _next_job(self):
+        """Pops the next admissible job, or returns (None, seconds to wait or None)."""
+        now = time.monotonic()
+        with self._lock:
+            if self._active >= self.max_in_flight:
+                return None, None
+            if now < self._resume_at:
+                return None, self._resume_at - now
+            wait = None
+            for session in list(self._queues):
+                queue = self._queues[session]
+                if not queue:
+                    del self._queues[session]
+                    continue
+                job = queue[0]
+                if job.not_before > now:
+                    # Backing off after an error; other sessions may go first
+                    ready_in = job.not_before - now
+                    wait = ready_in if wait is None else min(wait, ready_in)
+                    continue
+                delay = max(self.requests.delay_for(1), self.tokens.delay_for(job.tokens))
+                if delay > 0:
+                    return None, delay
+                queue.popleft()
+                self.requests.take(1)
+                self.tokens.take(job.tokens)
+                self._active += 1
+                # This session goes to the back of the line
+                self._queues.move_to_end(session)
+                return job, None
+            if self._queues or not self._background:
+                return None, wait
+            # Nothing else is waiting: a prefetch may use part of the capacity
+            if self._active >= max(1, int(self.max_in_flight * BACKGROUND_SHARE)):
+                return None, None
+            job = self._background[0]
+            if job.not_before > now:
+                return None, job.not_before - now
+            delay = max(self.requests.delay_for(1), self.tokens.delay_for(job.tokens))
+            if delay > 0:
+                return None, delay
+            self._background.popleft()
+            self.requests.take(1)
+            self.tokens.take(job.tokens)
+            self._active += 1
+            return job, None
+
+    def _fail_all(self, error):
+        """Fails every queued job and any later request with error."""
+        print(f"Analysis scheduler stopped: {str(error)}")
+        with self._lock:
+            self._error = error
+            jobs = [job for queue in self._queues.values() for job in queue] + list(self._background)
+            self._queues.clear()
+            self._background.clear()
+        for job in jobs:
+            if not job.future.done():
+                job.future.set_result(error_result(error))
+            # A waiting streamed call sees the failed future and doesn't make its call
+            job.admitted.set()
+
+    async def _dispatch(self):
+        try:
+            client = make_async_client()
+        except Exception as e:
+            # E.g. no API key; without this every request would wait forever
+            self._fail_all(e)
+            return
+        async with client:
+            while True:
+                # Cleared before looking, so a wake-up for work queued meanwhile isn't lost
+                self._wake.clear()
+                job, wait = self._next_job()
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if job.stream:
+                    job.admitted.set()
+                else:
+                    task = asyncio.create_task(self._run(client, job))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+    def _schedule_retry(self, job, error):
+        """Requeues job after a back-off; a 429 pauses every call. False if it shouldn't be retried."""
+        if job.attempts >= self.max_retries or not is_retryable(error):
+            return False
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** job.attempts) * (0.5 + random.random() / 2)
+        job.attempts += 1
+        job.not_before = time.monotonic() + delay
+        metrics.record_retry()
+        print(f"Retrying analysis in {delay:.1f}s (attempt {job.attempts}): {str(error)}")
+        with self._lock:
+            if getattr(error, "status_code", None) == 429:
+                self._resume_at = max(self._resume_at, job.not_before)
+            self._enqueue(job, front=True)
+        return True
+
+    async def _run(self, client, job):
+        try:
+            result = await request_analysis_async(client, job.text)
+        except Exception as e:
+            if not self._schedule_retry(job, e):
+                print(f"Analysis failed: {str(e)}")
+                job.future.set_result(error_result(e))
+        else:
+            job.future.set_result(result)
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._wake.set()
+            metrics.flush()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
@@ -0,0 +1,105 @@
+import threading
+import memo
+
+# Response data shared by every Streamlit session in the process. Each
+# distinct file (by content fingerprint) is parsed once into a ResponseCorpus,
+# and every session using that file is handed the same SharedDataset.
+# Sessions hold a reference while they use a dataset; when the last one lets
+# go, the dataset moves to memo.results, where it stays until the memory
+# bound pushes it out, so 100 teachers on the same file cost one copy and a
+# returning one doesn't reparse it.
+
+class SharedDataset:
+    """One parsed file's corpus; not modified after loading."""
+
+    def __init__(self, fingerprint, corpus):
+        self.fingerprint = fingerprint
+        self.corpus = corpus
+
+    def memory_size(self):
+        return self.corpus.memory_size()
+
+class DatasetRegistry:
+    """Reference-counted SharedDatasets; a holder (one session) uses at most one at a time."""
+
+    def __init__(self, cache=memo.results):
+        self.cache = cache
+        self._lock = threading.Lock()
+        # fingerprint -> SharedDataset with at least one holder
+        self._datasets = {}
+        # holder -> fingerprint of the dataset it holds
+        self._holders = {}
+        # fingerprint -> lock held while that file is being parsed
+        self._loading = {}
+
+    def _hold(self, holder, dataset):
+        """Caller holds self._lock."""
+        previous = self._holders.get(holder)
+        if previous == dataset.fingerprint:
+            return
+        self._datasets[dataset.fingerprint] = dataset
+        self._holders[holder] = dataset.fingerprint
+        if previous is not None:
+            self._drop(previous)
+
+    def _drop(self, fingerprint):
+        """Parks a dataset in the cache once nobody holds it. Caller holds self._lock."""
+        if fingerprint in self._holders.values():
+            return
+        dataset = self._datasets.pop(fingerprint, None)
+        if dataset is not None:
+            self.cache.put((fingerprint, 'dataset'), dataset)
+
+    def acquire(self, holder, fingerprint, load):
+        """The shared dataset for fingerprint, now held by holder.
+
+        `load()` returns the corpus and runs only if no session holds
+        the file and it isn't cached; concurrent first requests for the same
+        file wait for one load. A failed load (load() returning None or
+        raising) leaves what holder had before untouched.
+        """
+        with self._lock:
+            dataset = self.get(fingerprint)
+            if dataset is not None:
+                self._hold(holder, dataset)
+                return dataset
+            loading = self._loading.setdefault(fingerprint, threading.Lock())
+        with loading:
+            with self._lock:
+                dataset = self.get(fingerprint)
+            try:
+                if dataset is None:
+                    corpus = load()
+                    if corpus is None:
+                        return None
+                    dataset = SharedDataset(fingerprint, corpus)
+                with self._lock:
+                    self._hold(holder, dataset)
+                return dataset
+            finally:
+                with self._lock:
+                    if self._loading.get(fingerprint) is loading:
+                        del self._loading[fingerprint]
+
+    def get(self, fingerprint):
+        """A loaded dataset, held or cached, without taking a reference."""
+        dataset = self._datasets.get(fingerprint)
+        if dataset is None:
+            dataset = self.cache.get((fingerprint, 'dataset'))
+        return dataset
+
+    def release(self, holder):
+        with self._lock:
+            fingerprint = self._holders.pop(holder, None)
+            if fingerprint is not None:
+                self._drop(fingerprint)
+
+    def sweep(self, is_active):
+        """Releases holders for which is_active(holder) is false, e.g. closed sessions."""
+        with self._lock:
+            holders = list(self._holders)
+        for holder in holders:
+            if not is_active(holder):
+                self.release(holder)
+
+registry = DatasetRegistry()
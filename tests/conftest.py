@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+# Set before the app modules are imported, as they read these at import time
+_workdir = tempfile.mkdtemp(prefix="analysis-tests-")
+os.environ["ANALYSIS_CACHE"] = "0"
+os.environ.setdefault("OPENAI_API_KEY", "test")
+for name, filename in [
+    ("ANALYSIS_CACHE_PATH", "analysis_cache.sqlite"),
+    ("ANALYSIS_HISTORY_PATH", "analysis_history.sqlite"),
+    ("ANALYSIS_JOBS_PATH", "analysis_jobs.sqlite"),
+    ("ANALYSIS_VECTORS_PATH", "code_vectors"),
+    ("HEATMAP_ROWS_PATH", "heatmap_rows.sqlite"),
+    ("EXPORT_DIR", "exports"),
+]:
+    os.environ[name] = os.path.join(_workdir, filename)
+
+import pandas as pd
+import pytest
+import analysis
+import mock_server
+import scheduler
+from corpus import QUESTION_COLUMNS, STUDENT_COLUMN, ResponseCorpus
+
+@pytest.fixture
+def make_corpus():
+    """Builds a ResponseCorpus from {student: [answer per question]}."""
+    def build(answers):
+        rows = [{STUDENT_COLUMN: student, **dict(zip(QUESTION_COLUMNS, values))} for student, values in answers.items()]
+        return ResponseCorpus(pd.DataFrame(rows))
+    return build
+
+@pytest.fixture
+def server(monkeypatch):
+    """A mock OpenAI server the model clients talk to; yields its state."""
+    srv, url = mock_server.start_server(latency=0.1)
+    monkeypatch.setenv("OPENAI_BASE_URL", url)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    yield srv.RequestHandlerClass.state
+    srv.shutdown()
+    srv.server_close()
+
+@pytest.fixture
+def model(server, monkeypatch):
+    """Process-wide client and scheduler, fresh for one test, talking to the mock server."""
+    monkeypatch.setattr(analysis, "_client", None)
+    monkeypatch.setattr(scheduler, "_scheduler", scheduler.Scheduler(requests_per_minute=0, tokens_per_minute=0))
+    return server
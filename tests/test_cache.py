@@ -0,0 +1,44 @@
+import time
+import pytest
+import cache
+from cache import AnalysisCache, get_cache, make_key
+
+@pytest.fixture
+def store(tmp_path):
+    return AnalysisCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+
+def test_make_key_separates_parts():
+    assert make_key("gpt-4o", "1", 0, "text") == make_key("gpt-4o", "1", 0, "text")
+    assert make_key("ab", "c") != make_key("a", "bc")
+    assert make_key("gpt-4o", "1", 0, "text") != make_key("gpt-4o", "1-spans", 0, "text")
+
+def test_round_trip_and_replace(store):
+    assert store.get("a") is None
+    store.put("a", {"predetermined_codes": {"Grammar Support": ["Ana: 'Hi'"]}})
+    assert store.get("a") == {"predetermined_codes": {"Grammar Support": ["Ana: 'Hi'"]}}
+    store.put("a", {"replaced": True})
+    assert store.get("a") == {"replaced": True}
+    assert len(store) == 1
+
+def test_least_recently_used_entries_are_evicted(store):
+    for key in ["a", "b", "c"]:
+        store.put(key, key)
+        time.sleep(0.01)
+    store.get("a")
+    store.evict()
+    assert len(store) == 2
+    assert store.get("b") is None
+    assert store.get("a") == "a"
+
+def test_expired_entries_are_not_returned(tmp_path):
+    store = AnalysisCache(str(tmp_path / "cache.sqlite"), max_age_days=0)
+    store.put("a", "a")
+    assert store.get("a") is None
+    assert len(store) == 0
+
+def test_cache_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(cache, "_cache", None)
+    monkeypatch.setenv("ANALYSIS_CACHE", "0")
+    assert get_cache() is None
+    monkeypatch.setenv("ANALYSIS_CACHE", "1")
+    assert get_cache() is get_cache() is not None
@@ -0,0 +1,43 @@
+from dedup import cluster_students
+
+BASE = [
+    "I would look at their reading levels and any accommodations in their plans before the lesson starts.",
+    "I would ask the other teachers which students struggled with fractions and who needs extra support.",
+    "Students would work in small groups with assigned roles so that everyone has a reason to take part.",
+    "I would assess the assignment with a rubric that lists clear criteria for each part of the task.",
+    "Exit tickets at the end of class would show me whether each objective was understood by every student.",
+]
+
+OTHER = [
+    "Prior test scores, language background and the notes left by last year's teacher.",
+    "How they handled the unit on measurement and which grouping strategies worked for them.",
+    "Hands-on stations and frequent movement breaks keep attention high throughout the period.",
+    "A short written reflection graded on completeness and on the accuracy of the examples.",
+    "Observation during group work plus a five-question quiz covering the objectives.",
+]
+
+def test_identical_answers_form_one_cluster(make_corpus):
+    corpus = make_corpus({"Ana": BASE, "Ben": list(BASE), "Cleo": OTHER})
+    clusters = cluster_students(corpus)
+    assert [(c.representative, c.members) for c in clusters] == [("Ana", ["Ben"]), ("Cleo", [])]
+    assert len(clusters[0]) == 2
+
+def test_every_student_is_in_exactly_one_cluster(make_corpus):
+    corpus = make_corpus({"Ana": BASE, "Ben": OTHER, "Cleo": list(BASE), "Dev": list(OTHER)})
+    clusters = cluster_students(corpus)
+    students = [c.representative for c in clusters] + [m for c in clusters for m in c.members]
+    assert sorted(students) == sorted(corpus.students)
+    assert [(c.representative, c.members) for c in clusters] == [("Ana", ["Cleo"]), ("Ben", ["Dev"])]
+
+def test_one_different_answer_keeps_students_apart(make_corpus):
+    # Near-duplicates must be similar on every question, not on average
+    changed = BASE[:4] + [OTHER[4]]
+    corpus = make_corpus({"Ana": BASE, "Ben": changed})
+    assert [c.members for c in cluster_students(corpus)] == [[], []]
+
+def test_threshold_and_student_subset(make_corpus):
+    corpus = make_corpus({"Ana": BASE, "Ben": list(BASE), "Cleo": list(BASE)})
+    assert [(c.representative, c.members) for c in cluster_students(corpus, students=["Ben", "Cleo"])] == [("Ben", ["Cleo"])]
+    assert cluster_students(corpus, students=[]) == []
+    # A threshold above 1 never holds, so nobody is merged
+    assert [c.members for c in cluster_students(corpus, threshold=1.01)] == [[], [], []]
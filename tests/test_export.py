@@ -0,0 +1,60 @@
+import os
+import pandas as pd
+import pytest
+from analysis import NO_QUOTE, error_result
+from export import COLUMNS, FORMATS, export_to_dir, iter_row_chunks, result_rows
+
+ANSWERS = [
+    "I would look at their reading levels.",
+    "Ask which students need extra support.",
+    "Use think-pair-share so everyone talks.",
+    "A rubric with clear criteria.",
+    "Exit tickets for each objective.",
+]
+
+def read_export(path):
+    if path.endswith(".csv"):
+        return pd.read_csv(path, keep_default_na=False)
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_excel(path, sheet_name="Quotes", keep_default_na=False)
+
+def test_result_rows():
+    result = {
+        "predetermined_codes": {"Grammar Support": ["Ana: 'A rubric.'", NO_QUOTE]},
+        "emergent_codes": {"Perceived Challenges": ["Ben: 'Time.'"]}
+    }
+    assert result_rows(None, result) == [
+        ("Ana", "Predetermined", "Grammar Support", "A rubric."),
+        ("Ben", "Emergent", "Perceived Challenges", "Time.")
+    ]
+    assert result_rows("Cleo", result)[0][0] == "Cleo"
+    assert result_rows("Cleo", error_result("timed out")) == [("Cleo", "Error", "", "Analysis failed: timed out")]
+
+def test_chunks_cover_every_student(model, make_corpus):
+    corpus = make_corpus({f"S{i}": [f"{answer} {i}" for answer in ANSWERS] for i in range(5)})
+    progress = []
+    chunks = list(iter_row_chunks(corpus, chunk_students=2, on_progress=lambda done, total: progress.append((done, total))))
+    assert len(chunks) == 3
+    assert progress == [(2, 5), (4, 5), (5, 5)]
+    rows = [row for chunk in chunks for row in chunk]
+    assert {row[0] for row in rows} == set(corpus.students)
+    # Only verified quotes from the student's own answers are exported
+    for student, _, _, quote in rows:
+        assert quote.rstrip(".") in corpus.documents[student]
+
+def test_duplicates_are_exported_under_each_name(model, make_corpus):
+    corpus = make_corpus({"Ana": ANSWERS, "Ben": ANSWERS})
+    rows = [row for chunk in iter_row_chunks(corpus, dedup=True) for row in chunk]
+    assert model.snapshot()["chat_requests"] == 1
+    assert sorted(row[1:] for row in rows if row[0] == "Ana") == sorted(row[1:] for row in rows if row[0] == "Ben")
+
+@pytest.mark.parametrize("format", list(FORMATS))
+def test_export_to_dir(model, make_corpus, tmp_path, format):
+    corpus = make_corpus({"Ana": ANSWERS, "Ben": [answer.upper() for answer in ANSWERS]})
+    path, count = export_to_dir(corpus, format, directory=str(tmp_path))
+    assert path.endswith(FORMATS[format][0])
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+    frame = read_export(path)
+    assert list(frame.columns) == COLUMNS
+    assert len(frame) == count > 0
@@ -0,0 +1,53 @@
+import uuid
+from analysis import NO_QUOTE, error_result
+from history import HistoryStore
+from verify import verify_result
+
+ANSWERS = [
+    "I would look at their reading levels.",
+    "Ask which students need extra support.",
+    "Use think-pair-share so everyone talks.",
+    "A rubric with clear criteria.",
+    "Exit tickets for each objective.",
+]
+
+def analysis_of(corpus, quote):
+    result = {
+        "predetermined_codes": {"Grammar Support": [quote, "Ana: 'Something Ana never wrote'"]},
+        "emergent_codes": {}
+    }
+    return verify_result(result, corpus.quote_index, drop=False)
+
+def test_entries_survive_spilling(make_corpus):
+    corpus = make_corpus({"Ana": ANSWERS})
+    history = HistoryStore(uuid.uuid4().hex, max_in_memory=1)
+    history.add("Ana_1", analysis_of(corpus, "Ana: 'A rubric with clear criteria.'"), corpus)
+    history.add("Ana_2", error_result("timed out"), corpus)
+    # The first entry is now only on disk
+    result = history.get("Ana_1").to_result(corpus)
+    # Verified quotes are rebuilt from their spans in the answers
+    assert result["predetermined_codes"]["Grammar Support"] == [
+        "Ana: 'A rubric with clear criteria'", "Ana: 'Something Ana never wrote'"
+    ]
+    assert result["unverified_quotes"] == {"Grammar Support": ["Ana: 'Something Ana never wrote'"]}
+    assert result["emergent_codes"]["Perceived Challenges"] == [NO_QUOTE]
+    assert "timed out" in history.get("Ana_2").to_result(corpus)["predetermined_codes"]["error"]
+
+def test_same_key_twice_keeps_both(make_corpus):
+    corpus = make_corpus({"Ana": ANSWERS})
+    history = HistoryStore(uuid.uuid4().hex)
+    first = history.add("Ana_20260101_120000", analysis_of(corpus, "Ana: 'A rubric with clear criteria.'"), corpus)
+    second = history.add("Ana_20260101_120000", analysis_of(corpus, "Ana: 'Exit tickets for each objective.'"), corpus)
+    assert first == "Ana_20260101_120000"
+    assert second == "Ana_20260101_120000_2"
+    assert history.keys() == [first, second]
+    assert "Ana: 'Exit tickets for each objective'" in history.get(second).to_result(corpus)["predetermined_codes"]["Grammar Support"]
+    assert "Ana: 'A rubric with clear criteria'" in history.get(first).to_result(corpus)["predetermined_codes"]["Grammar Support"]
+
+def test_oldest_entries_are_forgotten(make_corpus):
+    corpus = make_corpus({"Ana": ANSWERS})
+    history = HistoryStore(uuid.uuid4().hex, max_in_memory=1, max_entries=2)
+    for i in range(3):
+        history.add(f"Ana_{i}", error_result(i), corpus)
+    assert history.keys() == ["Ana_1", "Ana_2"]
+    assert history.get("Ana_0") is None
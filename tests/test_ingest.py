@@ -0,0 +1,96 @@
+import csv
+import io
+import pytest
+from corpus import QUESTION_COLUMNS, STUDENT_COLUMN, ResponseDataError, map_columns
+from ingest import SNIFF_BYTES, IngestReport, read_responses
+
+def test_map_columns_matches_exact_headers():
+    headers = [STUDENT_COLUMN] + QUESTION_COLUMNS
+    assert map_columns(headers) == {header: header for header in headers}
+
+def test_map_columns_normalizes_headers():
+    headers = [
+        "﻿Name of Student",
+        "1. WHAT STUDENT INFORMATION DO YOU NEED TO PLAN THE LESSON?",
+        "2) What information would you ask of the other fifth-grade teachers?\n(optional notes)",
+        "How would you ensure all students are engaged in the lesson",
+        "How would you assess the assignment?",
+        "How would you assess students’ understanding of each of the objectives?",
+        "Timestamp",
+    ]
+    mapping = map_columns(headers)
+    assert mapping == dict(zip(headers, [STUDENT_COLUMN] + QUESTION_COLUMNS))
+
+def test_map_columns_matches_reworded_questions():
+    reworded = "How would you ensure all students, regardless of their proficiency level, are engaged in the lesson?"
+    mapping = map_columns(["Student", reworded, "Engagement notes"])
+    assert mapping == {"Student": STUDENT_COLUMN, reworded: QUESTION_COLUMNS[2]}
+
+def test_map_columns_uses_each_column_once():
+    mapping = map_columns(["Student", "Name", QUESTION_COLUMNS[0], QUESTION_COLUMNS[0].upper()])
+    assert list(mapping.values()).count(STUDENT_COLUMN) == 1
+    assert list(mapping.values()).count(QUESTION_COLUMNS[0]) == 1
+
+def write_csv(rows, headers=None):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(headers or [STUDENT_COLUMN] + QUESTION_COLUMNS)
+    writer.writerows(rows)
+    return out.getvalue()
+
+def filler_rows(count):
+    return [[f"Student {i}"] + [f"Answer {q} from student {i}, padded to fill the file." for q in range(5)] for i in range(count)]
+
+def test_missing_column_is_reported(tmp_path):
+    path = tmp_path / "responses.csv"
+    path.write_text(write_csv([["Ana", "a", "b", "c", "d"]], [STUDENT_COLUMN] + QUESTION_COLUMNS[:4]))
+    with pytest.raises(ResponseDataError, match="Missing required columns"):
+        read_responses(path)
+
+def test_rows_are_validated(tmp_path):
+    rows = [["Ana"] + ["a"] * 5, ["  Ana "] + ["b"] * 5, [""] + ["c"] * 5, [""] * 6, ["Ben"] + ["d"] * 5]
+    path = tmp_path / "responses.csv"
+    path.write_text(write_csv(rows))
+    report = IngestReport()
+    df = read_responses(path, report=report)
+    assert df[STUDENT_COLUMN].tolist() == ["Ana", "Ben"]
+    assert df[QUESTION_COLUMNS[0]].tolist() == ["a", "d"]
+    assert (report.duplicate_students, report.rows_without_student) == (1, 1)
+
+def test_cp1252_file_is_sniffed(tmp_path):
+    path = tmp_path / "responses.csv"
+    path.write_bytes(write_csv([["Zoë"] + ["café"] * 5]).encode("cp1252"))
+    report = IngestReport()
+    df = read_responses(path, report=report)
+    assert report.encoding == "cp1252"
+    assert df[STUDENT_COLUMN].tolist() == ["Zoë"]
+    assert df[QUESTION_COLUMNS[0]].tolist() == ["café"]
+
+def test_cp1252_past_the_sniffed_head_reads_again(tmp_path):
+    rows = filler_rows(2000)
+    rows.append(["Zoë"] + ["naïve café"] * 5)
+    data = write_csv(rows).encode("cp1252")
+    # The head decodes as UTF-8, so the file is first read as UTF-8
+    assert data.index("Zoë".encode("cp1252")) > SNIFF_BYTES
+    path = tmp_path / "responses.csv"
+    path.write_bytes(data)
+    report = IngestReport()
+    df = read_responses(path, chunk_bytes=16 * 1024, report=report)
+    assert report.encoding == "cp1252"
+    assert len(df) == 2001
+    assert df[STUDENT_COLUMN].is_unique
+    assert df[STUDENT_COLUMN].iloc[-1] == "Zoë"
+    assert df[QUESTION_COLUMNS[0]].iloc[-1] == "naïve café"
+    assert report.rows == 2001 and report.duplicate_students == 0
+
+def test_mixed_encodings_are_repaired(tmp_path):
+    # UTF-8 near the top, a Windows-1252 row further down, as when files are pasted together
+    head = write_csv([["Jürgen"] + ["über"] * 5] + filler_rows(2000)).encode("utf-8")
+    tail = write_csv([["Zoë"] + ["café"] * 5]).split("\n", 1)[1].encode("cp1252")
+    path = tmp_path / "responses.csv"
+    path.write_bytes(head + tail)
+    df = read_responses(path, chunk_bytes=16 * 1024)
+    assert df[STUDENT_COLUMN].iloc[0] == "Jürgen"
+    assert df[QUESTION_COLUMNS[0]].iloc[0] == "über"
+    assert df[STUDENT_COLUMN].iloc[-1] == "Zoë"
+    assert len(df) == 2002
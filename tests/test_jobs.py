@@ -0,0 +1,58 @@
+import time
+import threading
+import pytest
+from jobs import DONE, FAILED, INTERRUPTED, JobQueue, JobStore
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite"))
+
+def wait_for(queue, id):
+    deadline = time.monotonic() + 5
+    while not queue.get(id).finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return queue.get(id)
+
+def test_finished_job_is_kept_in_the_store(store):
+    queue = JobQueue(store, workers=1)
+
+    def work(report):
+        report(1, 2, partial={"rows": 1})
+        report(2, 2)
+        return {"rows": 2}
+
+    id = queue.submit("heatmap", "key", work, params={"fingerprint": "f1"})
+    job = wait_for(queue, id)
+    assert (job.status, job.result, job.done, job.total) == (DONE, {"rows": 2}, 2, 2)
+    # Read back from SQLite once the worker has let go of it
+    stored = store.get(id)
+    assert (stored.status, stored.result, stored.params) == (DONE, {"rows": 2}, {"fingerprint": "f1"})
+
+def test_repeated_submit_attaches_to_the_running_job(store):
+    queue = JobQueue(store, workers=2)
+    release = threading.Event()
+    first = queue.submit("analysis", "key", lambda report: release.wait(5) and "first")
+    second = queue.submit("analysis", "key", lambda report: "second")
+    other = queue.submit("analysis", "other", lambda report: "other")
+    assert second == first != other
+    release.set()
+    assert wait_for(queue, first).result == "first"
+    # Once finished, the same key starts a new job
+    assert queue.submit("analysis", "key", lambda report: "again") != first
+
+def test_failed_job_records_the_error(store):
+    queue = JobQueue(store, workers=1)
+
+    def work(report):
+        raise ValueError("no students")
+
+    job = wait_for(queue, queue.submit("export", "key", work))
+    assert (job.status, job.error) == (FAILED, "no students")
+    assert store.get(job.id).error == "no students"
+
+def test_restart_interrupts_unfinished_jobs(store):
+    store.create("old", "heatmap", "key", {})
+    assert store.find_unfinished("key") == "old"
+    store.interrupt_unfinished()
+    assert store.get("old").status == INTERRUPTED
+    assert store.find_unfinished("key") is None
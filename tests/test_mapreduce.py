@@ -0,0 +1,44 @@
+from analysis import NO_QUOTE, SECTIONS, error_result
+from mapreduce import analyze_cohort, estimate_tokens, merge_results, pack_documents
+
+ANSWERS = [
+    "I would look at their reading levels.",
+    "Ask which students need extra support.",
+    "Use think-pair-share so everyone talks.",
+    "A rubric with clear criteria.",
+    "Exit tickets for each objective.",
+]
+
+def result_with(quotes):
+    result = {section: {code: [NO_QUOTE] for code in codes} for section, codes in SECTIONS}
+    result["predetermined_codes"]["Grammar Support"] = quotes
+    return result
+
+def test_pack_documents_keeps_order_within_budget():
+    documents = ["a" * 40, "b" * 40, "c" * 40, "d" * 200]
+    chunks = pack_documents(documents, token_budget=25)
+    assert chunks == ["a" * 40 + "\n\n" + "b" * 40, "c" * 40, "d" * 200]
+    assert all(estimate_tokens(chunk) <= 25 for chunk in chunks[:2])
+
+def test_merge_results_dedupes_and_counts_failures():
+    merged = merge_results([
+        result_with(["Ana: 'One'", "Ben: 'Two'"]),
+        result_with(["Ben: 'Two'", "Cleo: 'Three'"]),
+        error_result("timed out"),
+    ])
+    assert merged["predetermined_codes"]["Grammar Support"] == ["Ana: 'One'", "Ben: 'Two'", "Cleo: 'Three'"]
+    assert merged["emergent_codes"]["Perceived Challenges"] == [NO_QUOTE]
+    assert merged["failed_chunks"] == 1
+    assert "all 2 chunks failed" in merge_results([error_result("a"), error_result("b")])["predetermined_codes"]["error"]
+
+def test_analyze_cohort_covers_every_chunk(model, make_corpus):
+    corpus = make_corpus({f"S{i}": [f"{answer} {i}" for answer in ANSWERS] for i in range(6)})
+    progress = []
+    result = analyze_cohort(corpus, token_budget=100, on_progress=lambda done, total, partial: progress.append((done, total)))
+    total = model.snapshot()["chat_requests"]
+    assert total > 1
+    assert progress[-1] == (total, total)
+    quoted = {
+        quote.split(":")[0] for section, codes in SECTIONS for code in codes for quote in result[section][code] if quote != NO_QUOTE
+    }
+    assert quoted == set(corpus.students)
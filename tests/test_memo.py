@@ -0,0 +1,53 @@
+from memo import BoundedCache, estimate_size, file_fingerprint, fingerprint
+
+class Sized:
+    def __init__(self, size):
+        self.size = size
+
+    def memory_size(self):
+        return self.size
+
+def test_least_recently_used_entries_go_first():
+    cache = BoundedCache(max_bytes=30)
+    cache.put(("a", "heatmap"), b"x" * 10)
+    cache.put(("b", "heatmap"), b"x" * 10)
+    cache.get(("a", "heatmap"))
+    cache.put(("c", "heatmap"), b"x" * 15)
+    assert cache.get(("b", "heatmap")) is None
+    assert cache.get(("a", "heatmap")) is not None
+    assert cache.size == 25
+
+def test_replacing_and_oversized_values():
+    cache = BoundedCache(max_bytes=30)
+    cache.put(("a", "heatmap"), b"x" * 10)
+    cache.put(("a", "heatmap"), b"y" * 20)
+    assert (len(cache), cache.size) == (1, 20)
+    # Too big to keep, but handed back to the caller
+    assert cache.put(("b", "heatmap"), b"z" * 31) == b"z" * 31
+    assert cache.get(("b", "heatmap")) is None
+
+def test_invalidate_drops_one_file():
+    cache = BoundedCache()
+    cache.put(("a", "dataset"), Sized(5))
+    cache.put(("a", "heatmap", True), b"x")
+    cache.put(("b", "dataset"), Sized(7))
+    cache.invalidate("a")
+    assert len(cache) == 1 and cache.size == 7
+
+def test_estimate_size():
+    assert estimate_size(("abc", [b"de", Sized(10)])) == 15
+    assert fingerprint(b"data") == fingerprint(b"data") != fingerprint(b"other")
+
+def test_file_fingerprint_follows_changes(tmp_path, monkeypatch):
+    import memo
+    path = str(tmp_path / "responses.csv")
+    with open(path, "wb") as f:
+        f.write(b"first")
+    hashed = []
+    monkeypatch.setattr(memo, "fingerprint", lambda data: hashed.append(data) or fingerprint(data))
+    assert file_fingerprint(path) == file_fingerprint(path) == fingerprint(b"first")
+    # Reread only when the file changes
+    assert hashed == [b"first"]
+    with open(path, "wb") as f:
+        f.write(b"second!")
+    assert file_fingerprint(path) == fingerprint(b"second!")
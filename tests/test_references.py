@@ -0,0 +1,59 @@
+import pytest
+import analysis
+import scheduler
+from analysis import EMERGENT_CODES, NO_QUOTE, SECTIONS
+from corpus import render_document
+from references import build_prompt, number_sentences, rehydrate
+
+ANSWERS = [
+    "I would look at their reading levels. Then I group them.",
+    "Ask which students need extra support.",
+    "Use think-pair-share so everyone talks.",
+    "A rubric with clear criteria.",
+    "Exit tickets for each objective.",
+]
+
+@pytest.fixture
+def spans(monkeypatch, model):
+    monkeypatch.setattr(analysis, "OUTPUT_MODE", "spans")
+    return model
+
+def check_quotes(result, student):
+    """Every quote is a whole answer sentence attributed to student."""
+    _, sentences = number_sentences(render_document(student, ANSWERS))
+    expected = {f"{student}: '{sentence}'" for _, sentence in sentences}
+    quotes = [quote for section, _ in SECTIONS for entries in result[section].values() for quote in entries]
+    found = [quote for quote in quotes if quote != NO_QUOTE]
+    assert found
+    assert set(found) <= expected
+
+def test_number_sentences():
+    numbered, sentences = number_sentences(render_document("Ana", ANSWERS))
+    assert "[1] I would look at their reading levels. [2] Then I group them." in numbered
+    assert sentences[1] == ("Ana", "Then I group them.")
+    assert len(sentences) == 6
+
+def test_rehydrate_drops_unknown_numbers():
+    _, sentences = number_sentences(render_document("Ana", ANSWERS))
+    quotes = rehydrate({"Grammar Support": [2, 2, 0, 99, True, "3"]}, sentences)
+    assert quotes == {"Grammar Support": ["Ana: 'Then I group them.'"]}
+
+def test_prompt_lists_every_code():
+    prompt = build_prompt(render_document("Ana", ANSWERS))
+    for _, codes in SECTIONS:
+        for code in codes:
+            assert code in prompt
+    assert ", ".join(EMERGENT_CODES) in prompt
+
+def test_submit_round_trip(spans):
+    result = scheduler.get_scheduler().submit(render_document("Ana", ANSWERS)).result(timeout=10)
+    assert "error" not in result["predetermined_codes"]
+    assert [set(result[section]) for section, _ in SECTIONS] == [set(codes) for _, codes in SECTIONS]
+    check_quotes(result, "Ana")
+    assert spans.snapshot()["chat_requests"] == 1
+
+def test_stream_round_trip(spans):
+    results = list(analysis.analyze_response_stream(render_document("Ben", ANSWERS)))
+    final = results[-1]
+    assert "error" not in final["predetermined_codes"]
+    check_quotes(final, "Ben")
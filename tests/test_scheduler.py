@@ -0,0 +1,152 @@
+import time
+import scheduler
+from corpus import render_document
+from scheduler import Scheduler
+
+def document(student):
+    return render_document(student, [
+        "I would look at their reading levels.",
+        "Ask which students need extra support.",
+        "Use think-pair-share so everyone talks.",
+        "A rubric with clear criteria.",
+        "Exit tickets for each objective.",
+    ])
+
+def unlimited(max_in_flight):
+    return Scheduler(max_in_flight=max_in_flight, requests_per_minute=0, tokens_per_minute=0)
+
+def test_identical_requests_share_one_call(server):
+    sched = unlimited(4)
+    first = sched.submit(document("Ana"), session="a")
+    second = sched.submit(document("Ana"), session="b")
+    assert second is first
+    result = first.result(timeout=10)
+    assert "error" not in result["predetermined_codes"]
+    assert server.snapshot()["chat_requests"] == 1
+
+def test_sessions_take_turns(server):
+    sched = unlimited(1)
+    finished = []
+    futures = [sched.submit(document(f"A{i}"), session="a") for i in range(4)]
+    futures.append(sched.submit(document("B0"), session="b"))
+    for label, future in zip(["A0", "A1", "A2", "A3", "B0"], futures):
+        future.add_done_callback(lambda _, label=label: finished.append(label))
+    for future in futures:
+        future.result(timeout=10)
+    # First come first served would leave session b's request until last
+    assert finished.index("B0") < finished.index("A3")
+    assert finished.index("B0") <= 2
+
+def test_rate_limit_pauses_every_call(server):
+    sent = []
+    admit = server.admit_chat
+
+    def admit_once():
+        limited, delay = admit()
+        sent.append(time.monotonic())
+        # Only the first call is rejected
+        server.rate_limit = 0.0
+        return limited, delay
+
+    server.rate_limit = 1.0
+    server.retry_after = 0.5
+    server.admit_chat = admit_once
+    sched = unlimited(1)
+    futures = [sched.submit(document("Ana"), session="a"), sched.submit(document("Ben"), session="b")]
+    results = [future.result(timeout=10) for future in futures]
+    assert all("error" not in result["predetermined_codes"] for result in results)
+    stats = server.snapshot()
+    assert (stats["chat_requests"], stats["rate_limited"]) == (3, 1)
+    # Nothing is sent until the Retry-After has passed, whichever session it's for
+    assert sent[1] - sent[0] >= 0.45
+
+def test_dispatcher_startup_failure_fails_requests(monkeypatch):
+    def no_client():
+        raise RuntimeError("The api_key client option must be set")
+
+    monkeypatch.setattr(scheduler, "make_async_client", no_client)
+    sched = unlimited(4)
+    started = time.monotonic()
+    result = sched.submit(document("Ana")).result(timeout=5)
+    assert "api_key" in result["predetermined_codes"]["error"]
+    assert time.monotonic() - started < 5
+    sched._thread.join(timeout=5)
+    assert not sched._thread.is_alive()
+    # Later requests fail straight away rather than waiting on a dead dispatcher
+    later = sched.submit(document("Ben"))
+    assert later.done() and "error" in later.result()["predetermined_codes"]
+    assert sched.prefetch(document("Cleo")) is False
+
+def test_failed_job_setup_is_not_shared(server, monkeypatch):
+    estimate = scheduler.estimate_call_tokens
+
+    def fail_once(text):
+        monkeypatch.setattr(scheduler, "estimate_call_tokens", estimate)
+        raise ValueError("prompt could not be built")
+
+    monkeypatch.setattr(scheduler, "estimate_call_tokens", fail_once)
+    sched = unlimited(4)
+    failed = sched.submit(document("Ana"))
+    assert failed.done() and "prompt could not be built" in failed.result()["predetermined_codes"]["error"]
+    # The same text is tried again instead of waiting on the failed setup
+    retried = sched.submit(document("Ana"))
+    assert retried is not failed
+    assert "error" not in retried.result(timeout=10)["predetermined_codes"]
+
+def test_reservation_finish_frees_its_slot():
+    sched = unlimited(1)
+    reservation = sched.reserve(document("Ana"))
+    assert reservation.wait()
+    # Identical requests share the streamed call
+    assert sched.reserve(document("Ana")).shared is reservation.job.future
+    reservation.finish({"predetermined_codes": {}, "emergent_codes": {}})
+    reservation.finish({"ignored": True})
+    assert reservation.job.future.result(timeout=1) == {"predetermined_codes": {}, "emergent_codes": {}}
+    assert sched._active == 0
+    assert sched.reserve(document("Ben")).wait()
+
+def test_abandoned_reservation_becomes_a_regular_call(server):
+    sched = unlimited(1)
+    reservation = sched.reserve(document("Ana"))
+    assert reservation.wait()
+    reservation.abandon()
+    assert "error" not in reservation.job.future.result(timeout=10)["predetermined_codes"]
+    assert server.snapshot()["chat_requests"] == 1
+
+def test_retried_reservation_becomes_a_regular_call(server, monkeypatch):
+    monkeypatch.setattr(scheduler, "BASE_BACKOFF", 0.01)
+    monkeypatch.setattr(scheduler, "is_retryable", lambda error: True)
+    sched = unlimited(1)
+    reservation = sched.reserve(document("Ana"))
+    assert reservation.wait()
+    assert reservation.retry(ConnectionError("connection reset"))
+    assert "error" not in reservation.job.future.result(timeout=10)["predetermined_codes"]
+    assert server.snapshot()["chat_requests"] == 1
+
+def test_refused_retry_releases_the_slot_once():
+    sched = unlimited(1)
+    reservation = sched.reserve(document("Ana"))
+    assert reservation.wait()
+    error = ValueError("not retryable")
+    assert not reservation.retry(error)
+    reservation.finish(scheduler.error_result(error))
+    assert sched._active == 0
+    assert "not retryable" in reservation.job.future.result(timeout=1)["predetermined_codes"]["error"]
+
+def test_prefetch_lands_in_the_cache_without_counting_lookups(server, monkeypatch, tmp_path):
+    import cache
+    from metrics import metrics
+    monkeypatch.setenv("ANALYSIS_CACHE", "1")
+    monkeypatch.setattr(cache, "_cache", cache.AnalysisCache(str(tmp_path / "cache.sqlite")))
+    sched = unlimited(2)
+    lookups = dict(metrics.cache)
+    assert sched.prefetch(document("Ana"))
+    deadline = time.monotonic() + 10
+    while scheduler.cached_result(document("Ana"), record=False) is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert sched.prefetch(document("Ana")) is False
+    assert dict(metrics.cache) == lookups
+    # The request itself finds the prefetched result
+    assert "error" not in sched.submit(document("Ana")).result(timeout=1)["predetermined_codes"]
+    assert metrics.cache["hit"] == lookups["hit"] + 1
+    assert server.snapshot()["chat_requests"] == 1
@@ -0,0 +1,44 @@
+import threading
+import time
+from memo import BoundedCache
+from shared import DatasetRegistry
+
+ANSWERS = ["One.", "Two.", "Three.", "Four.", "Five."]
+
+def test_sessions_share_one_load(make_corpus):
+    registry = DatasetRegistry(cache=BoundedCache())
+    loads = []
+
+    def load():
+        loads.append(1)
+        time.sleep(0.05)
+        return make_corpus({"Ana": ANSWERS})
+
+    datasets = []
+    threads = [threading.Thread(target=lambda i=i: datasets.append(registry.acquire(i, "f1", load))) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert all(dataset is datasets[0] for dataset in datasets)
+    assert datasets[0].memory_size() == datasets[0].corpus.memory_size()
+
+def test_released_datasets_are_parked_in_the_cache(make_corpus):
+    cache = BoundedCache()
+    registry = DatasetRegistry(cache=cache)
+    first = registry.acquire("a", "f1", lambda: make_corpus({"Ana": ANSWERS}))
+    registry.acquire("b", "f1", lambda: None)
+    registry.release("a")
+    assert cache.get(("f1", "dataset")) is None
+    registry.sweep(lambda holder: holder != "b")
+    assert cache.get(("f1", "dataset")) is first
+    # A returning session gets it back without reloading
+    assert registry.acquire("c", "f1", lambda: None) is first
+
+def test_failed_load_keeps_what_the_session_had(make_corpus):
+    registry = DatasetRegistry(cache=BoundedCache())
+    first = registry.acquire("a", "f1", lambda: make_corpus({"Ana": ANSWERS}))
+    assert registry.acquire("a", "f2", lambda: None) is None
+    assert registry.get("f1") is first
+    assert registry._holders == {"a": "f1"}
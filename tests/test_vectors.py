@@ -0,0 +1,51 @@
+import time
+import pytest
+import vectors
+from analysis import CODES
+from vectors import VectorStore
+
+def counts(value):
+    return [value] * len(CODES)
+
+@pytest.fixture
+def store(tmp_path):
+    return VectorStore(str(tmp_path / "vectors"))
+
+def test_views_count_each_student_once(store):
+    store.append(["Ana", "Ben"], [counts(1), counts(3)], "f1", source="fall.csv")
+    time.sleep(0.01)
+    # Ana analyzed again: only her latest vector counts
+    store.append(["Ana"], [counts(5)], "f1", source="fall.csv", kind="analysis")
+    store.append(["Cleo"], [counts(2)], "f2", source="spring.csv")
+    assert len(store) == 4
+    compare = store.compare()
+    assert compare.loc["f1", CODES[0]] == 4
+    assert compare.loc["f2", CODES[0]] == 2
+    cohorts = store.cohorts().set_index("fingerprint")
+    assert (cohorts.loc["f1", "students"], cohorts.loc["f1", "analyses"]) == (2, 3)
+    assert store.percentiles(q=(50,)).loc["p50", CODES[0]] == 3
+    assert store.latest("f1").loc["Ana", CODES[0]] == 5
+    assert store.trends(fingerprint="f1")[CODES[0]].iloc[-1] == 4
+
+def test_has_matches_model_and_kind(store, monkeypatch):
+    store.append(["Ana"], [counts(1)], "f1", kind="analysis")
+    assert store.has("f1", "Ana")
+    assert store.has("f1", "Ana", kind="analysis")
+    assert not store.has("f1", "Ana", kind="heatmap")
+    assert not store.has("f1", "Ben")
+    monkeypatch.setattr(vectors, "PROMPT_VERSION", "2")
+    assert not store.has("f1", "Ana")
+
+def test_compaction_keeps_every_row(store, monkeypatch):
+    monkeypatch.setattr(vectors, "COMPACT_PARTS", 3)
+    for i in range(5):
+        store.append([f"S{i}"], [counts(i)], "f1")
+    assert len(store._parts()) <= 3
+    assert len(store) == 5
+    assert sorted(store.frame(["student"])["student"]) == [f"S{i}" for i in range(5)]
+
+def test_empty_store(store):
+    assert len(store) == 0
+    assert store.cohorts().empty
+    assert store.compare().empty
+    assert list(store.percentiles().columns) == CODES
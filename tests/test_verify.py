@@ -0,0 +1,53 @@
+import pytest
+
+ANSWERS = {
+    "Ana": [
+        "I would look at their reading levels.",
+        "Ask which students need extra support.",
+        "Use think-pair-share so everyone talks.",
+        "A rubric with clear criteria.",
+        "Exit tickets for each objective.",
+    ],
+    "Ben": [
+        "Their reading levels and IEPs.",
+        "Ask which students need extra support.",
+        "Group work with roles.",
+        "Checklist.",
+        "A short quiz at the end.",
+    ],
+}
+
+@pytest.fixture
+def index(make_corpus):
+    return make_corpus(ANSWERS).quote_index
+
+def test_locate_returns_span_of_exact_quote(index):
+    [span] = index.locate(["Ana: 'Use think-pair-share so everyone talks.'"])
+    assert span["student"] == "Ana"
+    assert span["question"] == 2
+    answer = ANSWERS["Ana"][2]
+    assert answer[span["offset"]:span["offset"] + span["length"]] == "Use think-pair-share so everyone talks"
+
+def test_locate_ignores_case_curly_quotes_and_whitespace(index):
+    [span] = index.locate(["Ben: ‘their   READING levels and IEPs’"])
+    assert (span["student"], span["question"], span["offset"]) == ("Ben", 0, 0)
+
+def test_locate_matches_the_part_kept_before_an_ellipsis(index):
+    [span] = index.locate(["Ana: 'A rubric with clear...'"])
+    assert (span["student"], span["question"], span["offset"]) == ("Ana", 3, 0)
+
+def test_locate_prefers_the_named_student(index):
+    spans = index.locate(["Ben: 'Ask which students need extra support.'", "Ana: 'Ask which students need extra support.'"])
+    assert [span["student"] for span in spans] == ["Ben", "Ana"]
+
+def test_locate_returns_none_for_missing_or_too_short_quotes(index):
+    assert index.locate(["Ana: 'I would give a pop quiz.'", "Ana: 'I'", "Ben: ''"]) == [None, None, None]
+
+def test_locate_limits_the_scan_to_students(index):
+    entry = "Ana: 'Exit tickets for each objective.'"
+    assert index.locate([entry], students=["Ben"]) == [None]
+    assert index.locate([entry], students=["Ana"])[0]["student"] == "Ana"
+
+def test_locate_does_not_match_across_answers(index):
+    # The end of one answer and the start of the next are not one quote
+    assert index.locate(["Ana: 'reading levels. Ask which'"]) == [None]
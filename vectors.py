@@ -0,0 +1,180 @@
+import os
+import glob
+import time
+import uuid
+import threading
+from analysis import CODES, MODEL, PROMPT_VERSION
+
+# Persistent columnar store of code-frequency vectors. Every analysis made
+# by the app appends one row per student (10 code counts plus student,
+# upload fingerprint, file name, model, prompt version, kind and time) as a
+# small Parquet part file; parts are compacted into one file once there are
+# many. Queries read only the columns they need into Arrow and aggregate
+# with vectorized pandas/numpy, so trends, cohort comparisons and
+# percentiles over many thousands of analyses take milliseconds. Those views
+# count each student of an upload once, by their latest vector, however
+# often they were analyzed or drawn in a heatmap.
+
+VECTORS_PATH = os.environ.get("ANALYSIS_VECTORS_PATH", "code_vectors")
+# Part files merged into one once there are more than this many
+COMPACT_PARTS = 64
+META_COLUMNS = ["student", "fingerprint", "source", "model", "prompt_version", "kind", "recorded"]
+
+# Percentiles shown by default
+DEFAULT_PERCENTILES = (25, 50, 75, 90)
+
+def schema():
+    import pyarrow as pa
+    return pa.schema(
+        [(name, pa.string()) for name in META_COLUMNS[:-1]]
+        + [("recorded", pa.timestamp("ms"))]
+        + [(code, pa.int16()) for code in CODES]
+    )
+
+class VectorStore:
+    def __init__(self, path=VECTORS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path, "*.parquet")))
+
+    def append(self, students, matrix, fingerprint, source=None, kind="heatmap"):
+        """Records one code-count row per student; matrix rows are in CODES order."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if len(students) == 0:
+            return
+        count = len(students)
+        recorded = pa.array([int(time.time() * 1000)] * count, type=pa.timestamp("ms"))
+        columns = [
+            pa.array([str(s) for s in students], type=pa.string()),
+            pa.array([fingerprint] * count, type=pa.string()),
+            pa.array([source] * count, type=pa.string()),
+            pa.array([MODEL] * count, type=pa.string()),
+            pa.array([PROMPT_VERSION] * count, type=pa.string()),
+            pa.array([kind] * count, type=pa.string()),
+            recorded
+        ]
+        rows = [[int(c) for c in row] for row in matrix]
+        columns += [pa.array([row[j] for row in rows], type=pa.int16()) for j in range(len(CODES))]
+        table = pa.Table.from_arrays(columns, schema=schema())
+        part = os.path.join(self.path, f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet")
+        pq.write_table(table, f"{part}.tmp")
+        os.replace(f"{part}.tmp", part)
+        if len(self._parts()) > COMPACT_PARTS:
+            self.compact()
+
+    def compact(self):
+        """Merges every part file into one."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        with self._lock:
+            parts = self._parts()
+            if len(parts) < 2:
+                return
+            table = pa.concat_tables([pq.read_table(part, schema=schema()) for part in parts])
+            merged = os.path.join(self.path, f"part-{time.time_ns()}-merged.parquet")
+            pq.write_table(table, f"{merged}.tmp")
+            os.replace(f"{merged}.tmp", merged)
+            for part in parts:
+                os.remove(part)
+
+    def table(self, columns=None, **filters):
+        """Arrow table of stored rows; filters are column=value or column=[values]."""
+        import pyarrow.dataset as ds
+        expression = None
+        for name, value in filters.items():
+            if value is None:
+                continue
+            term = ds.field(name).isin(value) if isinstance(value, (list, tuple, set)) else ds.field(name) == value
+            expression = term if expression is None else expression & term
+        # Compaction replaces and deletes parts; reading meanwhile could miss or double rows
+        with self._lock:
+            parts = self._parts()
+            if not parts:
+                return schema().empty_table() if columns is None else schema().empty_table().select(columns)
+            dataset = ds.dataset(parts, schema=schema(), format="parquet")
+            return dataset.to_table(columns=columns, filter=expression)
+
+    def frame(self, columns=None, **filters):
+        return self.table(columns, **filters).to_pandas()
+
+    def latest_rows(self, columns, **filters):
+        """Stored rows reduced to each (upload, student)'s latest vector."""
+        keys = ["fingerprint", "student", "recorded"]
+        df = self.frame(keys + [c for c in columns if c not in keys], **filters)
+        return df.sort_values("recorded").drop_duplicates(["fingerprint", "student"], keep="last")[columns]
+
+    def has(self, fingerprint, student, kind=None):
+        """Whether student of this upload already has a vector from the current model and prompt."""
+        table = self.table(
+            ["student"], fingerprint=fingerprint, student=student, kind=kind, model=MODEL, prompt_version=PROMPT_VERSION
+        )
+        return table.num_rows > 0
+
+    def __len__(self):
+        import pyarrow.parquet as pq
+        with self._lock:
+            return sum(pq.ParquetFile(part).metadata.num_rows for part in self._parts())
+
+    def cohorts(self):
+        """One row per upload: fingerprint, file name, students, analyses and when it was last analyzed."""
+        df = self.frame(["fingerprint", "source", "student", "recorded"])
+        if df.empty:
+            return df
+        return df.groupby("fingerprint").agg(
+            source=("source", "last"),
+            students=("student", "nunique"),
+            analyses=("student", "size"),
+            last_analyzed=("recorded", "max")
+        ).sort_values("last_analyzed", ascending=False).reset_index()
+
+    def trends(self, freq="D", **filters):
+        """Mean count of each code per period, each student at their latest analysis."""
+        df = self.latest_rows(["recorded"] + CODES, **filters)
+        if df.empty:
+            return df
+        return df.set_index("recorded")[CODES].resample(freq).mean().dropna(how="all")
+
+    def compare(self, fingerprints=None, **filters):
+        """Mean count of each code per cohort (upload fingerprint)."""
+        df = self.latest_rows(["fingerprint"] + CODES, fingerprint=fingerprints, **filters)
+        if df.empty:
+            return df
+        return df.groupby("fingerprint")[CODES].mean()
+
+    def percentiles(self, q=DEFAULT_PERCENTILES, **filters):
+        """Percentiles of each code's count across students; one row per percentile."""
+        import numpy as np
+        import pandas as pd
+        df = self.latest_rows(CODES, **filters)
+        if df.empty:
+            return pd.DataFrame(columns=CODES)
+        counts = df.to_numpy()
+        return pd.DataFrame(np.percentile(counts, q, axis=0), index=[f"p{p}" for p in q], columns=CODES)
+
+    def latest(self, fingerprint, kind=None):
+        """Each student's most recent vector for one upload."""
+        df = self.frame(["student", "recorded"] + CODES, fingerprint=fingerprint, kind=kind)
+        if df.empty:
+            return df
+        return df.sort_values("recorded").groupby("student").last()[CODES]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_vector_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = VectorStore()
+        return _store
+
+def record_vectors(students, matrix, fingerprint, source=None, kind="heatmap"):
+    """Appends to the process-wide store; failures are logged, never raised."""
+    try:
+        get_vector_store().append(students, matrix, fingerprint, source, kind)
+    except Exception as e:
+        print(f"Recording code vectors failed: {str(e)}")
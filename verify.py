@@ -0,0 +1,222 @@
+import re
+from array import array
+from bisect import bisect_right
+from collections import deque
+from analysis import NO_QUOTE, SECTIONS
+
+# Checks that quotes returned by the model really occur in the students'
+# answers. The cohort's answers are normalized and indexed once; each batch
+# of quotes is compiled into an Aho-Corasick automaton and matched in a
+# single scan, so cost is linear in text plus quotes however many there are.
+
+# "Student Name: 'quote'" as requested in the prompt; quote marks may be curly
+QUOTE_FORMAT = re.compile(r"^\s*(?P<name>[^:'\"‘“]+?)\s*:\s*['\"‘“](?P<quote>.*)['\"’”]\s*$", re.DOTALL)
+# Quotes shorter than this (after normalization) match almost anywhere
+MIN_QUOTE_CHARS = 3
+# Occurrences remembered per quote while scanning
+MAX_HITS = 16
+SEPARATOR = "\x00"
+
+TRANSLATE = str.maketrans({
+    "‘": "'", "’": "'", "‚": "'", "′": "'",
+    "“": '"', "”": '"', "„": '"', "″": '"',
+    "–": "-", "—": "-", "‐": "-", " ": " "
+})
+
+def normalize_char(ch):
+    ch = ch.translate(TRANSLATE)
+    lowered = ch.lower()
+    return lowered if len(lowered) == 1 else ch
+
+def normalize(text):
+    """Normalization applied to both sides: case, quote marks, dashes and whitespace runs."""
+    text = " ".join(str(text).split())
+    return "".join(normalize_char(ch) for ch in text)
+
+def parse_quote(entry):
+    """Splits "Name: 'quote'" into (name, quote). name is None if the format wasn't followed."""
+    match = QUOTE_FORMAT.match(entry)
+    if match:
+        return match.group("name").strip(), match.group("quote")
+    return None, entry
+
+def clean_quote(quote):
+    # Models mark truncation with ellipses; match the part they kept
+    return normalize(quote).strip(" .…'\"").strip()
+
+class Automaton:
+    """Aho-Corasick automaton over a set of patterns."""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        self.lengths = []
+        for pattern_id, pattern in enumerate(patterns):
+            self.lengths.append(len(pattern))
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(pattern_id)
+
+        # Breadth-first pass to fill failure links and merge outputs
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def scan(self, text, start=0, end=None):
+        """Yields (pattern_id, end_index) for every match in text[start:end]."""
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for i in range(start, len(text) if end is None else end):
+            ch = text[i]
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern_id in out[state]:
+                yield pattern_id, i
+
+class QuoteIndex:
+    """Normalized, position-mapped copy of every answer in a corpus."""
+
+    def __init__(self, corpus):
+        self.segments = []
+        self.starts = []
+        self.positions = []
+        self.student_ranges = {}
+        parts = []
+        cursor = 0
+        for student in corpus.students:
+            first = len(self.segments)
+            for question, answer in enumerate(corpus.answers[student]):
+                normalized, positions = self._normalize_with_positions(str(answer))
+                self.segments.append((student, question))
+                self.starts.append(cursor)
+                self.positions.append(positions)
+                parts.append(normalized + SEPARATOR)
+                cursor += len(normalized) + 1
+            self.student_ranges[student] = (first, len(self.segments))
+        self.text = "".join(parts)
+
+    @staticmethod
+    def _normalize_with_positions(text):
+        chars = []
+        positions = array("I")
+        pending_space = False
+        for offset, ch in enumerate(text):
+            if ch.isspace():
+                pending_space = bool(chars)
+                continue
+            if pending_space:
+                chars.append(" ")
+                positions.append(offset - 1)
+                pending_space = False
+            chars.append(normalize_char(ch))
+            positions.append(offset)
+        return "".join(chars), positions
+
+    def _span(self, pattern_end, length):
+        segment = bisect_right(self.starts, pattern_end) - 1
+        base = self.starts[segment]
+        positions = self.positions[segment]
+        start = positions[pattern_end - length + 1 - base]
+        end = positions[pattern_end - base] + 1
+        student, question = self.segments[segment]
+        return {"student": student, "question": question, "offset": start, "length": end - start}
+
+    def locate(self, entries, students=None):
+        """Finds each entry in the source text in one scan.
+
+        Returns a list parallel to entries holding a span dict
+        (student, question, offset, length) or None if the quote was not
+        found. `students` limits the scan to those students' answers.
+        """
+        parsed = [parse_quote(entry) for entry in entries]
+        patterns = {}
+        for name, quote in parsed:
+            cleaned = clean_quote(quote)
+            if len(cleaned) >= MIN_QUOTE_CHARS:
+                patterns.setdefault(cleaned, len(patterns))
+
+        hits = [[] for _ in patterns]
+        if patterns:
+            automaton = Automaton(list(patterns))
+            if students is None:
+                ranges = [(0, len(self.text))]
+            else:
+                ranges = []
+                for student in students:
+                    if student in self.student_ranges:
+                        first, last = self.student_ranges[student]
+                        end = self.starts[last] if last < len(self.starts) else len(self.text)
+                        ranges.append((self.starts[first], end))
+            for start, end in ranges:
+                for pattern_id, pattern_end in automaton.scan(self.text, start, end):
+                    if len(hits[pattern_id]) < MAX_HITS:
+                        hits[pattern_id].append(pattern_end)
+
+        spans = []
+        for name, quote in parsed:
+            pattern_id = patterns.get(clean_quote(quote))
+            if pattern_id is None or not hits[pattern_id]:
+                spans.append(None)
+                continue
+            length = automaton.lengths[pattern_id]
+            candidates = [self._span(end, length) for end in hits[pattern_id]]
+            # Prefer an occurrence in the answers of the student the model named
+            claimed = [span for span in candidates if name is not None and str(span["student"]) == name]
+            spans.append((claimed or candidates)[0])
+        return spans
+
+def verify_result(result, index, students=None, drop=True):
+    """Checks every quote in an analysis result against the source text.
+
+    Returns a copy with `quote_spans`, parallel to each code's quote list,
+    holding the located span of every quote (None if it was not found), and
+    `unverified_quotes` listing the quotes not found in the text. With
+    drop=True unverified quotes are removed from the code lists; otherwise
+    they stay in place and are only flagged.
+    """
+    if not isinstance(result, dict) or "error" in result.get("predetermined_codes", {}):
+        return result
+
+    entries = []
+    for section, codes in SECTIONS:
+        for code in codes:
+            for quote in result.get(section, {}).get(code, []):
+                if quote != NO_QUOTE:
+                    entries.append((section, code, quote))
+    spans = index.locate([quote for _, _, quote in entries], students)
+
+    verified = {key: value for key, value in result.items()}
+    for section, codes in SECTIONS:
+        verified[section] = {code: [] for code in codes}
+    verified["quote_spans"] = {}
+    verified["unverified_quotes"] = {}
+    for (section, code, quote), span in zip(entries, spans):
+        if span is None:
+            verified["unverified_quotes"].setdefault(code, []).append(quote)
+            if drop:
+                continue
+        verified["quote_spans"].setdefault(code, []).append(span)
+        verified[section][code].append(quote)
+
+    for section, codes in SECTIONS:
+        for code in codes:
+            if not verified[section][code]:
+                verified[section][code] = [NO_QUOTE]
+    return verified